@@ -0,0 +1,212 @@
+from __future__ import division, print_function
+import json
+import time
+from collections import deque, namedtuple
+
+import engine
+
+"""
+Live measurement broadcaster for Simple Survey
+
+Broadcaster sends every fix and point, as the same JSON records the
+headless mode writes, to any number of other devices on the local
+network: tablets or a pole-mounted display.  Each record is serialised
+once and then fanned out:
+
+* over WebSocket, so a browser page can show it: every client gets its
+  own bounded queue, and only a little is handed to its socket at a
+  time, so a slow or stalled client drops its own oldest records rather
+  than holding up the others or using up memory;
+* over UDP multicast, one datagram per record for any number of
+  listeners, with nothing kept per listener.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, Slot
+
+DEFAULT_PORT = 8765
+DEFAULT_MULTICAST = ('239.255.43.21', 5010)
+
+# records kept for each WebSocket client before its oldest are dropped
+QUEUE_LENGTH = 64
+
+# bytes handed to a client's socket at a time
+MAX_BUFFERED = 64 * 1024
+
+# lag is seconds since the oldest record the client hasn't been sent
+ClientStatus = namedtuple('ClientStatus', ['name', 'queued', 'sent',
+                                           'dropped', 'lag', 'max_lag'])
+BroadcastStatus = namedtuple('BroadcastStatus', ['port', 'multicast',
+                                                 'records', 'clients',
+                                                 'error'])
+
+
+class Client(object):
+    """
+    One WebSocket client and the records waiting for it.
+    """
+    __slots__ = ('socket', 'name', 'pending', 'in_flight', 'sent', 'dropped',
+                 'max_lag', '__weakref__')
+
+    def __init__(self, socket):
+        self.socket = socket
+        self.name = '%s:%d' % (socket.peerAddress().toString(),
+                               socket.peerPort())
+        self.pending = deque()    # (message, time published)
+        self.in_flight = deque()  # time published, of messages not flushed
+        self.sent = 0
+        self.dropped = 0
+        self.max_lag = 0.0
+
+    def queue(self, message, now):
+        if len(self.pending) >= QUEUE_LENGTH:
+            self.pending.popleft()
+            self.dropped += 1
+        self.pending.append((message, now))
+        self.pump()
+
+    def pump(self, *args):
+        """
+        Hand the socket as much as it can take without buffering more
+        than MAX_BUFFERED.
+        """
+        socket = self.socket
+        if not socket.bytesToWrite():
+            self.in_flight.clear()
+        while self.pending and socket.bytesToWrite() < MAX_BUFFERED:
+            (message, published) = self.pending.popleft()
+            socket.sendTextMessage(message)
+            self.in_flight.append(published)
+            self.sent += 1
+
+    def lag(self, now):
+        if self.in_flight and self.socket.bytesToWrite():
+            oldest = self.in_flight[0]
+        elif self.pending:
+            oldest = self.pending[0][1]
+        else:
+            return 0.0
+        lag = now - oldest
+        self.max_lag = max(self.max_lag, lag)
+        return lag
+
+    def status(self, now):
+        return ClientStatus(self.name, len(self.pending), self.sent,
+                            self.dropped, self.lag(now), self.max_lag)
+
+
+class Broadcaster(QtCore.QObject):
+    """
+    Serves publish()ed snapshots on a WebSocket port (0 for none) and a
+    multicast (group, port) (None for none).
+    """
+
+    def __init__(self, port=DEFAULT_PORT, multicast=DEFAULT_MULTICAST,
+                 parent=None):
+        super(Broadcaster, self).__init__(parent)
+        from qt5pick import QtNetwork
+
+        self.port = port
+        self.multicast = multicast
+        self.records = 0
+        self.error = None
+        self.clients = []
+        self._fixes = 0
+        self._latest = None   # last fix record, for new clients
+
+        self.server = None
+        if port:
+            try:
+                from qt5pick import QtWebSockets
+            except ImportError:
+                self.error = 'QtWebSockets is not installed'
+                port = 0
+        if port:
+            self.server = QtWebSockets.QWebSocketServer(
+                'Simple Survey', QtWebSockets.QWebSocketServer.NonSecureMode,
+                self)
+            if self.server.listen(QtNetwork.QHostAddress.Any, port):
+                self.server.newConnection.connect(self._new_connection)
+            else:
+                self.error = 'Could not listen on port %d: %s' % (
+                             port, self.server.errorString())
+
+        self.udp = None
+        if multicast:
+            self.udp = QtNetwork.QUdpSocket(self)
+            # stay on the local network
+            self.udp.setSocketOption(
+                QtNetwork.QAbstractSocket.MulticastTtlOption, 1)
+            self._group = QtNetwork.QHostAddress(multicast[0])
+
+    def close(self):
+        for client in self.clients:
+            client.socket.close()
+        self.clients = []
+        if self.server:
+            self.server.close()
+        if self.udp:
+            self.udp.close()
+
+    def publish(self, snapshot):
+        """
+        Send anything new in snapshot to every client.
+        """
+        records = engine.snapshot_records(snapshot, self._fixes)
+        self._fixes = snapshot.fixes
+        if not records:
+            return
+
+        now = time.monotonic()
+        for record in records:
+            # serialised once, whatever the number of clients
+            message = json.dumps(record, sort_keys=True)
+            if 'event' not in record:
+                self._latest = message
+            for client in self.clients:
+                client.queue(message, now)
+            if self.udp:
+                self.udp.writeDatagram(message.encode('utf-8'), self._group,
+                                       self.multicast[1])
+            self.records += 1
+
+    def status(self):
+        now = time.monotonic()
+        return BroadcastStatus(self.port if self.server else None,
+                               self.multicast, self.records,
+                               [client.status(now) for client in self.clients],
+                               self.error)
+
+    @Slot()
+    def _new_connection(self):
+        while self.server.hasPendingConnections():
+            socket = self.server.nextPendingConnection()
+            client = Client(socket)
+            socket.bytesWritten.connect(client.pump)
+            socket.disconnected.connect(lambda client=client:
+                                        self._disconnected(client))
+            self.clients.append(client)
+            if self._latest:
+                # so a new display has something to show straight away
+                client.queue(self._latest, time.monotonic())
+
+    def _disconnected(self, client):
+        if client in self.clients:
+            self.clients.remove(client)
+        client.socket.deleteLater()
+
+
+def parse_multicast(text):
+    """
+    'group:port' as a (group, port) tuple, or None for 'off' or nothing.
+    """
+    if not text or text == 'off':
+        return None
+    (group, _, port) = text.rpartition(':')
+    if not group:
+        raise ValueError('expected GROUP:PORT: %s' % text)
+    return (group, int(port))
@@ -0,0 +1,139 @@
+from __future__ import division, print_function
+
+"""
+Coalesced widget updates for Simple Survey
+
+Receivers can send 20-50 fixes a second, far faster than anyone can read
+them, and every QLineEdit.setText() costs a relayout.  CoalescedDisplay
+remembers the last string shown in each widget and only calls setText()
+when it actually changed.  SimpleSurveyGui only formats the latest fix on
+a repaint timer, so together widgets are touched at most once per tick.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# default repaint rate in Hz
+DEFAULT_RATE = 10
+
+
+class CoalescedDisplay(object):
+    """
+    Dirty-checking front end for anything with setText().
+
+    updates counts the setText() calls that went through and skipped the
+    ones that didn't need to.  fixes and refreshes are counted by whoever
+    drives it, so the savings can be reported.
+    """
+
+    def __init__(self):
+        self._shown = {}
+        self.fixes = 0       # fixes received
+        self.refreshes = 0   # repaint ticks that had something new
+        self.updates = 0     # setText calls made
+        self.skipped = 0     # setText calls avoided
+
+    def set_text(self, widget, text):
+        if self._shown.get(widget) == text:
+            self.skipped += 1
+            return
+        self._shown[widget] = text
+        widget.setText(text)
+        self.updates += 1
+
+    def clear(self, *widgets):
+        for widget in widgets:
+            self.set_text(widget, '')
+
+    def stats(self):
+        return {
+            'fixes': self.fixes,
+            'refreshes': self.refreshes,
+            'updates': self.updates,
+            'skipped': self.skipped,
+        }
+
+
+def format_measurement(measurement, units):
+    """
+    Format a survey.Measurement with the given units formatter.  Returns
+    (northing, easting, bearing, distance, elevation, slope) strings,
+    empty where there's nothing to show.
+    """
+    length = units.length
+
+    if measurement.northing < 0:
+        northing = '%s South' % length(-measurement.northing)
+    else:
+        northing = '%s North' % length(measurement.northing)
+
+    if measurement.easting < 0:
+        easting = '%s West' % length(-measurement.easting)
+    else:
+        easting = '%s East' % length(measurement.easting)
+
+    if measurement.elevation is not None:
+        elevation = units.height(measurement.elevation)
+    else:
+        elevation = ''
+
+    if measurement.slope is not None:
+        slope = u"{:.1%} or {:.1f}\u00b0".format(measurement.slope,
+                                                 measurement.slope_angle)
+    else:
+        slope = ''
+
+    return (northing, easting, u'%.1f\u00b0' % measurement.bearing,
+            length(measurement.distance), elevation, slope)
+
+
+class _CountingWidget(object):
+    calls = 0
+
+    def setText(self, text):
+        _CountingWidget.calls += 1
+
+
+if __name__ == "__main__":
+    # simulate a minute of a 50 Hz receiver with 18 fields, comparing
+    # setText on every fix against a 10 Hz dirty-checked repaint
+    import random
+    import time
+
+    random.seed(1)
+    rate = 50
+    seconds = 60
+    widgets = [_CountingWidget() for x in range(18)]
+    values = [0.0] * len(widgets)
+    frames = []
+    for i in range(rate * seconds):
+        # most fields barely move between fixes, like a pole held still
+        values = [v + random.gauss(0, 0.0005) for v in values]
+        frames.append(['%.3f m' % v for v in values])
+
+    t = time.perf_counter()
+    for frame in frames:
+        for (widget, text) in zip(widgets, frame):
+            widget.setText(text)
+    naive = time.perf_counter() - t
+    naive_calls = _CountingWidget.calls
+
+    _CountingWidget.calls = 0
+    display = CoalescedDisplay()
+    step = rate // DEFAULT_RATE
+    t = time.perf_counter()
+    for (i, frame) in enumerate(frames):
+        display.fixes += 1
+        if i % step == 0:
+            display.refreshes += 1
+            for (widget, text) in zip(widgets, frame):
+                display.set_text(widget, text)
+    coalesced = time.perf_counter() - t
+
+    print('every fix:   %7d setText calls, %.1f ms' % (naive_calls,
+                                                       naive * 1000))
+    print('coalesced:   %7d setText calls, %.1f ms' % (_CountingWidget.calls,
+                                                      coalesced * 1000))
+    print(display.stats())
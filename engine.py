@@ -0,0 +1,615 @@
+from __future__ import division, print_function
+import time
+from functools import reduce
+from collections import namedtuple
+
+import numpy
+
+import nmea
+import projection
+import survey
+import track
+import stakeout
+import tin
+
+"""
+Survey engine for Simple Survey
+
+Holds the survey state (start, mark and reference points, occupations)
+and turns each fix into a Snapshot of everything the display needs.  It
+knows nothing about Qt, so it can run on a worker thread or without a
+GUI at all.
+
+Fixes can come from several receivers, told apart by Fix.source.  The
+latest position of each is kept in numpy arrays, so measuring all of
+them from the start point is one vectorised pass however many there
+are.  Either one primary receiver drives the display, or the positions
+of every receiver heard from recently are averaged.  Every fix that
+drives the display is kept in a track.Track, and every point set
+with an elevation goes into a tin.Surface for cut and fill.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# names of the start and mark reference points
+START = 'Start'
+MARK = 'Mark'
+
+# source name of averaged fixes
+MERGED = 'merged'
+
+# receivers heard from within this many seconds go into the average
+MERGE_WINDOW = 2.0
+
+# a point that was just set; whoever consumes snapshots records these.
+# kind is 'start', 'mark', 'reference' or 'stake', the last being where
+# a design point was staked out.  projector is the grid the
+# northing and easting are on.
+PointEvent = namedtuple('PointEvent', ['kind', 'name', 'northing', 'easting',
+                                       'altitude', 'latitude', 'longitude',
+                                       'quality', 'projector'])
+
+# what's new in the track since the last snapshot, for a plan view, all
+# on the track's own grid (track.Track.projector) centred on origin, a
+# (lat, lon) tuple.  clear is True when the track has started again.
+# levels has a (northings, eastings) tuple of new rows, or None, for
+# each of the track's levels of detail, whose tolerances in metres are
+# in tolerances.  position is the latest
+# (northing, easting).  references is None if they haven't changed
+# since, or a (names, northings, eastings) tuple of every one.
+TrackUpdate = namedtuple('TrackUpdate', ['origin', 'clear', 'tolerances',
+                                         'levels', 'position', 'references'])
+
+# progress of an occupation; target is START or MARK.  done is True on
+# the one snapshot after it finished.
+OccupationStatus = namedtuple('OccupationStatus', ['target', 'count', 'std',
+                                                   'done'])
+
+
+class Snapshot(object):
+    """
+    Everything computed from the latest fix.  northing, easting and
+    measurements are None until there's a start point.  events lists
+    the PointEvents since the last snapshot.  fixes counts the fixes
+    seen so far.  receivers names every receiver heard from, and with
+    more than one, sources measures each one's latest position from the
+    start point.  track is a TrackUpdate, or None before any fix.
+    stakeout is a stakeout.StakeoutStatus while staking out, with no
+    name until there's a start point.  surface is the tin.SurfaceStatus
+    of the points set since the start point.  replay, recording, connections,
+    ntrip, broadcast and export are filled in by whoever runs the sources.
+    """
+    __slots__ = ('generation', 'fixes', 'fix', 'altitude', 'northing',
+                 'easting', 'measurements', 'occupation', 'events',
+                 'receivers', 'sources', 'track', 'stakeout', 'surface',
+                 'replay', 'recording', 'connections', 'ntrip', 'broadcast',
+                 'export')
+
+    def __init__(self, generation, fixes, fix, altitude, northing=None,
+                 easting=None, measurements=None, occupation=None, events=(),
+                 receivers=(), sources=None, track=None, stakeout=None,
+                 surface=None, replay=None, recording=None, connections=None,
+                 ntrip=None, broadcast=None, export=None):
+        self.generation = generation
+        self.fixes = fixes
+        self.fix = fix
+        self.altitude = altitude
+        self.northing = northing
+        self.easting = easting
+        self.measurements = measurements
+        self.occupation = occupation
+        self.events = events
+        self.receivers = receivers
+        self.sources = sources
+        self.track = track
+        self.stakeout = stakeout
+        self.surface = surface
+        self.replay = replay
+        self.recording = recording
+        self.connections = connections
+        self.ntrip = ntrip
+        self.broadcast = broadcast
+        self.export = export
+
+
+def merge_snapshots(older, newer):
+    """
+    When a newer snapshot replaces one that was never looked at, keep
+    the older one's events, finished occupation and track so nothing is
+    lost.
+    """
+    if older.events:
+        newer.events = list(older.events) + list(newer.events)
+    if older.occupation and older.occupation.done and \
+       older.generation == newer.generation and newer.occupation is None:
+        newer.occupation = older.occupation
+    if older.track and newer.track and not newer.track.clear:
+        newer.track = merge_track_updates(older.track, newer.track)
+    return newer
+
+
+def merge_track_updates(older, newer):
+    levels = []
+    for (old, new) in zip(older.levels, newer.levels):
+        if old is None or new is None:
+            levels.append(new if old is None else old)
+        else:
+            levels.append((numpy.concatenate((old[0], new[0])),
+                           numpy.concatenate((old[1], new[1]))))
+    references = newer.references
+    if references is None:
+        references = older.references
+    return TrackUpdate(newer.origin, older.clear, newer.tolerances,
+                       tuple(levels), newer.position, references)
+
+
+# what goes into each record from snapshot_records()
+MEASUREMENT_FIELDS = ('northing', 'easting', 'distance', 'bearing',
+                      'elevation', 'slope', 'slope_angle')
+FIX_FIELDS = ('time', 'date', 'latitude', 'longitude', 'altitude',
+              'heading', 'speed', 'quality', 'satellites', 'hdop',
+              'lat_sigma', 'lon_sigma', 'alt_sigma', 'source')
+
+
+def _measurement_records(measurements):
+    result = {}
+    for i in range(len(measurements)):
+        row = measurements.row(i)
+        result[measurements.names[i]] = dict(
+            (field, getattr(row, field)) for field in MEASUREMENT_FIELDS)
+    return result
+
+
+def snapshot_records(snapshot, last_fixes):
+    """
+    A snapshot as dicts ready for JSON, for the headless mode and the
+    broadcaster: any points set and the surface they've changed, then
+    the fix if it's newer than the last_fixes'th.
+    """
+    records = []
+    for event in snapshot.events:
+        records.append({'event': event.kind, 'name': event.name,
+                        'northing': event.northing, 'easting': event.easting,
+                        'altitude': event.altitude,
+                        'latitude': event.latitude,
+                        'longitude': event.longitude,
+                        'quality': event.quality})
+    if snapshot.events and snapshot.surface and snapshot.surface.triangles:
+        surface = snapshot.surface._asdict()
+        surface['plane'] = snapshot.surface.plane._asdict()
+        records.append({'surface': surface})
+
+    if snapshot.fix is not None and snapshot.fixes > last_fixes:
+        fix = snapshot.fix
+        record = dict((field, getattr(fix, field)) for field in FIX_FIELDS)
+        record['altitude'] = snapshot.altitude
+        if snapshot.northing is not None:
+            record['northing'] = snapshot.northing
+            record['easting'] = snapshot.easting
+            record['measurements'] = _measurement_records(
+                                         snapshot.measurements)
+        if snapshot.sources is not None:
+            record['receivers'] = _measurement_records(snapshot.sources)
+        if snapshot.stakeout is not None and snapshot.stakeout.name:
+            record['stakeout'] = snapshot.stakeout._asdict()
+        records.append(record)
+    return records
+
+
+class SurveyEngine(object):
+
+    def __init__(self, track_memory=track.TRACK_MEMORY):
+        self.fixes = 0
+        self.generation = 0
+        self.primary = None   #receiver driving the display, None to merge
+        self.track = track.Track(track_memory)
+        self.stakeout = None   #stakeout.Stakeout, kept across resets
+        self.design_plane = tin.FLAT   #kept across resets
+        self.reset()
+
+    def reset(self, generation=None):
+        """
+        Forget the last fix, the track and the start, mark and reference
+        points, as when switching sources.  Snapshots from now on carry
+        generation, so stale ones can be told apart.
+        """
+        if generation is not None:
+            self.generation = generation
+        self.fix = None
+        self.altitude = None
+        self.receivers = ()
+        self._receiver_index = {}
+        self._latitude = numpy.empty(0)
+        self._longitude = numpy.empty(0)
+        self._height = numpy.empty(0)
+        self._quality = numpy.empty(0)
+        self._heard = numpy.empty(0)
+        self.projector = None
+        self.references = survey.ReferenceSet()
+        self.surface = None
+        self.mark_count = 0
+        self.occupation = None
+        self.occupation_target = None
+        self._occupation_projector = None
+        self._occupation_quality = None
+        self._occupation_result = None
+        self._events = []
+        self.track.clear()
+        self._track_sent = [0] * len(self.track.levels)
+        self._references_changed = True
+
+    @property
+    def position(self):
+        if self.fix is None:
+            return None
+        return (self.fix.latitude, self.fix.longitude)
+
+    @property
+    def quality(self):
+        return self.fix.quality if self.fix else None
+
+    def _receiver(self, name):
+        i = self._receiver_index.get(name)
+        if i is None:
+            i = len(self.receivers)
+            self._receiver_index[name] = i
+            self.receivers = self.receivers + (name,)
+            self._latitude = numpy.append(self._latitude, numpy.nan)
+            self._longitude = numpy.append(self._longitude, numpy.nan)
+            self._height = numpy.append(self._height, numpy.nan)
+            self._quality = numpy.append(self._quality, numpy.nan)
+            self._heard = numpy.append(self._heard, -numpy.inf)
+        return i
+
+    def remove_receiver(self, name):
+        """
+        Forget a receiver that has been disconnected.
+        """
+        i = self._receiver_index.pop(name, None)
+        if i is None: return
+        self.receivers = self.receivers[:i] + self.receivers[i + 1:]
+        self._receiver_index = dict((n, j) for (j, n) in
+                                    enumerate(self.receivers))
+        for array in ('_latitude', '_longitude', '_height', '_quality',
+                      '_heard'):
+            setattr(self, array, numpy.delete(getattr(self, array), i))
+
+    def set_primary(self, name):
+        """
+        Let only the named receiver drive the display, or with None,
+        average every receiver.
+        """
+        self.primary = name
+
+    def _merge(self, fix, now):
+        fresh = self._heard >= now - MERGE_WINDOW
+        if numpy.count_nonzero(fresh) < 2:
+            return fix
+
+        heights = self._height[fresh]
+        heights = heights[~numpy.isnan(heights)]
+        qualities = self._quality[fresh]
+        qualities = qualities[~numpy.isnan(qualities)]
+        return nmea.Fix(fix.time, fix.date,
+                        float(self._latitude[fresh].mean()),
+                        float(self._longitude[fresh].mean()),
+                        float(heights.mean()) if len(heights) else None,
+                        fix.heading, fix.speed,
+                        reduce(nmea.worse_quality,
+                               [int(q) for q in qualities], None),
+                        source=MERGED)
+
+    def update(self, fix):
+        """
+        Take a new fix and return its Snapshot.
+        """
+        self.fixes += 1
+
+        i = self._receiver(fix.source)
+        self._latitude[i] = fix.latitude
+        self._longitude[i] = fix.longitude
+        self._height[i] = numpy.nan if fix.altitude is None else fix.altitude
+        self._quality[i] = numpy.nan if fix.quality is None else fix.quality
+        now = time.monotonic()
+        self._heard[i] = now
+        if len(self.receivers) > 1:
+            if self.primary is None or \
+               self.primary not in self._receiver_index:
+                fix = self._merge(fix, now)
+            elif fix.source != self.primary:
+                return self.snapshot()
+
+        if fix.altitude is not None:
+            self.altitude = fix.altitude
+        self.fix = fix
+        self.track.add(fix, self.altitude)
+
+        if self.projector:
+            self.references.fill_altitude(self.altitude)
+
+        if self.occupation:
+            self._occupy(fix)
+
+        return self.snapshot()
+
+    def snapshot(self):
+        """
+        Snapshot of the latest fix against the current state.
+        """
+        events = self._events
+        self._events = []
+        track = self._track_update(bool(events))
+        occupation = self._occupation_result
+        self._occupation_result = None
+        if self.occupation:
+            occupation = OccupationStatus(self.occupation_target,
+                                          self.occupation.count,
+                                          self.occupation.std, False)
+
+        fix = self.fix
+        if fix is None or not self.projector:
+            staking = None
+            if self.stakeout:
+                # waiting for a start point
+                staking = stakeout.StakeoutStatus(
+                    None, None, None, None, None, None, False,
+                    self.stakeout.remaining, len(self.stakeout))
+            return Snapshot(self.generation, self.fixes, fix, self.altitude,
+                            occupation=occupation, events=events,
+                            receivers=self.receivers, track=track,
+                            stakeout=staking, surface=self._surface_status())
+
+        # project once, then one vectorised pass against every reference
+        (northing, easting, _) = self.projector.forward(fix.latitude,
+                                                        fix.longitude)
+        measurements = self.references.measure(northing, easting,
+                                               self.altitude)
+        staking = None
+        if self.stakeout:
+            staking = self.stakeout.update(northing, easting,
+                                           self._elevation())
+        return Snapshot(self.generation, self.fixes, fix, self.altitude,
+                        northing, easting, measurements, occupation, events,
+                        self.receivers, self._measure_receivers(), track,
+                        staking, self._surface_status())
+
+    @property
+    def start_altitude(self):
+        """
+        The start point's altitude, or None.
+        """
+        if not self.projector:
+            return None
+        start = self.references.altitude[self.references.index(START)]
+        if start != start:
+            return None
+        return float(start)
+
+    def _elevation(self):
+        # height above the start point, or None
+        start = self.start_altitude
+        if self.altitude is None or start is None:
+            return None
+        return self.altitude - start
+
+    def _surface_status(self):
+        if self.surface is not None:
+            return self.surface.status()
+        return None
+
+    def _track_update(self, references_changed):
+        """
+        TrackUpdate of anything added to the track since the last one.
+        """
+        self._references_changed |= references_changed
+        track = self.track
+        if track.projector is None:
+            return None
+
+        clear = not self._track_sent[0]
+        if track.levels[0].total == self._track_sent[0]:
+            # the coarser levels only change when the finest does
+            levels = (None,) * len(track.levels)
+        else:
+            levels = []
+            for (i, ring) in enumerate(track.levels):
+                new = ring.total - self._track_sent[i]
+                if new:
+                    self._track_sent[i] = ring.total
+                    levels.append((ring.tail(new, 'northing'),
+                                   ring.tail(new, 'easting')))
+                else:
+                    levels.append(None)
+            levels = tuple(levels)
+
+        references = None
+        if self._references_changed:
+            self._references_changed = False
+            # the references are on the start point's grid
+            names = list(self.references.names)
+            northings = numpy.empty(len(names))
+            eastings = numpy.empty(len(names))
+            for i in range(len(names)):
+                (lat, lon, _) = self.projector.inverse(
+                                    self.references.northing[i],
+                                    self.references.easting[i])
+                (northings[i], eastings[i], _) = track.projector.forward(
+                                                     lat, lon)
+            references = (names, northings, eastings)
+
+        return TrackUpdate((track.projector.lat0, track.projector.lon0),
+                           clear, track.tolerances, levels, track.position,
+                           references)
+
+    def _measure_receivers(self):
+        if len(self.receivers) < 2:
+            return None
+        (northings, eastings, _) = self.projector.forward_many(
+                                       self._latitude, self._longitude)
+        start = self.references.index(START)
+        return survey.measure_many(self.receivers,
+                                   (self.references.northing[start],
+                                    self.references.easting[start]),
+                                   self.references.altitude[start],
+                                   northings, eastings, self._height)
+
+    def set_start(self, lat=None, lon=None, altitude=None, quality=None):
+        """
+        Start at the given position, or the current one.
+        """
+        if lat is None:
+            if self.fix is None: return
+            (lat, lon) = self.position
+            altitude = self.altitude
+            quality = self.quality
+
+        # everything that depends on the start point is worked out once
+        # here, so projecting each fix is cheap
+        self.projector = projection.LocalProjector(lat, lon)
+        self.references = survey.ReferenceSet()
+        self.references.add(START, 0.0, 0.0, altitude)
+        self.surface = tin.Surface(self.design_plane)
+        self._shoot(0.0, 0.0, altitude)
+        self.mark_count = 0
+        self._events.append(PointEvent('start', START, 0.0, 0.0, altitude,
+                                       lat, lon, quality, self.projector))
+
+    def set_mark(self, lat=None, lon=None, altitude=None, quality=None):
+        """
+        Mark the given position, or the current one.
+        """
+        if not self.projector: return
+        if lat is None:
+            if self.fix is None: return
+            (lat, lon) = self.position
+            altitude = self.altitude
+            quality = self.quality
+
+        (northing, easting, _) = self.projector.forward(lat, lon)
+        self.references.add(MARK, northing, easting, altitude)
+        self._shoot(northing, easting, altitude)
+        self.mark_count += 1
+        self._events.append(PointEvent('mark', 'Mark %d' % self.mark_count,
+                                       northing, easting, altitude, lat, lon,
+                                       quality, self.projector))
+
+    def add_reference(self, name):
+        """
+        Add the current position as a named reference point, like a
+        corner stake, to measure against along with start and mark.
+        """
+        if not self.projector or self.fix is None or name in (START, MARK):
+            return
+
+        (lat, lon) = self.position
+        (northing, easting, _) = self.projector.forward(lat, lon)
+        self.references.add(name, northing, easting, self.altitude)
+        self._shoot(northing, easting, self.altitude)
+        self._events.append(PointEvent('reference', name, northing, easting,
+                                       self.altitude, lat, lon, self.quality,
+                                       self.projector))
+
+    def set_stakeout(self, stakeout):
+        """
+        Stake out a stakeout.Stakeout's design points, or stop with None.
+        """
+        self.stakeout = stakeout
+
+    def stake(self):
+        """
+        Record the current position as the nearest design point still to
+        be staked, and move on to the next.
+        """
+        if not self.stakeout or not self.projector or self.fix is None:
+            return
+
+        (lat, lon) = self.position
+        (northing, easting, _) = self.projector.forward(lat, lon)
+        self.stakeout.update(northing, easting)
+        i = self.stakeout.stake()
+        if i is None: return
+        self._shoot(northing, easting, self.altitude)
+        self._events.append(PointEvent('stake', self.stakeout.names[i],
+                                       northing, easting, self.altitude, lat,
+                                       lon, self.quality, self.projector))
+
+    def set_design_plane(self, plane):
+        """
+        Work out cut and fill against a tin.DesignPlane.
+        """
+        self.design_plane = plane
+        if self.surface is not None:
+            self.surface.set_plane(plane)
+
+    def _shoot(self, northing, easting, altitude):
+        # add a point to the surface, as a height above the start point
+        start = self.start_altitude
+        if self.surface is None or altitude is None or start is None:
+            return
+        try:
+            self.surface.add(easting, northing, altitude - start)
+        except ValueError:
+            pass   # too far from the start point to be part of the work
+
+    def begin_occupation(self, target, epochs=None, seconds=None, sigma=None):
+        """
+        Start averaging fixes for the start or mark point.  See
+        survey.Occupation for when it stops by itself.
+        """
+        if self.fix is None: return
+        if target == START:
+            # average on a provisional grid centred here, then move the
+            # real one to the averaged position
+            projector = projection.LocalProjector(*self.position)
+        elif self.projector:
+            projector = self.projector
+        else:
+            return
+
+        self.occupation = survey.Occupation(epochs, seconds, sigma)
+        self.occupation_target = target
+        self._occupation_projector = projector
+        self._occupation_quality = None
+
+    def _occupy(self, fix):
+        (northing, easting, _) = self._occupation_projector.forward(
+                                     fix.latitude, fix.longitude)
+        # with the date, so an occupation can run past midnight
+        timestamp = track.timestamp(fix)
+        if timestamp != timestamp:
+            timestamp = time.monotonic()
+        elif fix.date is None and self.occupation.last is not None:
+            while timestamp < self.occupation.last - 43200:
+                timestamp += 86400
+        self.occupation.add(northing, easting, self.altitude, timestamp)
+        # keep the worst fix quality seen during the occupation
+        self._occupation_quality = nmea.worse_quality(
+            self._occupation_quality, fix.quality)
+
+        if self.occupation.done:
+            self.finish_occupation()
+
+    def finish_occupation(self):
+        """
+        Stop averaging and set the start or mark to the mean, returning
+        the finished survey.Occupation.
+        """
+        occupation = self.occupation
+        if occupation is None: return None
+        self.occupation = None
+        self._occupation_result = OccupationStatus(self.occupation_target,
+                                                   occupation.count,
+                                                   occupation.std, True)
+
+        if occupation.count:
+            (northing, easting, altitude) = occupation.mean
+            (lat, lon, _) = self._occupation_projector.inverse(northing,
+                                                               easting)
+            if self.occupation_target == START:
+                self.set_start(lat, lon, altitude, self._occupation_quality)
+            else:
+                self.set_mark(lat, lon, altitude, self._occupation_quality)
+        return occupation
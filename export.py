@@ -0,0 +1,470 @@
+from __future__ import division, print_function
+import os
+import json
+import time
+import sqlite3
+from collections import namedtuple
+
+import numpy
+
+"""
+Point and track export for Simple Survey
+
+Stored points and the walked track are written to CSV, GeoJSON or DXF
+with their coordinates both local (northing, easting and up from Start)
+and geographic (latitude, longitude and altitude).  Rows are read a
+chunk at a time, from an SQLite cursor or straight out of the track's
+ring, and each writer is a generator turning one chunk into one piece
+of text, so memory stays the same however long the track is.  An Export
+writes a piece at a time for as long as it's given, so the worker
+thread can run one in steps between fixes.
+
+The file is written under a .part name and renamed when it's complete.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# rows read and written at a time
+CHUNK_ROWS = 4096
+
+# how long Export.step() writes for before returning, in seconds
+STEP_SECONDS = 0.02
+
+FORMATS = ('csv', 'geojson', 'dxf')
+_EXTENSIONS = {'.csv': 'csv', '.txt': 'csv', '.geojson': 'geojson',
+               '.json': 'geojson', '.dxf': 'dxf'}
+
+# which coordinates GeoJSON and DXF geometry is in; CSV has both
+LOCAL = 'local'
+GEOGRAPHIC = 'geographic'
+COORDINATES = (LOCAL, GEOGRAPHIC)
+_AXES = {LOCAL: ('easting', 'northing', 'up'),
+         GEOGRAPHIC: ('longitude', 'latitude', 'altitude')}
+
+# northing, easting and up are metres from Start; altitude is as the
+# receiver gave it.  time is UTC seconds since 1970, or since midnight
+# for track fixes without a date.
+POINT_FIELDS = ('kind', 'name', 'northing', 'easting', 'up', 'latitude',
+                'longitude', 'altitude', 'quality', 'time')
+TRACK_FIELDS = ('time', 'northing', 'easting', 'up', 'latitude',
+                'longitude', 'altitude', 'quality')
+
+_NUMBER_FORMATS = {'northing': '%.4f', 'easting': '%.4f', 'up': '%.4f',
+                   'latitude': '%.9f', 'longitude': '%.9f',
+                   'altitude': '%.3f', 'time': '%.2f'}
+
+# DXF text height for point names, in drawing units
+_TEXT_HEIGHT = {LOCAL: 0.1, GEOGRAPHIC: 0.000001}
+
+# rows is how many have been written out of total
+ExportStatus = namedtuple('ExportStatus', ['path', 'what', 'rows', 'total',
+                                           'done'])
+
+
+def format_for(path):
+    """
+    The format for a file name's extension, or ValueError.
+    """
+    format = _EXTENSIONS.get(os.path.splitext(path)[1].lower())
+    if format is None:
+        raise ValueError('not a .csv, .geojson or .dxf file: %s' % path)
+    return format
+
+
+# sources: each yields chunks, dicts of a list per field
+
+def point_chunks(path, projector=None, start_altitude=None, session=None,
+                 size=CHUNK_ROWS):
+    """
+    Chunks of POINT_FIELDS from a pointstore.PointStore database, read
+    on a connection of its own.  Northing and easting are on
+    projector's grid, and up is above start_altitude; without a
+    projector they're on the grid of each point's own session and from
+    its start point.
+    """
+    db = sqlite3.connect(path)
+    try:
+        starts = dict(db.execute("SELECT session, altitude FROM points "
+                                 "WHERE kind = 'start' ORDER BY id"))
+        query = 'SELECT kind, name, northing, easting, altitude, latitude, ' \
+                'longitude, quality, time, session FROM points'
+        if session is None:
+            cursor = db.execute(query + ' ORDER BY id')
+        else:
+            cursor = db.execute(query + ' WHERE session = ? ORDER BY id',
+                                (session,))
+        while True:
+            rows = cursor.fetchmany(size)
+            if not rows:
+                break
+            (kinds, names, northings, eastings, altitudes, latitudes,
+             longitudes, qualities, times, sessions) = zip(*rows)
+            if projector is not None:
+                (northings, eastings, _) = projector.forward_many(latitudes,
+                                                                  longitudes)
+                northings = list(northings)
+                eastings = list(eastings)
+                ups = [_above(altitude, start_altitude)
+                       for altitude in altitudes]
+            else:
+                ups = [_above(altitude, starts.get(session))
+                       for (altitude, session) in zip(altitudes, sessions)]
+            yield {'kind': kinds, 'name': names, 'northing': northings,
+                   'easting': eastings, 'up': ups, 'latitude': latitudes,
+                   'longitude': longitudes, 'altitude': altitudes,
+                   'quality': qualities, 'time': times}
+    finally:
+        db.close()
+
+
+def count_points(path, session=None):
+    db = sqlite3.connect(path)
+    try:
+        if session is None:
+            (count,) = db.execute('SELECT COUNT(*) FROM points').fetchone()
+        else:
+            (count,) = db.execute('SELECT COUNT(*) FROM points WHERE '
+                                  'session = ?', (session,)).fetchone()
+    finally:
+        db.close()
+    return count
+
+
+def _above(altitude, start):
+    if altitude is None or start is None or start != start:
+        return None
+    return altitude - start
+
+
+def track_chunks(ring, grid, start, stop, projector=None,
+                 start_altitude=None, size=CHUNK_ROWS):
+    """
+    Chunks of TRACK_FIELDS for rows start to stop of a track.Ring, whose
+    northings and eastings are on grid.  They're moved onto projector's
+    grid, with up above start_altitude; without a projector they stay
+    on the track's own grid, centred on its first fix, and up is left
+    out.  Rows overwritten before they're read are skipped.
+    """
+    while start < stop:
+        (first, (times, northings, eastings, altitudes, qualities)) = \
+            ring.rows(start, min(start + size, stop))
+        if not len(times):
+            break
+        start = first + len(times)
+
+        (latitudes, longitudes, _) = grid.inverse_many(northings, eastings)
+        if projector is not None:
+            (northings, eastings, _) = projector.forward_many(latitudes,
+                                                              longitudes)
+            if start_altitude is None:
+                ups = numpy.full(len(times), numpy.nan)
+            else:
+                ups = altitudes - start_altitude
+        else:
+            ups = numpy.full(len(times), numpy.nan)
+        yield {'time': times.tolist(), 'northing': northings.tolist(),
+               'easting': eastings.tolist(), 'up': ups.tolist(),
+               'latitude': latitudes.tolist(),
+               'longitude': longitudes.tolist(),
+               'altitude': altitudes.tolist(),
+               'quality': qualities.tolist()}
+
+
+# writers: each takes chunks and yields a piece of text per chunk
+
+def _column(values, field):
+    # a chunk's values as text, blank where missing
+    if field == 'quality':
+        return ['' if v is None or v < 0 else '%d' % v for v in values]
+    fmt = _NUMBER_FORMATS.get(field)
+    if fmt is None:
+        return ['' if v is None else str(v) for v in values]
+    return [fmt % v if v is not None and v == v else '' for v in values]
+
+
+def _json_column(values, field):
+    if field in _NUMBER_FORMATS or field == 'quality':
+        return [text or 'null' for text in _column(values, field)]
+    return [json.dumps(v) for v in values]
+
+
+def _csv_field(text):
+    if ',' in text or '"' in text or '\n' in text or '\r' in text:
+        return '"%s"' % text.replace('"', '""')
+    return text
+
+
+def csv_text(chunks, fields, line=False, coordinates=None):
+    """
+    A header, then a line per row.  Only names and kinds can need
+    quoting, so the numbers are joined as they are.
+    """
+    yield ','.join(fields) + '\n'
+    for chunk in chunks:
+        columns = []
+        for field in fields:
+            column = _column(chunk[field], field)
+            if field not in _NUMBER_FORMATS and field != 'quality':
+                column = [_csv_field(text) for text in column]
+            columns.append(column)
+        yield '\n'.join(map(','.join, zip(*columns))) + '\n'
+
+
+def _positions(chunk, coordinates):
+    (x, y, z) = _AXES[coordinates]
+    positions = []
+    for (px, py, pz) in zip(_column(chunk[x], x), _column(chunk[y], y),
+                            _column(chunk[z], z)):
+        if not px or not py:
+            positions.append(None)
+        elif pz:
+            positions.append('[%s, %s, %s]' % (px, py, pz))
+        else:
+            positions.append('[%s, %s]' % (px, py))
+    return positions
+
+
+def geojson_text(chunks, fields, line=False, coordinates=GEOGRAPHIC):
+    """
+    A FeatureCollection of a Point for each row, or of one LineString.
+    Geographic coordinates are as GeoJSON expects; local ones need
+    whatever reads them to be told.  The other fields are properties
+    of each Point; a LineString gets its first and last time and how
+    many fixes it has.
+    """
+    yield '{"type": "FeatureCollection", "features": ['
+    if line:
+        yield '\n{"type": "Feature", "geometry": {"type": "LineString", ' \
+              '"coordinates": ['
+    properties = [field for field in fields
+                  if field not in _AXES[coordinates]]
+    names = ['"%s": ' % field for field in properties]
+    separator = '\n'
+    count = 0
+    times = [None, None]
+    for chunk in chunks:
+        positions = _positions(chunk, coordinates)
+        if line:
+            positions = [p for p in positions if p]
+            if not positions:
+                continue
+            count += len(positions)
+            valid = [t for t in chunk['time'] if t == t]
+            if valid:
+                if times[0] is None:
+                    times[0] = valid[0]
+                times[1] = valid[-1]
+            yield separator + ',\n'.join(positions)
+        else:
+            columns = [_json_column(chunk[field], field)
+                       for field in properties]
+            features = []
+            for (position, values) in zip(positions, zip(*columns)):
+                if position is None:
+                    continue
+                features.append(
+                    '{"type": "Feature", "geometry": {"type": "Point", '
+                    '"coordinates": %s}, "properties": {%s}}' % (
+                        position, ', '.join(name + value for (name, value)
+                                            in zip(names, values))))
+            if not features:
+                continue
+            yield separator + ',\n'.join(features)
+        separator = ',\n'
+
+    if line:
+        yield '\n]}, "properties": %s}' % json.dumps(
+                  {'fixes': count, 'start': times[0], 'end': times[1]})
+    yield '\n]}\n'
+
+
+def dxf_text(chunks, fields, line=False, coordinates=LOCAL):
+    """
+    An ASCII DXF ENTITIES section: a POINT and a TEXT of its name for
+    each row, or one 3D POLYLINE.  x is easting or longitude and y
+    northing or latitude.  stakeout.read_dxf() reads the points back.
+    """
+    yield '0\nSECTION\n2\nENTITIES\n'
+    if line:
+        yield ('0\nPOLYLINE\n8\nTRACK\n66\n1\n'
+               '10\n0.0\n20\n0.0\n30\n0.0\n70\n8\n')
+    (x, y, z) = _AXES[coordinates]
+    height = _TEXT_HEIGHT[coordinates]
+    for chunk in chunks:
+        pieces = []
+        xs = _column(chunk[x], x)
+        ys = _column(chunk[y], y)
+        zs = _column(chunk[z], z)
+        if line:
+            for (px, py, pz) in zip(xs, ys, zs):
+                if px and py:
+                    pieces.append('0\nVERTEX\n8\nTRACK\n10\n%s\n20\n%s\n'
+                                  '30\n%s\n70\n32\n' % (px, py, pz or '0'))
+        else:
+            for (px, py, pz, name) in zip(xs, ys, zs, chunk['name']):
+                if not px or not py:
+                    continue
+                pieces.append('0\nPOINT\n8\nPOINTS\n10\n%s\n20\n%s\n30\n%s\n'
+                              % (px, py, pz or '0'))
+                if name:
+                    pieces.append('0\nTEXT\n8\nNAMES\n10\n%s\n20\n%s\n30\n%s\n'
+                                  '40\n%g\n1\n%s\n' % (
+                                      px, py, pz or '0', height,
+                                      ' '.join(name.splitlines())))
+        yield ''.join(pieces)
+    if line:
+        yield '0\nSEQEND\n8\nTRACK\n'
+    yield '0\nENDSEC\n0\nEOF\n'
+
+
+WRITERS = {'csv': csv_text, 'geojson': geojson_text, 'dxf': dxf_text}
+
+
+class Export(object):
+    """
+    Writes the chunks for what ('points' or 'track') to path in format,
+    or the one its extension says.  total is how many rows are coming,
+    for progress.  Call step() until done, or run().
+    """
+
+    def __init__(self, path, what, chunks, fields, total, format=None,
+                 coordinates=LOCAL, line=False):
+        if format is None:
+            format = format_for(path)
+        if format not in WRITERS:
+            raise ValueError('unknown export format %s' % format)
+        if coordinates not in COORDINATES:
+            raise ValueError('unknown coordinates %s' % coordinates)
+        self.path = path
+        self.what = what
+        self.total = total
+        self.rows = 0
+        self.done = False
+        self.finished = None   # time.monotonic() when done
+        self._pieces = WRITERS[format](self._counted(chunks, fields[0]),
+                                       fields, line, coordinates)
+        self._part = path + '.part'
+        self._file = open(self._part, 'w', newline='')
+
+    def _counted(self, chunks, field):
+        for chunk in chunks:
+            yield chunk
+            self.rows += len(chunk[field])
+
+    def status(self):
+        return ExportStatus(self.path, self.what, self.rows, self.total,
+                            self.done)
+
+    def step(self, seconds=STEP_SECONDS):
+        """
+        Write for about seconds.  Returns True once it's all written.
+        Raises EnvironmentError, or sqlite3.Error if the points can't be
+        read, having given up.
+        """
+        if self.done:
+            return True
+        end = time.monotonic() + seconds
+        try:
+            for piece in self._pieces:
+                self._file.write(piece)
+                if time.monotonic() >= end:
+                    return False
+            self._file.close()
+            os.replace(self._part, self.path)
+        except (EnvironmentError, sqlite3.Error):
+            self.cancel()
+            raise
+        self.done = True
+        self.finished = time.monotonic()
+        return True
+
+    def run(self):
+        while not self.step(1.0):
+            pass
+
+    def cancel(self):
+        """
+        Stop, leaving no file behind.
+        """
+        if self.done:
+            return
+        self._pieces.close()
+        self._file.close()
+        try:
+            os.remove(self._part)
+        except EnvironmentError:
+            pass
+        self.done = True
+
+
+def export_points(path, db_path, format=None, coordinates=LOCAL,
+                  projector=None, start_altitude=None, session=None):
+    """
+    Export the points stored in the point store at db_path; see
+    point_chunks().
+    """
+    return Export(path, 'points',
+                  point_chunks(db_path, projector, start_altitude, session),
+                  POINT_FIELDS, count_points(db_path, session), format,
+                  coordinates)
+
+
+def export_track(path, ring, grid, format=None, coordinates=LOCAL,
+                 projector=None, start_altitude=None):
+    """
+    Export the rows in a track.Ring now; see track_chunks().  Rows added
+    while it's being written are left for the next export.
+    """
+    return Export(path, 'track',
+                  track_chunks(ring, grid, ring.total - len(ring), ring.total,
+                               projector, start_altitude),
+                  TRACK_FIELDS, len(ring), format, coordinates, line=True)
+
+
+if __name__ == "__main__":
+    # export a simulated two hour 20 Hz track to each format: the time
+    # taken, then the peak memory on a second run
+    import sys
+    import tempfile
+    import tracemalloc
+
+    import projection
+    import track
+
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 2
+    count = int(hours * 3600 * 20)
+    grid = projection.LocalProjector(40.0, -111.0)
+    ring = track.Ring(count)
+    t = numpy.arange(count) / 20.0
+    for row in zip(t + 1.5e9, 100 * numpy.sin(t / 600),
+                   100 * numpy.cos(t / 700), 1400 + numpy.sin(t / 60),
+                   numpy.full(count, 4)):
+        ring.append(row)
+    del t
+    print('%d fixes, %.0f MB in the ring' % (len(ring), ring.nbytes / 1e6))
+
+    directory = tempfile.mkdtemp()
+    start = projection.LocalProjector(40.0005, -111.0005)
+    for format in FORMATS:
+        path = os.path.join(directory, 'track.' + format)
+        began = time.perf_counter()
+        job = export_track(path, ring, grid, projector=start,
+                           start_altitude=1400.0)
+        steps = 1
+        while not job.step():
+            steps += 1
+        elapsed = time.perf_counter() - began
+
+        tracemalloc.start()
+        export_track(path, ring, grid, projector=start,
+                     start_altitude=1400.0).run()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        print('%-8s %.1f s, %.0f fixes/s, %.0f MB file, %.1f MB peak, '
+              '%d steps' % (format, elapsed, job.rows / elapsed,
+                            os.path.getsize(path) / 1e6, peak / 1e6, steps))
+        os.remove(path)
+    os.rmdir(directory)
@@ -0,0 +1,320 @@
+#!/usr/bin/env python3
+from __future__ import division, print_function
+import sys
+import json
+import argparse
+import threading
+
+import engine
+import worker
+import broadcast
+import stakeout
+import tin
+import export
+
+"""
+Headless Simple Survey
+
+Runs the survey engine without a window and writes a JSON object per
+line to stdout (or --output): one for every fix, at the receiver's full
+rate, with its position relative to the start, mark and any other
+reference points, plus one for every point set, the cut and fill of the
+surface the points make (against --grade) and every change in a TCP
+connection's state.  --track writes the walked track out as CSV,
+GeoJSON or DXF when it finishes.  --broadcast and --multicast send the
+same records to other devices, as the window can.  Nothing from
+QtWidgets is loaded, so it starts quickly and runs on a computer
+without a display.
+
+    python3 headless.py --serial /dev/ttyUSB0 --baud 115200 --start here
+    python3 headless.py --tcp 192.168.1.10:9999 --start 40.1,-111.5,1400
+    python3 headless.py --log day1.nmea --speed 0 --start here > day1.jsonl
+
+Commands can also be typed (or piped) on stdin, one per line:
+
+    start [LAT LON [ALTITUDE]]    set the start point, here if no position
+    mark [LAT LON [ALTITUDE]]     set the mark
+    reference NAME                add a named reference point here
+    design FILE                   stake out the design points in FILE
+    staked                        record this position as the target point
+    grade ELEVATION [SLOPE BEARING]
+                                  work out cut and fill against this grade
+    track FILE [local|geographic] export the track so far
+    primary NAME                  follow one receiver (or "merged")
+    reset                         forget every point
+    quit
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, Signal
+
+class JsonLinesOutput(object):
+    """
+    Takes the worker's snapshots in place of its LatestQueue, so every
+    one is written out rather than only the latest.  on_snapshot, if
+    given, is called with each snapshot once it's written.
+    """
+
+    def __init__(self, stream, on_snapshot=None):
+        self.stream = stream
+        self.on_snapshot = on_snapshot
+        self.fixes = 0
+        self.lines = 0
+        self._connections = {}
+
+    def put(self, snapshot):
+        lines = [json.dumps(record, sort_keys=True) for record in
+                 engine.snapshot_records(snapshot, self.fixes)]
+        self.fixes = snapshot.fixes
+
+        for (name, status) in snapshot.connections or ():
+            if self._connections.get(name) != status.state:
+                self._connections[name] = status.state
+                lines.append(json.dumps({'connection': name,
+                                         'state': status.state,
+                                         'error': status.error},
+                                        sort_keys=True))
+
+        if lines:
+            self.write(lines)
+        if self.on_snapshot:
+            self.on_snapshot(snapshot)
+
+    def write(self, lines):
+        self.stream.write('\n'.join(lines) + '\n')
+        self.stream.flush()
+        self.lines += len(lines)
+
+    def error(self, message):
+        self.write([json.dumps({'error': message})])
+
+
+class StdinCommands(QtCore.QObject):
+    """
+    Reads command lines from stdin in a thread and hands them to the
+    main thread as lineRead signals.
+    """
+
+    lineRead = Signal(str)
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='stdin commands')
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        for line in sys.stdin:
+            if line.strip():
+                self.lineRead.emit(line.strip())
+
+
+def _position(text):
+    """
+    LAT,LON[,ALTITUDE] as a tuple of floats.
+    """
+    values = [float(v) for v in text.replace(',', ' ').split()]
+    if len(values) not in (2, 3):
+        raise ValueError('expected LAT,LON[,ALTITUDE]: %s' % text)
+    return tuple(values)
+
+
+def _host_port(text):
+    (host, _, port) = text.rpartition(':')
+    if not host:
+        raise argparse.ArgumentTypeError('expected HOST:PORT: %s' % text)
+    return (host, int(port))
+
+
+class Headless(QtCore.QObject):
+    """
+    Drives a SurveyWorker from the command line arguments and stdin.
+    """
+
+    def __init__(self, args, stream, parent=None):
+        super(Headless, self).__init__(parent)
+        self.args = args
+        self.output = JsonLinesOutput(stream, self._snapshot)
+        self.worker = worker.SurveyWorker(self, self.output)
+        self.worker.sourceError.connect(
+            lambda title, message, last: self.output.error(message))
+        self.worker.recorderError.connect(self.output.error)
+        self.worker.stakeoutError.connect(self.output.error)
+        self.worker.exportError.connect(self.output.error)
+        self._start_here = False
+        self._mark_here = False
+        self._quitting = False
+
+    def start(self):
+        args = self.args
+        attach = False
+        for path in args.serial:
+            self.worker.open_serial(path, args.baud, attach)
+            attach = True
+        for (host, port) in args.tcp:
+            self.worker.open_tcp(host, port, attach)
+            attach = True
+        for filename in args.log:
+            self.worker.open_log(filename, args.speed, attach)
+            attach = True
+        if args.record:
+            self.worker.set_recording({'directory': args.record})
+        if args.design:
+            self.worker.load_design(args.design, args.tolerance)
+        self.worker.set_design_plane(*args.grade)
+        if args.broadcast or args.multicast:
+            self.worker.set_broadcast({'port': args.broadcast,
+                                       'multicast': args.multicast})
+
+        if args.start == 'here':
+            self._start_here = True
+        elif args.start:
+            self.worker.set_start(*_position(args.start))
+        if args.mark == 'here':
+            self._mark_here = True
+        elif args.mark:
+            self.worker.set_mark(*_position(args.mark))
+
+    def _snapshot(self, snapshot):
+        if snapshot.fix is not None:
+            # "here" is the first fix
+            if self._start_here:
+                self._start_here = False
+                self.worker.set_start()
+            if self._mark_here:
+                self._mark_here = False
+                self.worker.set_mark()
+
+        # stop at the end of the log unless there's something live too
+        if snapshot.replay and snapshot.replay.finished and \
+           not self.args.serial and not self.args.tcp and not self._quitting:
+            self._quitting = True
+            QtCore.QTimer.singleShot(0, self.quit)
+
+    def command(self, line):
+        """
+        Run one stdin command.
+        """
+        words = line.split()
+        (name, rest) = (words[0].lower(), words[1:])
+        try:
+            if name in ('start', 'mark'):
+                position = _position(' '.join(rest)) if rest else ()
+                getattr(self.worker, 'set_' + name)(*position)
+            elif name == 'reference' and rest:
+                self.worker.add_reference(' '.join(rest))
+            elif name == 'design' and rest:
+                self.worker.load_design(' '.join(rest), self.args.tolerance)
+            elif name == 'staked':
+                self.worker.stake()
+            elif name == 'grade' and rest:
+                self.worker.set_design_plane(*tin.parse_plane(' '.join(rest)))
+            elif name == 'track' and rest:
+                coordinates = export.LOCAL
+                if len(rest) > 1 and rest[-1].lower() in export.COORDINATES:
+                    coordinates = rest.pop().lower()
+                self.worker.start_export('track', ' '.join(rest),
+                                         {'coordinates': coordinates})
+            elif name == 'primary' and rest:
+                self.worker.set_primary(rest[0])
+            elif name == 'reset':
+                self.worker.reset(self.worker.engine.generation + 1)
+            elif name in ('quit', 'exit'):
+                self.quit()
+            else:
+                self.output.error('unknown command: %s' % line)
+        except ValueError as e:
+            self.output.error(str(e))
+
+    def quit(self):
+        # finish any export from a command before starting --track's
+        self.worker.finish_export()
+        if self.args.track:
+            self.worker.start_export('track', self.args.track,
+                                     {'coordinates': self.args.coordinates})
+            self.worker.finish_export()
+        self.worker.close_source()
+        QtCore.QCoreApplication.instance().quit()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Simple Survey without a window: relative measurements '
+                    'as JSON lines')
+    parser.add_argument('--serial', action='append', default=[],
+                        metavar='PORT', help='read a serial receiver')
+    parser.add_argument('--baud', type=int, default=9600)
+    parser.add_argument('--tcp', action='append', default=[], type=_host_port,
+                        metavar='HOST:PORT', help='read an NMEA TCP server')
+    parser.add_argument('--log', action='append', default=[],
+                        metavar='FILE', help='replay an NMEA log')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='log replay speed, 0 for as fast as possible')
+    parser.add_argument('--start', metavar='LAT,LON[,ALT]',
+                        help='start point, or "here" for the first fix')
+    parser.add_argument('--mark', metavar='LAT,LON[,ALT]',
+                        help='mark point, or "here" for the first fix')
+    parser.add_argument('--record', metavar='DIRECTORY',
+                        help='also record the raw NMEA from live sources')
+    parser.add_argument('--design', metavar='FILE',
+                        help='stake out the design points in a CSV, LandXML '
+                             'or DXF file')
+    parser.add_argument('--tolerance', type=float,
+                        default=stakeout.TOLERANCE, metavar='METRES',
+                        help='how close counts as on a design point')
+    parser.add_argument('--grade', type=tin.parse_plane, default=tin.FLAT,
+                        metavar='"ELEVATION [SLOPE BEARING]"',
+                        help='design grade for cut and fill: metres above '
+                             'the start, and the slope in percent falling '
+                             'towards bearing')
+    parser.add_argument('--track', metavar='FILE',
+                        help='write the track to a .csv, .geojson or .dxf '
+                             'file at the end')
+    parser.add_argument('--coordinates', choices=export.COORDINATES,
+                        default=export.LOCAL,
+                        help='coordinates for GeoJSON and DXF geometry')
+    parser.add_argument('--broadcast', type=int, default=0, metavar='PORT',
+                        help='also serve the records over WebSocket')
+    parser.add_argument('--multicast', type=broadcast.parse_multicast,
+                        metavar='GROUP:PORT',
+                        help='also send the records by UDP multicast')
+    parser.add_argument('--output', help='write to this file, not stdout')
+    parser.add_argument('--no-stdin', action='store_true',
+                        help="don't read commands from stdin")
+    args = parser.parse_args(argv)
+    if not (args.serial or args.tcp or args.log):
+        parser.error('give at least one --serial, --tcp or --log source')
+    for position in (args.start, args.mark):
+        if position and position != 'here':
+            try:
+                _position(position)
+            except ValueError as e:
+                parser.error(str(e))
+
+    app = QtCore.QCoreApplication(sys.argv[:1])
+    stream = open(args.output, 'w') if args.output else sys.stdout
+    headless = Headless(args, stream)
+
+    if not args.no_stdin:
+        commands = StdinCommands()
+        commands.lineRead.connect(headless.command)
+        commands.start()
+
+    # let Ctrl+C through while Qt's event loop is running
+    import signal
+    signal.signal(signal.SIGINT, lambda signum, frame: headless.quit())
+    timer = QtCore.QTimer()
+    timer.timeout.connect(lambda: None)
+    timer.start(250)
+
+    QtCore.QTimer.singleShot(0, headless.start)
+    app.exec_()
+    if stream is not sys.stdout:
+        stream.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,410 @@
+from __future__ import division, print_function
+import time
+from functools import reduce
+from operator import xor
+
+"""
+Incremental NMEA 0183 parser for Simple Survey
+
+Works on raw bytes as they arrive from a serial port or socket and only
+understands the RMC, GGA and GST sentences we actually use.  Unlike
+QNmeaPositionInfoSource it keeps the GGA fix quality, satellite count and
+HDOP, and the GST error estimates.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# GGA fix quality indicator
+FIX_INVALID = 0
+FIX_GPS = 1
+FIX_DGPS = 2
+FIX_PPS = 3
+FIX_RTK_FIXED = 4
+FIX_RTK_FLOAT = 5
+FIX_ESTIMATED = 6
+FIX_MANUAL = 7
+FIX_SIMULATION = 8
+
+QUALITY_NAMES = {
+    FIX_INVALID: 'No fix',
+    FIX_GPS: 'GPS',
+    FIX_DGPS: 'DGPS',
+    FIX_PPS: 'PPS',
+    FIX_RTK_FIXED: 'RTK fixed',
+    FIX_RTK_FLOAT: 'RTK float',
+    FIX_ESTIMATED: 'Estimated',
+    FIX_MANUAL: 'Manual',
+    FIX_SIMULATION: 'Simulation',
+}
+
+# the quality indicators aren't in order of how good the position is;
+# this is, worst first.  Anything unknown counts as no fix.
+QUALITY_RANK = {
+    FIX_INVALID: 0,
+    FIX_SIMULATION: 1,
+    FIX_MANUAL: 2,
+    FIX_ESTIMATED: 3,
+    FIX_GPS: 4,
+    FIX_DGPS: 5,
+    FIX_PPS: 5,
+    FIX_RTK_FLOAT: 6,
+    FIX_RTK_FIXED: 7,
+}
+
+KNOTS_TO_MS = 1852.0 / 3600.0
+
+# sentences longer than this are garbage; NMEA says 82 but lots of
+# receivers ignore that with high precision positions
+MAX_SENTENCE = 256
+
+# hex digit value of a byte, -1 for anything that isn't a hex digit
+_HEX = [-1] * 256
+for _i, _c in enumerate(b'0123456789ABCDEF'):
+    _HEX[_c] = _i
+for _i, _c in enumerate(b'abcdef'):
+    _HEX[_c] = _i + 10
+del _i, _c
+
+
+def checksum(data):
+    """
+    XOR of all the bytes in data, which should be the part of a
+    sentence between the $ and the *
+    """
+    return reduce(xor, bytearray(data), 0)
+
+
+def make_sentence(body):
+    """
+    Add the leading $, checksum and line ending to a sentence body,
+    ie. 'GPGGA,...'.  Returns bytes.
+    """
+    if not isinstance(body, bytes):
+        body = body.encode('ascii')
+    return b'$' + body + ('*%02X\r\n' % checksum(body)).encode('ascii')
+
+
+class Fix(object):
+    """
+    One position epoch.  Fields that the receiver did not send are None.
+
+    time is UTC seconds since midnight and date is a (year, month, day)
+    tuple from the last RMC sentence seen.  speed is in m/s, heading in
+    degrees true and the sigmas (from GST) in metres.  source names the
+    receiver it came from, if there's more than one.
+    """
+    __slots__ = ('time', 'date', 'latitude', 'longitude', 'altitude',
+                 'heading', 'speed', 'quality', 'satellites', 'hdop',
+                 'lat_sigma', 'lon_sigma', 'alt_sigma', 'source')
+
+    def __init__(self, time=None, date=None, latitude=None, longitude=None,
+                 altitude=None, heading=None, speed=None, quality=None,
+                 satellites=None, hdop=None, lat_sigma=None, lon_sigma=None,
+                 alt_sigma=None, source=None):
+        self.time = time
+        self.date = date
+        self.latitude = latitude
+        self.longitude = longitude
+        self.altitude = altitude
+        self.heading = heading
+        self.speed = speed
+        self.quality = quality
+        self.satellites = satellites
+        self.hdop = hdop
+        self.lat_sigma = lat_sigma
+        self.lon_sigma = lon_sigma
+        self.alt_sigma = alt_sigma
+        self.source = source
+
+    @property
+    def quality_name(self):
+        if self.quality is None:
+            return ''
+        return QUALITY_NAMES.get(self.quality, str(self.quality))
+
+    def __repr__(self):
+        return 'Fix(%s)' % ', '.join('%s=%r' % (name, getattr(self, name))
+                                     for name in self.__slots__)
+
+
+def worse_quality(a, b):
+    """
+    The worse of two fix qualities by QUALITY_RANK, or the other one if
+    either is None.
+    """
+    if a is None:
+        return b
+    if b is None:
+        return a
+    return b if QUALITY_RANK.get(b, 0) < QUALITY_RANK.get(a, 0) else a
+
+
+def _float(field):
+    if field:
+        return float(field)
+    return None
+
+
+def _time(field):
+    # hhmmss.sss
+    if len(field) < 6:
+        return None
+    return (int(field[0:2]) * 3600 + int(field[2:4]) * 60 +
+            float(field[4:]))
+
+
+def _angle(field, hemisphere):
+    # [d]ddmm.mmmm; split at the decimal point so we don't lose any
+    # precision on RTK positions
+    if not field:
+        return None
+    dot = field.find(b'.')
+    if dot < 0:
+        dot = len(field)
+    degrees = int(field[:dot - 2]) + float(field[dot - 2:]) / 60.0
+    if hemisphere in (b'S', b'W'):
+        return -degrees
+    return degrees
+
+
+def gga_sentence(fix, talker='GP'):
+    """
+    A GGA sentence for fix, as bytes, for sending our position to an
+    NTRIP caster.  Uses the current UTC time if fix has none.
+    """
+    if fix.time is not None:
+        t = fix.time
+    else:
+        t = time.time() % 86400
+    # rounded to what's sent before splitting, so 59.999 s or minutes
+    # carry over rather than coming out as 60
+    (minutes, centiseconds) = divmod(int(round(t * 100)) % 8640000, 6000)
+    (lat, lat_minutes) = divmod(int(round(abs(fix.latitude) * 6e8)),
+                                600000000)
+    (lon, lon_minutes) = divmod(int(round(abs(fix.longitude) * 6e8)),
+                                600000000)
+    return make_sentence('%sGGA,%02d%02d%05.2f,%02d%010.7f,%s,%03d%010.7f,%s,'
+                         '%d,%02d,%.1f,%.3f,M,,M,,' % (
+        talker, minutes // 60, minutes % 60, centiseconds / 100.0,
+        lat, lat_minutes / 1e7, 'N' if fix.latitude >= 0 else 'S',
+        lon, lon_minutes / 1e7, 'E' if fix.longitude >= 0 else 'W',
+        fix.quality if fix.quality else FIX_GPS, fix.satellites or 0,
+        fix.hdop if fix.hdop is not None else 1.0, fix.altitude or 0.0))
+
+
+class NmeaParser(object):
+    """
+    Feed it bytes with feed() and get back a list of Fix objects.
+
+    Fields from RMC (date, speed, heading) and GST (sigmas) are merged
+    into the next fix.  If the receiver sends GGA we emit one fix per GGA,
+    since it carries the altitude and fix quality; otherwise we fall back
+    to emitting one fix per valid RMC.  Every fix is tagged with source.
+    """
+
+    def __init__(self, source=None):
+        self.source = source
+        self._buf = bytearray()
+        self._have_gga = False
+
+        self.time = None
+        self.date = None
+        self.latitude = None
+        self.longitude = None
+        self.altitude = None
+        self.heading = None
+        self.speed = None
+        self.quality = None
+        self.satellites = None
+        self.hdop = None
+        self.lat_sigma = None
+        self.lon_sigma = None
+        self.alt_sigma = None
+
+        self.fix = None       # last fix emitted
+        self.sentences = 0    # sentences parsed
+        self.errors = 0       # bad checksums or unparseable sentences
+
+    def reset(self):
+        """
+        Throw away any partial sentence in the buffer.
+        """
+        del self._buf[:]
+
+    def feed(self, data):
+        """
+        Parse as many complete sentences as there are in data plus
+        whatever was left over from the last call.  Returns a list of
+        new fixes, oldest first.
+        """
+        buf = self._buf
+        buf += data
+        fixes = []
+
+        end = len(buf)
+        consumed = 0
+        with memoryview(buf) as view:
+            while True:
+                nl = buf.find(b'\n', consumed)
+                if nl < 0:
+                    break
+
+                # the last $, so whatever was cut off before a sentence
+                # (by a dropped connection or an overrun) doesn't take
+                # the sentence with it
+                start = buf.rfind(b'$', consumed, nl)
+                consumed = nl + 1
+                if start < 0:
+                    continue
+
+                star = buf.find(b'*', start, nl)
+                if star < 0 or star + 2 >= nl or nl - start > MAX_SENTENCE:
+                    self.errors += 1
+                    continue
+
+                hi = _HEX[buf[star + 1]]
+                lo = _HEX[buf[star + 2]]
+                if hi < 0 or lo < 0 or \
+                   reduce(xor, view[start + 1:star], 0) != hi * 16 + lo:
+                    self.errors += 1
+                    continue
+
+                # $ttSSS: talker id is ignored so GP, GN, GL, etc. all work
+                if buf.startswith(b'GGA', start + 3, star):
+                    handler = self._gga
+                elif buf.startswith(b'RMC', start + 3, star):
+                    handler = self._rmc
+                elif buf.startswith(b'GST', start + 3, star):
+                    handler = self._gst
+                else:
+                    continue
+
+                try:
+                    fix = handler(bytes(buf[start + 7:star]).split(b','))
+                except (ValueError, IndexError):
+                    self.errors += 1
+                    continue
+
+                self.sentences += 1
+                if fix is not None:
+                    fixes.append(fix)
+
+        if consumed:
+            del buf[:consumed]
+        elif end > MAX_SENTENCE * 4:
+            # no line ending in sight; this isn't NMEA
+            del buf[:]
+            self.errors += 1
+
+        return fixes
+
+    def _emit(self):
+        self.fix = Fix(self.time, self.date, self.latitude, self.longitude,
+                       self.altitude, self.heading, self.speed, self.quality,
+                       self.satellites, self.hdop, self.lat_sigma,
+                       self.lon_sigma, self.alt_sigma, self.source)
+        return self.fix
+
+    def _gga(self, fields):
+        # time, lat, N/S, lon, E/W, quality, sats, hdop, alt, M, geoid sep, M,
+        # age, station
+        self._have_gga = True
+        quality = int(fields[5]) if fields[5] else FIX_INVALID
+        self.quality = quality
+        if quality == FIX_INVALID:
+            return None
+
+        self.time = _time(fields[0])
+        self.latitude = _angle(fields[1], fields[2])
+        self.longitude = _angle(fields[3], fields[4])
+        self.satellites = int(fields[6]) if fields[6] else None
+        self.hdop = _float(fields[7])
+        self.altitude = _float(fields[8])
+
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self._emit()
+
+    def _rmc(self, fields):
+        # time, status, lat, N/S, lon, E/W, speed (knots), course, date, ...
+        if fields[1] != b'A':
+            return None
+
+        self.time = _time(fields[0])
+        speed = _float(fields[6])
+        self.speed = speed * KNOTS_TO_MS if speed is not None else None
+        self.heading = _float(fields[7])
+        date = fields[8]
+        if len(date) == 6:
+            self.date = (2000 + int(date[4:6]), int(date[2:4]), int(date[0:2]))
+
+        if self._have_gga:
+            return None
+
+        self.latitude = _angle(fields[2], fields[3])
+        self.longitude = _angle(fields[4], fields[5])
+        if self.latitude is None or self.longitude is None:
+            return None
+        return self._emit()
+
+    def _gst(self, fields):
+        # time, rms, major, minor, orientation, lat sigma, lon sigma, alt sigma
+        self.lat_sigma = _float(fields[5])
+        self.lon_sigma = _float(fields[6])
+        self.alt_sigma = _float(fields[7])
+        return None
+
+
+def _synthetic_stream(count, lat=40.0, lon=-111.0):
+    lines = []
+    for i in range(count):
+        seconds = i / 20.0
+        hhmmss = '%02d%02d%05.2f' % (seconds // 3600, seconds // 60 % 60,
+                                     seconds % 60)
+        latm = (lat % 1) * 60 + i * 1e-6
+        lonm = (-lon % 1) * 60 + i * 1e-6
+        lines.append(make_sentence(
+            'GNGGA,%s,%02d%010.7f,N,%03d%010.7f,W,4,14,0.6,1402.123,M,'
+            '-17.5,M,1.0,0000'
+            % (hhmmss, int(lat), latm, int(-lon), lonm)))
+        lines.append(make_sentence(
+            'GNRMC,%s,A,%02d%010.7f,N,%03d%010.7f,W,0.02,123.4,180618,,,R'
+            % (hhmmss, int(lat), latm, int(-lon), lonm)))
+    return lines
+
+
+if __name__ == "__main__":
+    # benchmark sentences/sec against QNmeaPositionInfoSource
+    import time
+
+    lines = _synthetic_stream(20000)
+    data = b''.join(lines)
+
+    parser = NmeaParser()
+    t = time.perf_counter()
+    # feed in serial-port sized chunks
+    fixes = 0
+    for offset in range(0, len(data), 512):
+        fixes += len(parser.feed(data[offset:offset + 512]))
+    elapsed = time.perf_counter() - t
+    print('NmeaParser:              %9.0f sentences/s (%d fixes, %d errors)'
+          % (len(lines) / elapsed, fixes, parser.errors))
+
+    try:
+        from qt5pick import QtCore, QtPositioning
+    except ImportError:
+        print('Qt not available, skipping QNmeaPositionInfoSource')
+    else:
+        app = QtCore.QCoreApplication([])
+        source = QtPositioning.QNmeaPositionInfoSource(
+            QtPositioning.QNmeaPositionInfoSource.RealTimeMode)
+        t = time.perf_counter()
+        for line in lines:
+            info = QtPositioning.QGeoPositionInfo()
+            source.parsePosInfoFromNmeaData(line, len(line), info)
+        elapsed = time.perf_counter() - t
+        print('QNmeaPositionInfoSource: %9.0f sentences/s'
+              % (len(lines) / elapsed))
@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+from __future__ import division, print_function
+import time
+import socket
+import base64
+import argparse
+import threading
+
+import ssbench
+
+"""
+Stand-in NMEA server for testing Simple Survey
+
+Serves a synthetic NMEA stream (or a log file, looped) over TCP the way a
+receiver's TCP server or a serial-to-network bridge would, and can
+misbehave on purpose to exercise reconnecting: drop every connection
+after a while, cut it off in the middle of a sentence, go quiet without
+closing, or refuse connections for a time.
+
+    python3 nmeaserver.py --port 9999 --drop-every 20 --down 5
+
+With --caster it acts as an NTRIP caster instead, serving made-up RTCM3
+frames on any mountpoint and printing the GGA sentences sent back to it.
+
+    python3 nmeaserver.py --caster --port 2101
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+
+class NmeaServer(object):
+    """
+    Serves epochs, a list of bytes objects, one every 1/rate seconds to
+    each client.  Any of drop_every, stall_every (seconds of streaming
+    before misbehaving) and down (seconds to refuse connections after a
+    drop) can be None.
+    """
+
+    def __init__(self, epochs, rate, host='127.0.0.1', port=0,
+                 drop_every=None, mid_sentence=True, stall_every=None,
+                 down=None):
+        self.epochs = epochs
+        self.rate = rate
+        self.host = host
+        self.drop_every = drop_every
+        self.mid_sentence = mid_sentence
+        self.stall_every = stall_every
+        self.down = down
+
+        self.connections = 0
+        self.drops = 0
+        self.sent = 0
+        self._stop = threading.Event()
+        self._listener = None
+        self.port = port
+        self._listen()
+        self._thread = threading.Thread(target=self._accept,
+                                        name='nmea server')
+        self._thread.daemon = True
+
+    def _listen(self):
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind((self.host, self.port))
+        listener.listen(4)
+        listener.settimeout(0.2)
+        self.port = listener.getsockname()[1]
+        self._listener = listener
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _accept(self):
+        position = 0
+        while not self._stop.is_set():
+            try:
+                (client, address) = self._listener.accept()
+            except socket.timeout:
+                continue
+            self.connections += 1
+            position = self._serve(client, position)
+
+            if self.down:
+                # refuse connections for a while
+                self._listener.close()
+                self._stop.wait(self.down)
+                self._listen()
+        self._listener.close()
+
+    def _serve(self, client, position):
+        # one client at a time is plenty for testing
+        started = time.monotonic()
+        interval = 1.0 / self.rate
+        next_time = started
+        try:
+            while not self._stop.is_set():
+                elapsed = time.monotonic() - started
+                data = self.epochs[position % len(self.epochs)]
+
+                if self.drop_every and elapsed >= self.drop_every:
+                    if self.mid_sentence:
+                        client.sendall(data[:len(data) // 2])
+                    self.drops += 1
+                    return position + 1
+                if self.stall_every and elapsed >= self.stall_every:
+                    # stop sending but keep the connection open, like a
+                    # link that's gone dead
+                    self.drops += 1
+                    self._stop.wait(self.stall_every)
+                    return position + 1
+
+                client.sendall(data)
+                self.sent += 1
+                position += 1
+                next_time += interval
+                self._stop.wait(max(0.0, next_time - time.monotonic()))
+        except (socket.error, OSError):
+            return position
+        finally:
+            client.close()
+        return position
+
+
+def crc24q(data):
+    """
+    The CRC-24Q that ends every RTCM3 frame.
+    """
+    crc = 0
+    for byte in bytearray(data):
+        crc ^= byte << 16
+        for bit in range(8):
+            crc <<= 1
+            if crc & 0x1000000:
+                crc ^= 0x1864CFB
+    return crc & 0xFFFFFF
+
+
+def rtcm_frame(message, payload_length):
+    """
+    An RTCM3 frame of the given message type, its payload otherwise
+    filled with a counting pattern.
+    """
+    payload = bytearray(payload_length)
+    for i in range(2, payload_length):
+        payload[i] = i & 0xFF
+    payload[0] = message >> 4
+    payload[1] = (message & 0x0F) << 4
+    frame = bytearray([0xD3, payload_length >> 8, payload_length & 0xFF])
+    frame += payload
+    crc = crc24q(frame)
+    frame += bytearray([crc >> 16, (crc >> 8) & 0xFF, crc & 0xFF])
+    return bytes(frame)
+
+
+# roughly what a base sends each second: its position and MSM7 for
+# GPS, GLONASS, Galileo and BeiDou
+RTCM_EPOCH = b''.join([rtcm_frame(1005, 19), rtcm_frame(1077, 410),
+                       rtcm_frame(1087, 350), rtcm_frame(1097, 380),
+                       rtcm_frame(1127, 360)])
+
+
+class MockCaster(NmeaServer):
+    """
+    Stand-in NTRIP caster.  Answers any mountpoint with ICY 200 OK (or
+    401 if username is set and the client's Basic credentials differ)
+    and serves RTCM_EPOCH rate times a second.  GGA sentences the client
+    sends are kept in gga.  Takes NmeaServer's misbehaviour options.
+    """
+
+    def __init__(self, rate=1, host='127.0.0.1', port=0, username=None,
+                 password=None, **kwargs):
+        super(MockCaster, self).__init__([RTCM_EPOCH], rate, host, port,
+                                         **kwargs)
+        self.username = username
+        self.password = password
+        self.requests = []
+        self.gga = []
+
+    def _serve(self, client, position):
+        client.settimeout(5)
+        try:
+            request = b''
+            while b'\r\n\r\n' not in request:
+                data = client.recv(4096)
+                if not data:
+                    client.close()
+                    return position
+                request += data
+        except (socket.error, OSError):
+            client.close()
+            return position
+        self.requests.append(request)
+
+        if self.username:
+            credentials = base64.b64encode(('%s:%s' % (
+                self.username, self.password or '')).encode('utf-8'))
+            if b'Authorization: Basic ' + credentials not in request:
+                client.sendall(b'HTTP/1.0 401 Unauthorized\r\n\r\n')
+                client.close()
+                return position
+        client.sendall(b'ICY 200 OK\r\n\r\n')
+
+        # collect GGA upstream while the base class streams
+        client.settimeout(None)
+        reader = threading.Thread(target=self._read_gga, args=(client,))
+        reader.daemon = True
+        reader.start()
+        return super(MockCaster, self)._serve(client, position)
+
+    def _read_gga(self, client):
+        buffered = b''
+        try:
+            while True:
+                data = client.recv(4096)
+                if not data:
+                    return
+                buffered += data
+                while b'\r\n' in buffered:
+                    (line, buffered) = buffered.split(b'\r\n', 1)
+                    if line:
+                        self.gga.append(line)
+        except (socket.error, OSError):
+            return
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Stand-in NMEA server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9999)
+    parser.add_argument('--rate', type=float,
+                        help='epochs per second (default 10, or 1 for '
+                        'the caster)')
+    parser.add_argument('--log', help='serve this NMEA log, one line per '
+                        'epoch, instead of a synthetic stream')
+    parser.add_argument('--drop-every', type=float,
+                        help='drop each connection after this many seconds')
+    parser.add_argument('--whole-sentences', action='store_true',
+                        help="don't cut the last sentence off when dropping")
+    parser.add_argument('--stall-every', type=float,
+                        help='go quiet without closing after this many '
+                        'seconds')
+    parser.add_argument('--down', type=float,
+                        help='refuse connections for this many seconds '
+                        'after a drop')
+    parser.add_argument('--caster', action='store_true',
+                        help='act as an NTRIP caster serving RTCM3')
+    parser.add_argument('--user', help='caster username')
+    parser.add_argument('--password', help='caster password')
+    args = parser.parse_args(argv)
+
+    if args.caster:
+        server = MockCaster(args.rate or 1, args.host,
+                            args.port, args.user, args.password,
+                            drop_every=args.drop_every,
+                            stall_every=args.stall_every,
+                            down=args.down).start()
+        print('caster on %s:%d' % (server.host, server.port))
+        shown = 0
+        try:
+            while True:
+                time.sleep(1)
+                for line in server.gga[shown:]:
+                    print(line.decode('ascii', 'replace'))
+                    shown += 1
+        except KeyboardInterrupt:
+            server.stop()
+        return
+
+    rate = args.rate or 10
+    if args.log:
+        with open(args.log, 'rb') as f:
+            epochs = [line for line in f if line.strip()]
+    else:
+        epochs = ssbench.synthetic_stream(rate, 3600)
+
+    server = NmeaServer(epochs, rate, args.host, args.port,
+                        args.drop_every, not args.whole_sentences,
+                        args.stall_every, args.down).start()
+    print('serving on %s:%d' % (server.host, server.port))
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,318 @@
+from __future__ import division, print_function
+import time
+import base64
+import random
+from collections import deque, namedtuple
+
+import nmea
+import sources
+
+"""
+NTRIP correction relay for Simple Survey
+
+NtripClient connects to an NTRIP caster, streams the RTCM3 corrections
+for one mountpoint and writes them into the serial port the receiver's
+NMEA is read from, so no second program or second handle on the port is
+needed.  Each block read from the caster is written to the port as is,
+without being split into messages or copied; RtcmFramer only peeks at
+the frame headers to count messages.  Our position is sent back to the
+caster as GGA every GGA_INTERVAL, which network (VRS) mountpoints need.
+
+Status reports the age of the last correction and the relay latency:
+the time from the caster's data arriving to the serial port handing it
+to the operating system.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, QtNetwork, Signal, Slot
+
+# send our position to the caster this often, in ms
+GGA_INTERVAL = 10000
+
+RTCM3_PREAMBLE = 0xD3
+
+USER_AGENT = 'NTRIP SimpleSurvey/1.0'
+
+# state is 'connecting', 'streaming', 'waiting' (to reconnect) or
+# 'stopped'.  age is seconds since the last correction, latency and
+# max_latency the relay latency in seconds.
+NtripStatus = namedtuple('NtripStatus', ['state', 'error', 'bytes',
+                                         'messages', 'age', 'latency',
+                                         'max_latency', 'gga_sent'])
+
+
+def request(mountpoint, host, username=None, password=None):
+    """
+    NTRIP 1.0 request for mountpoint.  Casters answer it with an
+    unchunked stream, so the data can be relayed exactly as it comes.
+    """
+    lines = ['GET /%s HTTP/1.0' % mountpoint,
+             'Host: %s' % host,
+             'User-Agent: %s' % USER_AGENT,
+             'Accept: */*']
+    if username:
+        credentials = ('%s:%s' % (username, password or '')).encode('utf-8')
+        lines.append('Authorization: Basic %s' %
+                     base64.b64encode(credentials).decode('ascii'))
+    return ('\r\n'.join(lines) + '\r\n\r\n').encode('ascii')
+
+
+class RtcmFramer(object):
+    """
+    Counts RTCM3 messages by type in a stream fed in arbitrary blocks,
+    reading only each frame's header.  Frames aren't CRC checked; the
+    receiver does that.
+    """
+
+    def __init__(self):
+        self.messages = 0
+        self.types = {}
+        self._skip = 0        # bytes left of the frame we're in
+        self._header = b''    # start of a frame split across blocks
+
+    def resync(self):
+        """
+        Forget any frame in progress, as when the stream starts again.
+        """
+        self._skip = 0
+        self._header = b''
+
+    def feed(self, data):
+        """
+        Returns the number of frames whose headers were in data.
+        """
+        found = 0
+        i = self._skip
+        self._skip = 0
+        if self._header:
+            # finish the header left over from the last block
+            had = len(self._header)
+            self._header += bytes(data[:5 - had])
+            if len(self._header) < 5:
+                return 0
+            i = self._count(self._header, 0) - had
+            self._header = b''
+            found += 1
+
+        end = len(data)
+        while i < end:
+            if data[i] != RTCM3_PREAMBLE:
+                # out of step; look for the next frame
+                i = data.find(b'\xd3', i + 1)
+                if i < 0:
+                    return found
+                continue
+            if end - i < 5:
+                self._header = bytes(data[i:])
+                return found
+            i += self._count(data, i)
+            found += 1
+        self._skip = i - end
+        return found
+
+    def _count(self, data, i):
+        # count the frame at i and return its length
+        length = ((data[i + 1] & 0x03) << 8) | data[i + 2]
+        message = (data[i + 3] << 4) | (data[i + 4] >> 4)
+        self.types[message] = self.types.get(message, 0) + 1
+        self.messages += 1
+        return length + 6
+
+
+class NtripClient(QtCore.QObject):
+    """
+    Relays corrections from a caster mountpoint into target, an open
+    QIODevice such as the receiver's QSerialPort.  Reconnects with the
+    same backoff as sources.TcpSource.  statusChanged is emitted when
+    the connection state changes.
+    """
+
+    statusChanged = Signal()
+
+    def __init__(self, host, port, mountpoint, username=None,
+                 password=None, parent=None):
+        super(NtripClient, self).__init__(parent)
+        self.host = host
+        self.port = port
+        self.mountpoint = mountpoint
+        self.username = username
+        self.password = password
+
+        self.state = 'stopped'
+        self.error = None
+        self.attempts = 0
+        self.target = None
+        self.position = None       # latest nmea.Fix, sent back as GGA
+        self.framer = RtcmFramer()
+        self.bytes = 0
+        self.gga_sent = 0
+        self.last_correction = None
+
+        self._header = b''         # caster's response, until it's complete
+        self._pending = deque()    # (bytes written to target so far, time)
+        self._queued = 0
+        self._written = 0
+        self.latency = None
+        self.max_latency = None
+
+        self.socket = QtNetwork.QTcpSocket(self)
+        self.socket.connected.connect(self._connected)
+        self.socket.readyRead.connect(self._ready_read)
+        self.socket.disconnected.connect(self._lost)
+        self.socket.error.connect(self._lost)
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._timer_fired)
+        self._gga_timer = QtCore.QTimer(self)
+        self._gga_timer.setInterval(GGA_INTERVAL)
+        self._gga_timer.timeout.connect(self.send_gga)
+        self._quiet = QtCore.QTimer(self)
+        self._quiet.setSingleShot(True)
+        self._quiet.setInterval(sources.UPDATE_TIMEOUT)
+        self._quiet.timeout.connect(self._no_data)
+
+    def set_target(self, device):
+        if self.target is not None:
+            self.target.bytesWritten.disconnect(self._bytes_written)
+        self.target = device
+        self._pending.clear()
+        self._queued = self._written = 0
+        if device is not None:
+            device.bytesWritten.connect(self._bytes_written)
+
+    def set_position(self, fix):
+        self.position = fix
+
+    def status(self):
+        age = None
+        if self.last_correction is not None:
+            age = time.monotonic() - self.last_correction
+        return NtripStatus(self.state, self.error, self.bytes,
+                           self.framer.messages, age, self.latency,
+                           self.max_latency, self.gga_sent)
+
+    def start(self):
+        self._open()
+
+    def stop(self):
+        self._timer.stop()
+        self._gga_timer.stop()
+        self._quiet.stop()
+        if self.state != 'stopped':
+            self.state = 'stopped'
+            self.socket.abort()
+            self.statusChanged.emit()
+
+    def _set_state(self, state):
+        self.state = state
+        self.statusChanged.emit()
+
+    def _open(self):
+        self.socket.abort()
+        self._header = b''
+        self.framer.resync()
+        self._set_state('connecting')
+        self._timer.start(sources.CONNECT_TIMEOUT)
+        self.socket.connectToHost(self.host, self.port)
+
+    @Slot()
+    def _connected(self):
+        self.socket.write(request(self.mountpoint, self.host, self.username,
+                                  self.password))
+
+    @Slot()
+    def send_gga(self):
+        if self.state == 'streaming' and self.position is not None:
+            self.socket.write(nmea.gga_sentence(self.position))
+            self.gga_sent += 1
+
+    @Slot()
+    def _ready_read(self):
+        now = time.monotonic()
+        if self.state == 'connecting':
+            self._header += bytes(self.socket.readAll())
+            end = self._header.find(b'\r\n\r\n')
+            if end < 0:
+                if len(self._header) > 4096:
+                    self._retry_later('Not an NTRIP caster')
+                return
+            status = self._header.split(b'\r\n', 1)[0]
+            if b' 200 ' not in status + b' ':
+                self._retry_later(status.decode('latin-1') or 'Refused')
+                return
+            data = self._header[end + 4:]
+            self._header = b''
+            self._timer.stop()
+            self.attempts = 0
+            self.error = None
+            self._set_state('streaming')
+            self.send_gga()
+            self._gga_timer.start()
+            if not data:
+                self._quiet.start()
+                return
+            self._relay(data, now)
+            return
+
+        # straight from the socket into the serial port
+        data = self.socket.readAll()
+        self._relay(data, now)
+
+    def _relay(self, data, now):
+        self._quiet.start()
+        self.bytes += len(data)
+        self.last_correction = now
+        if self.target is not None and self.target.isOpen():
+            written = self.target.write(data)
+            if written > 0:
+                self._queued += written
+                self._pending.append((self._queued, now))
+        # only the frame headers are looked at; one bytes object per
+        # block rather than per message
+        self.framer.feed(data.data() if hasattr(data, 'data') else data)
+
+    @Slot('qint64')
+    def _bytes_written(self, count):
+        self._written += count
+        now = time.monotonic()
+        pending = self._pending
+        while pending and pending[0][0] <= self._written:
+            latency = now - pending.popleft()[1]
+            self.latency = latency
+            if self.max_latency is None or latency > self.max_latency:
+                self.max_latency = latency
+
+    def _lost(self, *args):
+        if self.state not in ('connecting', 'streaming'):
+            return
+        self._retry_later(self.socket.errorString())
+
+    @Slot()
+    def _no_data(self):
+        if self.state == 'streaming':
+            self._retry_later('No corrections for %g s' %
+                              (sources.UPDATE_TIMEOUT / 1000))
+
+    @Slot()
+    def _timer_fired(self):
+        if self.state == 'connecting':
+            self._retry_later('Timed out connecting')
+        elif self.state == 'waiting':
+            self._open()
+
+    def _retry_later(self, error):
+        self.state = 'waiting'
+        self.error = error
+        self.attempts += 1
+        self._gga_timer.stop()
+        self._quiet.stop()
+        self.socket.abort()
+        delay = min(sources.RECONNECT_MAX,
+                    sources.RECONNECT_MIN * 2 ** (self.attempts - 1))
+        self._timer.start(int(random.uniform(delay / 2, delay)))
+        self.statusChanged.emit()
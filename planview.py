@@ -0,0 +1,396 @@
+from __future__ import division, print_function
+import math
+
+import units
+
+"""
+Plan view for Simple Survey
+
+PlanView draws the walked track, the reference points and the current
+position from above, north up.  It's fed the engine's TrackUpdates, so
+only what's new comes across from the worker thread, and keeps the
+track at each of the engine's levels of detail as polylines of up to
+CHUNK_POINTS points.  A chunk's QPolygonF is built the first time it's
+drawn and only the last, open chunk is ever rebuilt, so new fixes never
+touch the rest of the track.
+
+Each paint draws the coarsest level whose tolerance is still under a
+pixel, and only the chunks that overlap the window, so the number of
+points drawn depends on how much of the track is on screen at what
+zoom, not on how long it is.
+
+Drag to pan, scroll to zoom, double-click to follow the current
+position again.
+
+numpy is only imported once there's a track to draw, so the view
+doesn't hold up showing the window.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, QtGui, QtWidgets
+
+# points in each cached polyline
+CHUNK_POINTS = 2048
+
+# zoom, in pixels per metre
+DEFAULT_SCALE = 10.0
+MIN_SCALE = 0.001
+MAX_SCALE = 5000.0
+
+# scroll wheel zoom per notch
+ZOOM_STEP = 1.25
+
+# the scale bar is about this many pixels long
+SCALE_BAR = 100
+
+FEET_PER_METRE = units.INCHES_PER_METRE / 12
+
+
+def polygon(eastings, northings):
+    """
+    A QPolygonF of (easting, northing) points, filled straight from the
+    arrays where the binding allows it.
+    """
+    import numpy
+    count = len(eastings)
+    result = QtGui.QPolygonF(count)
+    if count and hasattr(result, 'data'):
+        pointer = result.data()
+        pointer.setsize(count * 16)
+        points = numpy.frombuffer(pointer, numpy.float64).reshape(count, 2)
+        points[:, 0] = eastings
+        points[:, 1] = northings
+        return result
+    return QtGui.QPolygonF([QtCore.QPointF(e, n) for (e, n) in
+                            zip(eastings.tolist(), northings.tolist())])
+
+
+class Chunk(object):
+    """
+    Up to CHUNK_POINTS consecutive points of a track and, once it has
+    been drawn, their polyline and bounding rectangle.
+    """
+    __slots__ = ('easting', 'northing', 'size', '_polygon', '_bounds')
+
+    def __init__(self):
+        import numpy
+        self.easting = numpy.empty(CHUNK_POINTS)
+        self.northing = numpy.empty(CHUNK_POINTS)
+        self.size = 0
+        self._polygon = None
+        self._bounds = None
+
+    @property
+    def full(self):
+        return self.size == CHUNK_POINTS
+
+    def extend(self, eastings, northings):
+        """
+        Add as many of the points as fit.  Returns how many that was.
+        """
+        count = min(len(eastings), CHUNK_POINTS - self.size)
+        self.easting[self.size:self.size + count] = eastings[:count]
+        self.northing[self.size:self.size + count] = northings[:count]
+        self.size += count
+        if count:
+            self._polygon = None
+            self._bounds = None
+        return count
+
+    def polygon(self):
+        if self._polygon is None:
+            self._polygon = polygon(self.easting[:self.size],
+                                    self.northing[:self.size])
+        return self._polygon
+
+    def bounds(self):
+        """
+        QRectF around the points, in (easting, northing).
+        """
+        if self._bounds is None:
+            e = self.easting[:self.size]
+            n = self.northing[:self.size]
+            self._bounds = QtCore.QRectF(e.min(), n.min(), e.max() - e.min(),
+                                         n.max() - n.min())
+        return self._bounds
+
+
+class Polyline(object):
+    """
+    One level of detail of a track, as a list of Chunks.  Each chunk
+    starts with the last point of the one before, so they join up.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.points = 0
+
+    def extend(self, eastings, northings):
+        self.points += len(eastings)
+        while len(eastings):
+            if not self.chunks or self.chunks[-1].full:
+                chunk = Chunk()
+                if self.chunks:
+                    last = self.chunks[-1]
+                    chunk.extend(last.easting[-1:], last.northing[-1:])
+                self.chunks.append(chunk)
+            count = self.chunks[-1].extend(eastings, northings)
+            eastings = eastings[count:]
+            northings = northings[count:]
+
+    def last(self):
+        if not self.chunks:
+            return None
+        chunk = self.chunks[-1]
+        return (chunk.easting[chunk.size - 1], chunk.northing[chunk.size - 1])
+
+
+class PlanView(QtWidgets.QWidget):
+    """
+    Track, reference points and position from above.  Give it every
+    TrackUpdate with add_track().
+    """
+
+    def __init__(self, parent=None):
+        super(PlanView, self).__init__(parent)
+        self.tolerances = ()
+        self.scale = DEFAULT_SCALE
+        self.feet = False
+        self.follow = True
+        self.centre = None     # (easting, northing) when not following
+        self._drag = None
+        self.setMinimumHeight(150)
+        self.setSizePolicy(QtWidgets.QSizePolicy.Expanding,
+                           QtWidgets.QSizePolicy.Expanding)
+        self.clear()
+
+        self._track_pen = QtGui.QPen(QtGui.QColor(30, 90, 200))
+        self._track_pen.setCosmetic(True)
+        self._track_pen.setWidth(0)
+
+    def sizeHint(self):
+        return QtCore.QSize(300, 250)
+
+    def clear(self):
+        self.lines = [Polyline() for tolerance in self.tolerances]
+        self.position = None
+        self.references = ((), (), ())
+        self.update()
+
+    def set_units(self, formatter):
+        """
+        Label the scale bar in feet for any of the imperial formatters.
+        """
+        self.feet = formatter.name != 'metres'
+        self.update()
+
+    def add_track(self, update):
+        """
+        Take an engine.TrackUpdate.
+        """
+        if update is None:
+            return
+        if update.clear or update.tolerances != self.tolerances:
+            self.tolerances = update.tolerances
+            self.clear()
+        for (line, new) in zip(self.lines, update.levels):
+            if new is not None:
+                (northings, eastings) = new
+                line.extend(eastings, northings)
+        self.position = (update.position[1], update.position[0])
+        if update.references is not None:
+            (names, northings, eastings) = update.references
+            self.references = (names, eastings, northings)
+        if self.isVisible():
+            self.update()
+
+    def _transform(self):
+        """
+        QTransform from (easting, northing) to the widget, with y
+        flipped so north is up.
+        """
+        (ce, cn) = self.position if self.follow else self.centre
+        s = self.scale
+        return QtGui.QTransform(s, 0, 0, -s, self.width() / 2 - s * ce,
+                                self.height() / 2 + s * cn)
+
+    def _level(self):
+        """
+        The coarsest level of detail that's within a pixel.
+        """
+        pixel = 1 / self.scale
+        level = 0
+        for (i, tolerance) in enumerate(self.tolerances):
+            if tolerance <= pixel and self.lines[i].points:
+                level = i
+        return level
+
+    def paintEvent(self, event):
+        painter = QtGui.QPainter(self)
+        painter.fillRect(self.rect(), self.palette().base())
+        if self.position is None:
+            painter.setPen(self.palette().color(QtGui.QPalette.Mid))
+            painter.drawText(self.rect(), QtCore.Qt.AlignCenter,
+                             'Waiting for a fix')
+            return
+
+        transform = self._transform()
+        (visible, _) = transform.inverted()
+        visible = visible.mapRect(QtCore.QRectF(self.rect()))
+
+        # the track, in metres, only the chunks that are on screen
+        level = self._level()
+        line = self.lines[level]
+        margin = self.tolerances[level]
+        visible = visible.adjusted(-margin, -margin, margin, margin)
+        painter.save()
+        painter.setTransform(transform)
+        painter.setPen(self._track_pen)
+        for chunk in line.chunks:
+            if chunk.size > 1 and chunk.bounds().intersects(visible):
+                painter.drawPolyline(chunk.polygon())
+        last = line.last()
+        if last is not None:
+            painter.drawLine(QtCore.QPointF(*last),
+                             QtCore.QPointF(*self.position))
+        painter.restore()
+
+        # markers are drawn in pixels so they stay the same size
+        painter.setRenderHint(QtGui.QPainter.Antialiasing)
+        (names, eastings, northings) = self.references
+        text = self.palette().color(QtGui.QPalette.Text)
+        for (name, e, n) in zip(names, eastings, northings):
+            point = transform.map(QtCore.QPointF(e, n))
+            painter.setPen(QtGui.QPen(QtGui.QColor(200, 60, 30), 2))
+            painter.drawLine(point + QtCore.QPointF(-5, -5),
+                             point + QtCore.QPointF(5, 5))
+            painter.drawLine(point + QtCore.QPointF(-5, 5),
+                             point + QtCore.QPointF(5, -5))
+            painter.setPen(text)
+            painter.drawText(point + QtCore.QPointF(8, -4), name)
+
+        point = transform.map(QtCore.QPointF(*self.position))
+        painter.setPen(QtGui.QPen(QtCore.Qt.white, 2))
+        painter.setBrush(QtGui.QColor(30, 90, 200))
+        painter.drawEllipse(point, 6, 6)
+
+        self._paint_scale_bar(painter, text)
+
+    def _paint_scale_bar(self, painter, colour):
+        # a round number of metres or feet about SCALE_BAR pixels long
+        per_unit = self.scale / FEET_PER_METRE if self.feet else self.scale
+        length = SCALE_BAR / per_unit
+        magnitude = 10 ** math.floor(math.log10(length))
+        for step in (5, 2, 1):
+            if step * magnitude <= length:
+                length = step * magnitude
+                break
+        pixels = length * per_unit
+
+        x = 10
+        y = self.height() - 10
+        painter.setPen(QtGui.QPen(colour, 1))
+        painter.drawLine(QtCore.QPointF(x, y), QtCore.QPointF(x + pixels, y))
+        painter.drawLine(QtCore.QPointF(x, y - 4), QtCore.QPointF(x, y))
+        painter.drawLine(QtCore.QPointF(x + pixels, y - 4),
+                         QtCore.QPointF(x + pixels, y))
+        painter.drawText(QtCore.QPointF(x, y - 6),
+                         '%g %s' % (length, 'ft' if self.feet else 'm'))
+
+    def zoom(self, factor, anchor=None):
+        """
+        Zoom by factor, keeping the point under anchor (a QPointF in the
+        widget) where it is.  Following, it zooms about the position.
+        """
+        scale = min(MAX_SCALE, max(MIN_SCALE, self.scale * factor))
+        if anchor is not None and not self.follow:
+            (inverse, _) = self._transform().inverted()
+            before = inverse.map(anchor)
+            self.scale = scale
+            (inverse, _) = self._transform().inverted()
+            after = inverse.map(anchor)
+            self.centre = (self.centre[0] + before.x() - after.x(),
+                           self.centre[1] + before.y() - after.y())
+        else:
+            self.scale = scale
+        self.update()
+
+    def wheelEvent(self, event):
+        if self.position is None:
+            return
+        notches = event.angleDelta().y() / 120
+        self.zoom(ZOOM_STEP ** notches, QtCore.QPointF(event.pos()))
+
+    def mousePressEvent(self, event):
+        if self.position is not None and \
+           event.button() == QtCore.Qt.LeftButton:
+            self._drag = event.pos()
+
+    def mouseMoveEvent(self, event):
+        if self._drag is None:
+            return
+        if self.follow:
+            self.follow = False
+            self.centre = self.position
+        delta = event.pos() - self._drag
+        self._drag = event.pos()
+        self.centre = (self.centre[0] - delta.x() / self.scale,
+                       self.centre[1] + delta.y() / self.scale)
+        self.update()
+
+    def mouseReleaseEvent(self, event):
+        self._drag = None
+
+    def mouseDoubleClickEvent(self, event):
+        self.follow = True
+        self.update()
+
+
+if __name__ == "__main__":
+    # paint times for a long synthetic track at a range of zooms
+    import sys
+    import time
+    import random
+    import numpy
+    import track
+    import engine
+
+    points = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    app = QtWidgets.QApplication(sys.argv)
+    rnd = random.Random(1)
+
+    # a wandering walk, thinned the way the engine does it
+    levels = [track.Ring(points * 2) for tolerance in track.THIN_LEVELS]
+    thinner = None
+    for (ring, tolerance) in reversed(list(zip(levels, track.THIN_LEVELS))):
+        thinner = track.Thinner(ring, tolerance, thinner)
+    (n, e, heading) = (0.0, 0.0, 0.0)
+    while len(levels[0]) < points:
+        heading += rnd.gauss(0, 0.3)
+        n += math.cos(heading)
+        e += math.sin(heading)
+        thinner.add((0.0, n, e, 0.0, 4))
+
+    view = PlanView()
+    view.resize(800, 600)
+    view.add_track(engine.TrackUpdate(
+        (40.0, -111.0), True, track.THIN_LEVELS,
+        tuple((ring.column('northing'), ring.column('easting'))
+              for ring in levels),
+        (n, e), (['Start'], numpy.zeros(1), numpy.zeros(1))))
+    print('%s points at each level' % ', '.join(str(len(ring))
+                                                for ring in levels))
+
+    image = QtGui.QImage(view.size(), QtGui.QImage.Format_ARGB32_Premultiplied)
+    for scale in (100.0, 10.0, 1.0, 0.1, 0.01):
+        view.scale = scale
+        view.render(image)   # builds the polylines the first time
+        t0 = time.perf_counter()
+        for i in range(10):
+            view.render(image)
+        print('%8g px/m: level %d, %.1f ms a frame' % (
+              scale, view._level(), (time.perf_counter() - t0) * 100))
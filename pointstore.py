@@ -0,0 +1,405 @@
+from __future__ import division, print_function
+import math
+import time
+import sqlite3
+from collections import namedtuple
+
+"""
+Persistent survey point store for Simple Survey
+
+Every Start and Mark is appended to an SQLite database along with its
+position, fix quality and time.  Points are never updated or deleted.
+An in-memory grid index over the points, projected onto the current
+session's local grid, answers "nearest point" and "points within a
+radius" queries without touching the database.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# grid index cell size in metres
+CELL_SIZE = 5.0
+
+# cells nearest() looks through before going to a coarser grid
+_RING_CELLS = 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    origin_latitude REAL NOT NULL,
+    origin_longitude REAL NOT NULL,
+    origin_altitude REAL
+);
+CREATE TABLE IF NOT EXISTS points (
+    id INTEGER PRIMARY KEY,
+    session INTEGER NOT NULL REFERENCES sessions(id),
+    kind TEXT NOT NULL,
+    name TEXT,
+    northing REAL NOT NULL,
+    easting REAL NOT NULL,
+    altitude REAL,
+    latitude REAL NOT NULL,
+    longitude REAL NOT NULL,
+    quality INTEGER,
+    time REAL NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS points_append_only_update
+    BEFORE UPDATE ON points
+    BEGIN SELECT RAISE(ABORT, 'points are append only'); END;
+CREATE TRIGGER IF NOT EXISTS points_append_only_delete
+    BEFORE DELETE ON points
+    BEGIN SELECT RAISE(ABORT, 'points are append only'); END;
+"""
+
+# northing and easting are on the local grid of the session the point
+# was taken in; nearest() and within() return them re-projected onto the
+# current session's grid
+StoredPoint = namedtuple('StoredPoint', ['id', 'session', 'kind', 'name',
+                                         'northing', 'easting', 'altitude',
+                                         'latitude', 'longitude', 'quality',
+                                         'time'])
+
+
+class GridIndex(object):
+    """
+    Uniform grid over (northing, easting) points.  Each cell holds the
+    keys of the points in it.
+    """
+
+    def __init__(self, cell_size=CELL_SIZE):
+        self.cell_size = cell_size
+        self._initial_cell_size = cell_size
+        self._cells = {}
+        self._points = {}
+        self._bounds = None   # (min row, min col, max row, max col)
+        self._built = 0       # most points held since the cells were laid
+        self._coarse = None   # the same points in bigger cells, once needed
+
+    def __len__(self):
+        return len(self._points)
+
+    def clear(self):
+        self.cell_size = self._initial_cell_size
+        self._cells.clear()
+        self._points.clear()
+        self._bounds = None
+        self._built = 0
+        self._coarse = None
+
+    def _cell(self, northing, easting):
+        return (int(math.floor(northing / self.cell_size)),
+                int(math.floor(easting / self.cell_size)))
+
+    def insert(self, key, northing, easting):
+        self._points[key] = (northing, easting)
+        self._built = max(self._built, len(self._points))
+        self._add(key, self._cell(northing, easting))
+        if self._coarse is not None:
+            self._coarse.insert(key, northing, easting)
+
+    def _add(self, key, cell):
+        if self._bounds is None:
+            self._bounds = cell + cell
+        else:
+            (r0, c0, r1, c1) = self._bounds
+            self._bounds = (min(r0, cell[0]), min(c0, cell[1]),
+                            max(r1, cell[0]), max(c1, cell[1]))
+        bucket = self._cells.get(cell)
+        if bucket is None:
+            self._cells[cell] = [key]
+        else:
+            bucket.append(key)
+
+    def remove(self, key):
+        """
+        Take a point out.  Once only a quarter of the points are left the
+        cells are laid again twice the size, over just what's left, so
+        nearest() isn't searching rings of emptied cells.
+        """
+        (northing, easting) = self._points.pop(key)
+        cell = self._cell(northing, easting)
+        bucket = self._cells[cell]
+        bucket.remove(key)
+        if not bucket:
+            del self._cells[cell]
+        if self._coarse is not None:
+            self._coarse.remove(key)
+        if len(self._points) * 4 < self._built:
+            self._rebuild(self.cell_size * 2)
+
+    def _rebuild(self, cell_size):
+        self.cell_size = cell_size
+        self._cells = {}
+        self._bounds = None
+        self._built = len(self._points)
+        coarse = self._coarse
+        self._coarse = None
+        for (key, (northing, easting)) in self._points.items():
+            self._add(key, self._cell(northing, easting))
+        if coarse is not None:
+            self._coarser()
+
+    def position(self, key):
+        return self._points[key]
+
+    def within(self, northing, easting, radius):
+        """
+        Returns a list of (distance, key) within radius, nearest first.
+        """
+        size = self.cell_size
+        (row0, col0) = self._cell(northing - radius, easting - radius)
+        (row1, col1) = self._cell(northing + radius, easting + radius)
+        cells = self._cells
+        points = self._points
+        r2 = radius * radius
+
+        found = []
+        for row in range(row0, row1 + 1):
+            for col in range(col0, col1 + 1):
+                bucket = cells.get((row, col))
+                if not bucket:
+                    continue
+                for key in bucket:
+                    (n, e) = points[key]
+                    d2 = (n - northing) * (n - northing) + \
+                         (e - easting) * (e - easting)
+                    if d2 <= r2:
+                        found.append((math.sqrt(d2), key))
+        found.sort()
+        return found
+
+    def nearest(self, northing, easting):
+        """
+        Returns (distance, key) of the nearest point, or None if the
+        index is empty.  Searches rings of cells outwards until no
+        unsearched cell could hold anything closer.  If that's a long
+        way across empty cells it's handed to a grid of cells eight
+        times the size, kept from then on alongside this one.
+        """
+        if not self._points:
+            return None
+
+        cells = self._cells
+        points = self._points
+        size = self.cell_size
+        (row0, col0) = self._cell(northing, easting)
+
+        best = None
+        best_d2 = float('inf')
+        # start at the first ring that touches an occupied cell, and stop
+        # once we've gone past all of them
+        (r0, c0, r1, c1) = self._bounds
+        ring = max(0, r0 - row0, row0 - r1, c0 - col0, col0 - c1)
+        max_ring = max(row0 - r0, r1 - row0, col0 - c0, c1 - col0)
+        searched = 0
+        while ring <= max_ring:
+            searched += 8 * ring or 1
+            if searched > _RING_CELLS:
+                return self._coarser().nearest(northing, easting)
+            for (row, col) in self._ring(row0, col0, ring):
+                bucket = cells.get((row, col))
+                if not bucket:
+                    continue
+                for key in bucket:
+                    (n, e) = points[key]
+                    d2 = (n - northing) * (n - northing) + \
+                         (e - easting) * (e - easting)
+                    if d2 < best_d2:
+                        best_d2 = d2
+                        best = key
+            # everything outside this ring is at least ring * size away
+            if best is not None and best_d2 <= (ring * size) ** 2:
+                break
+            ring += 1
+
+        return (math.sqrt(best_d2), best)
+
+    def _coarser(self):
+        if self._coarse is None:
+            self._coarse = GridIndex(self.cell_size * 8)
+            for (key, (northing, easting)) in self._points.items():
+                self._coarse.insert(key, northing, easting)
+        return self._coarse
+
+    @staticmethod
+    def _ring(row0, col0, ring):
+        if ring == 0:
+            yield (row0, col0)
+            return
+        for col in range(col0 - ring, col0 + ring + 1):
+            yield (row0 - ring, col)
+            yield (row0 + ring, col)
+        for row in range(row0 - ring + 1, row0 + ring):
+            yield (row, col0 - ring)
+            yield (row, col0 + ring)
+
+
+class PointStore(object):
+    """
+    Append-only SQLite store of surveyed points.
+
+    Call start_session() with the projector for a new Start before
+    adding points; it re-projects every stored point onto that grid for
+    the spatial index.
+    """
+
+    def __init__(self, path, cell_size=CELL_SIZE):
+        self.path = path
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+        self.session = None
+        self.projector = None
+        self.index = GridIndex(cell_size)
+        self._points = {}
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        (count,) = self.db.execute('SELECT COUNT(*) FROM points').fetchone()
+        return count
+
+    def start_session(self, projector, started=None):
+        """
+        Start a new session with its origin at the projector's origin,
+        and rebuild the spatial index on its grid.
+        """
+        cursor = self.db.execute(
+            'INSERT INTO sessions (started, origin_latitude, '
+            'origin_longitude, origin_altitude) VALUES (?, ?, ?, ?)',
+            (started or time.time(), projector.lat0, projector.lon0,
+             projector.h0))
+        self.db.commit()
+        self.session = cursor.lastrowid
+        self.projector = projector
+
+        self.index.clear()
+        self._points.clear()
+        rows = self.db.execute('SELECT * FROM points').fetchall()
+        if rows:
+            (northings, eastings, _) = projector.forward_many(
+                [row[7] for row in rows], [row[8] for row in rows])
+            for (row, northing, easting) in zip(rows, northings, eastings):
+                self._index(StoredPoint(*row), float(northing), float(easting))
+        return self.session
+
+    def _index(self, point, northing, easting):
+        self._points[point.id] = point
+        self.index.insert(point.id, northing, easting)
+
+    def add(self, kind, name, northing, easting, altitude, latitude,
+            longitude, quality=None, timestamp=None):
+        """
+        Append a point taken in the current session and return it.
+        """
+        return self.add_many([(kind, name, northing, easting, altitude,
+                               latitude, longitude, quality, timestamp)])[0]
+
+    def add_many(self, points):
+        """
+        Append a batch of (kind, name, northing, easting, altitude,
+        latitude, longitude, quality, timestamp) tuples in one
+        transaction.
+        """
+        if self.session is None:
+            raise RuntimeError('start_session() must be called first')
+
+        added = []
+        now = time.time()
+        with self.db:
+            for (kind, name, northing, easting, altitude, latitude,
+                 longitude, quality, timestamp) in points:
+                values = (self.session, kind, name, northing, easting,
+                          altitude, latitude, longitude, quality,
+                          timestamp or now)
+                cursor = self.db.execute(
+                    'INSERT INTO points (session, kind, name, northing, '
+                    'easting, altitude, latitude, longitude, quality, time) '
+                    'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)', values)
+                point = StoredPoint(cursor.lastrowid, *values)
+                self._index(point, northing, easting)
+                added.append(point)
+        return added
+
+    def _located(self, key):
+        (northing, easting) = self.index.position(key)
+        return self._points[key]._replace(northing=northing, easting=easting)
+
+    def nearest(self, northing, easting):
+        """
+        Returns (distance, StoredPoint) for the stored point nearest the
+        given position on the current grid, or None.
+        """
+        found = self.index.nearest(northing, easting)
+        if found is None:
+            return None
+        return (found[0], self._located(found[1]))
+
+    def within(self, northing, easting, radius):
+        """
+        Returns a list of (distance, StoredPoint) within radius metres,
+        nearest first.
+        """
+        return [(distance, self._located(key)) for (distance, key) in
+                self.index.within(northing, easting, radius)]
+
+    def points(self, session=None):
+        """
+        Iterate over stored points in the order they were taken,
+        optionally just those from one session.
+        """
+        if session is None:
+            cursor = self.db.execute('SELECT * FROM points ORDER BY id')
+        else:
+            cursor = self.db.execute('SELECT * FROM points WHERE session = ? '
+                                     'ORDER BY id', (session,))
+        for row in cursor:
+            yield StoredPoint(*row)
+
+
+if __name__ == "__main__":
+    # query times with 100k points spread over a 500 m square
+    import random
+    import projection
+
+    random.seed(1)
+    store = PointStore(':memory:')
+    projector = projection.LocalProjector(40.0, -111.0, 1400.0)
+    store.start_session(projector)
+
+    t = time.perf_counter()
+    batch = []
+    for i in range(100000):
+        n = random.uniform(-250, 250)
+        e = random.uniform(-250, 250)
+        (lat, lon, h) = projector.inverse(n, e)
+        batch.append(('mark', 'Mark %d' % i, n, e, 1400.0, lat, lon, 4, None))
+    store.add_many(batch)
+    print('added %d points in %.2f s' % (len(store), time.perf_counter() - t))
+
+    queries = [(random.uniform(-300, 300), random.uniform(-300, 300))
+               for x in range(10000)]
+    t = time.perf_counter()
+    for (n, e) in queries:
+        store.nearest(n, e)
+    print('nearest:  %.1f us/query' % ((time.perf_counter() - t) /
+                                       len(queries) * 1e6))
+
+    t = time.perf_counter()
+    found = 0
+    for (n, e) in queries:
+        found += len(store.within(n, e, 5.0))
+    print('within 5 m: %.1f us/query, %.1f points each' % (
+          (time.perf_counter() - t) / len(queries) * 1e6,
+          found / len(queries)))
+
+    t = time.perf_counter()
+    store.start_session(projection.LocalProjector(40.001, -111.001))
+    print('reindexed on a new start in %.2f s' % (time.perf_counter() - t))
@@ -0,0 +1,122 @@
+from __future__ import division, print_function
+import os
+from collections import namedtuple
+
+"""
+Serial port watcher for Simple Survey
+
+Listing serial ports can take seconds on machines with many virtual or
+Bluetooth ports, so PortWatcher does it in its own thread and reports
+the list only when it changes.  On Linux it watches /sys/class/tty,
+which is cheap to read, and only lists the ports again when a tty
+appears or goes away, so a USB receiver shows up about a second after
+it's plugged in.  Elsewhere it lists them every FALLBACK_INTERVAL.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, Signal, Slot
+
+SYSFS_TTY = '/sys/class/tty'
+
+# how often to look for changes, in ms
+POLL_INTERVAL = 1000
+FALLBACK_INTERVAL = 5000
+
+# name is what to show, location what to open
+SerialPort = namedtuple('SerialPort', ['name', 'location'])
+
+
+def list_ports():
+    """
+    Every serial port, sorted by name.  May be slow.
+    """
+    from qt5pick import QtSerialPort
+    return sorted(SerialPort(info.portName(), info.systemLocation())
+                  for info in QtSerialPort.QSerialPortInfo.availablePorts())
+
+
+def dumps(ports):
+    """
+    ports as a string, for keeping in the settings.
+    """
+    return '\n'.join('%s\t%s' % port for port in ports)
+
+
+def loads(text):
+    ports = []
+    for line in (text or '').splitlines():
+        fields = line.split('\t')
+        if len(fields) == 2:
+            ports.append(SerialPort(*fields))
+    return ports
+
+
+class PortWatcher(QtCore.QObject):
+    """
+    Emits portsChanged with the list of SerialPorts whenever it changes,
+    and once at the start.  Move it to a QThread with start_watcher().
+    """
+
+    portsChanged = Signal(object)
+
+    def __init__(self, parent=None):
+        super(PortWatcher, self).__init__(parent)
+        self.ports = None
+        self._ttys = None
+        self._timer = None
+
+    @Slot()
+    def start(self):
+        self._timer = QtCore.QTimer(self)
+        self._timer.timeout.connect(self._poll)
+        if os.path.isdir(SYSFS_TTY):
+            self._timer.start(POLL_INTERVAL)
+        else:
+            self._timer.start(FALLBACK_INTERVAL)
+        self._poll()
+
+    @Slot()
+    def stop(self):
+        if self._timer:
+            self._timer.stop()
+
+    @Slot()
+    def rescan(self):
+        """
+        List the ports now, whether or not anything seems to have changed.
+        """
+        ports = list_ports()
+        if ports != self.ports:
+            self.ports = ports
+            self.portsChanged.emit(ports)
+
+    @Slot()
+    def _poll(self):
+        try:
+            ttys = os.listdir(SYSFS_TTY)
+        except EnvironmentError:
+            self.rescan()
+            return
+        ttys.sort()
+        if ttys != self._ttys:
+            self._ttys = ttys
+            self.rescan()
+
+
+def start_watcher(slot, parent=None):
+    """
+    Start a PortWatcher in a new QThread, with portsChanged connected to
+    slot before the first list is made.  Returns (thread, watcher).
+    """
+    thread = QtCore.QThread(parent)
+    watcher = PortWatcher()
+    watcher.moveToThread(thread)
+    watcher.portsChanged.connect(slot)
+    thread.started.connect(watcher.start)
+    thread.finished.connect(watcher.deleteLater)
+    thread.start()
+    return (thread, watcher)
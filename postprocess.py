@@ -0,0 +1,692 @@
+#!/usr/bin/env python3
+from __future__ import division, print_function
+import os
+import sys
+import gzip
+import time
+import calendar
+import argparse
+from collections import OrderedDict
+
+import numpy
+
+import nmea
+import engine
+import projection
+import survey
+
+"""
+Batch post-processing of NMEA logs for Simple Survey
+
+Parses a whole log (plain, or .gz and .zst as the recorder writes them)
+into columnar numpy arrays instead of a Fix at a time, then projects
+every fix and measures it from the start and mark in a few passes over
+the arrays.  The result is written out as a table, as .npz, .csv or
+.parquet:
+
+    python3 postprocess.py day1.nmea.gz --start 40.1,-111.5,1400 \\
+        --mark 40.1002,-111.5001 --output day1.parquet
+
+LogParser follows nmea.NmeaParser sentence for sentence: the same
+framing and checksums, one fix per GGA (or per RMC until a GGA is seen)
+and the date, speed, heading and sigmas carried forward from the last
+RMC and GST.  Fields are parsed as whole columns; a number is built from
+its digits and divided by a power of ten, which gives the same float as
+float() does.  The odd sentence that doesn't fit that (exponents,
+spaces, very long fields, too few fields) goes through NmeaParser's own
+handlers instead, so the columns match what the live parser would have
+emitted.  measure() uses the same projector and survey maths as
+SurveyEngine, so the numbers agree with what was on screen.
+
+pyarrow is needed for Parquet and zstandard for .zst logs.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# bytes of log parsed at once
+CHUNK_BYTES = 1024 * 1024
+
+# rows formatted at once when writing CSV
+CSV_ROWS = 65536
+
+FIX_COLUMNS = ('time', 'latitude', 'longitude', 'altitude', 'quality',
+               'satellites', 'hdop', 'speed', 'heading', 'lat_sigma',
+               'lon_sigma', 'alt_sigma')
+
+# parser state carried from sentence to sentence, as NmeaParser keeps it
+_STATE = ('time', 'date', 'latitude', 'longitude', 'altitude', 'heading',
+          'speed', 'quality', 'satellites', 'hdop', 'lat_sigma', 'lon_sigma',
+          'alt_sigma')
+
+# missing integers are -1
+_INTEGER_COLUMNS = {'quality': numpy.int8, 'satellites': numpy.int16}
+
+_GGA = 0x474741
+_RMC = 0x524d43
+_GST = 0x475354
+
+# fields longer than this are left to NmeaParser
+_WIDTH = 18
+_COLUMN = numpy.arange(_WIDTH)
+# up to 15 digits a number fits in a double exactly
+_MAX_DIGITS = 15
+_POW10 = numpy.array([float(10 ** k) for k in range(_WIDTH + 1)])
+_PLACE = numpy.array([10 ** k for k in range(_WIDTH + 1)], numpy.int64)
+
+# each byte's digit value, and what kind of byte it is: digits count 1
+# and decimal points 1 << 20, so one sum counts both
+_VALUE = numpy.zeros(256, numpy.uint8)
+_VALUE[48:58] = numpy.arange(10)
+_KIND = numpy.zeros(256)
+_KIND[48:58] = 1
+_KIND[46] = 1 << 20
+_COUNT = numpy.stack((numpy.ones(_WIDTH), numpy.arange(1.0, _WIDTH + 1)))
+
+_HEX = numpy.array(nmea._HEX, dtype=numpy.int16)
+
+_UNSET = object()
+
+# by column, or measurement field; anything else is %.4f
+_CSV_FORMATS = {'time': '%.3f', 'latitude': '%.9f', 'longitude': '%.9f',
+                'altitude': '%.3f', 'quality': '%d', 'satellites': '%d',
+                'hdop': '%.2f', 'speed': '%.3f', 'heading': '%.2f',
+                'lat_sigma': '%.3f', 'lon_sigma': '%.3f',
+                'alt_sigma': '%.3f', 'slope': '%.6f'}
+
+
+def _empty_columns():
+    return OrderedDict((name, numpy.empty(
+        0, _INTEGER_COLUMNS.get(name, float))) for name in FIX_COLUMNS)
+
+
+class _Field(object):
+    """
+    One field of a number of sentences.  number is its digits read as
+    one integer, with a decimal point read as a 0 digit.  point is where
+    the decimal point is, or -1, and whole the number of characters
+    before it (or the length).  plain is True for fields that are only
+    digits with at most one point, after a leading minus if minus is.
+    """
+    __slots__ = ('length', 'first', 'minus', 'digits', 'point', 'whole',
+                 'plain', 'number')
+
+    def __init__(self, a, window, begin, end):
+        length = end - begin
+        width = min(max(int(length.max()) if len(length) else 0, 1), _WIDTH)
+        # right aligned, so each column is worth the same power of ten
+        chars = numpy.where(_COLUMN[:width] >= (width - length)[:, None],
+                            window[end - width, :width], 0)
+        # how many digits and points, and the column of the point (plus
+        # one) if there's only one
+        (count, column) = numpy.dot(_KIND[chars], _COUNT[:, :width].T).astype(
+            numpy.int64).T
+        dots = count >> 20
+
+        self.length = length
+        self.first = numpy.where(length > 0, a[begin], 0)
+        self.minus = self.first == 45
+        self.digits = count & 0xfffff
+        self.point = numpy.where(dots > 0,
+                                 (column >> 20) - 1 - (width - length), -1)
+        self.whole = numpy.where(dots > 0, self.point, length)
+        self.plain = (dots <= 1) & (length <= width) & \
+            (self.digits + dots + self.minus == length)
+        # exact as doubles up to 15 digits
+        place = _PLACE[width - 1::-1]
+        if width > _MAX_DIGITS:
+            self.number = numpy.dot(_VALUE[chars].astype(numpy.int64), place)
+        else:
+            self.number = numpy.dot(_VALUE[chars], place.astype(float)
+                                    ).astype(numpy.int64)
+
+
+def _mantissa(number, point, after):
+    # number, with a point read as 0 that has after digits after it,
+    # without the 0
+    upper = number // _PLACE[numpy.minimum(after + 1, _WIDTH)]
+    return numpy.where(point >= 0, number - 9 * upper * _PLACE[after],
+                       number)
+
+
+def _decimal(field, signed=True):
+    """
+    float() of each field, and whether it's a plain decimal number we
+    could do.  Empty ones are None, which isn't an error.
+    """
+    after = numpy.where(field.point >= 0, field.length - field.point - 1, 0)
+    value = _mantissa(field.number, field.point, after) / _POW10[after]
+    ok = field.plain & (field.digits >= 1) & (field.digits <= _MAX_DIGITS)
+    if signed:
+        value = numpy.where(field.minus, -value, value)
+    else:
+        ok &= ~field.minus
+    empty = field.length == 0
+    return (numpy.where(empty, numpy.nan, value), ok | empty)
+
+
+def _integer(field):
+    # int() of each field
+    ok = field.plain & (field.point < 0) & ~field.minus & \
+        (field.length >= 1)
+    return (field.number, ok)
+
+
+def _time(field):
+    # hhmmss.sss, None if it's too short
+    seconds = numpy.maximum(field.length - 4, 0)
+    scale = _PLACE[seconds]
+    after = numpy.where(field.point >= 0, field.length - field.point - 1, 0)
+    hhmm = field.number // scale
+    value = ((hhmm // 100 * 3600 + hhmm % 100 * 60) +
+             _mantissa(field.number % scale, field.point, after) /
+             _POW10[after])
+    ok = field.plain & ~field.minus & (field.whole >= 4) & \
+        (field.digits <= _MAX_DIGITS)
+    short = field.length < 6
+    return (numpy.where(short, numpy.nan, value), ok | short)
+
+
+def _angle(field, hemisphere):
+    # [d]ddmm.mmmm, None if it's empty
+    minutes = field.length - field.whole + 2
+    scale = _PLACE[numpy.minimum(minutes, _WIDTH)]
+    after = numpy.where(field.point >= 0, field.length - field.point - 1, 0)
+    value = field.number // scale + \
+        _mantissa(field.number % scale, field.point, after) / \
+        _POW10[after] / 60.0
+    value = numpy.where((hemisphere.length == 1) &
+                        ((hemisphere.first == 83) | (hemisphere.first == 87)),
+                        -value, value)
+    ok = field.plain & ~field.minus & (field.whole >= 3) & \
+        (field.digits <= _MAX_DIGITS)
+    empty = field.length == 0
+    return (numpy.where(empty, numpy.nan, value), ok | empty, empty)
+
+
+class LogParser(object):
+    """
+    Feed it bytes with feed() and get back the new fixes as an ordered
+    dict of FIX_COLUMNS arrays, like NmeaParser.feed() but a column per
+    Fix field.  time is UTC seconds since 1970, or since midnight if no
+    RMC with a date has been seen, as track.timestamp() has it.  Missing
+    values are NaN, or -1 for quality and satellites.
+    """
+
+    def __init__(self):
+        self._buf = b''
+        self._have_gga = False
+        # last value of each _STATE field, dates as yyyymmdd
+        self._state = dict((name, numpy.nan) for name in _STATE)
+        self._scratch = nmea.NmeaParser()
+        self.sentences = 0
+        self.errors = 0
+
+    def feed(self, data):
+        """
+        Parse every complete line in data plus whatever was left over
+        from the last call.
+        """
+        buf = self._buf + data if self._buf else data
+        end = buf.rfind(b'\n') + 1
+        self._buf = buf[end:]
+        if not end:
+            return _empty_columns()
+        # room for a whole field either side
+        a = numpy.zeros(end + 2 * _WIDTH, numpy.uint8)
+        a[_WIDTH:_WIDTH + end] = numpy.frombuffer(buf, numpy.uint8, end)
+        return self._block(a)
+
+    def _block(self, a):
+        newlines = numpy.flatnonzero(a == 10)
+        dollars = numpy.flatnonzero(a == 36)
+
+        # the last $ on each line, and the first * after it
+        line = numpy.searchsorted(newlines, dollars)
+        last = numpy.ones(len(dollars), bool)
+        last[:-1] = line[:-1] != line[1:]
+        start = dollars[last]
+        nl = newlines[line[last]]
+        stars = numpy.append(numpy.flatnonzero(a == 42), len(a) + 3)
+        star = stars[numpy.searchsorted(stars, start)]
+
+        framed = (star + 2 < nl) & (nl - start <= nmea.MAX_SENTENCE)
+        self.errors += int(len(start) - framed.sum())
+        (start, star) = (start[framed], star[framed])
+
+        # XOR from just after the $ to just before the *
+        acc = numpy.bitwise_xor.accumulate(a)
+        hi = _HEX[a[star + 1]]
+        lo = _HEX[a[star + 2]]
+        valid = (hi >= 0) & (lo >= 0) & \
+            ((acc[star - 1] ^ acc[start]) == hi * 16 + lo)
+        self.errors += int(len(start) - valid.sum())
+        (start, star) = (start[valid], star[valid])
+
+        # $ttSSS: the talker is ignored
+        typed = star >= start + 6
+        (start, star) = (start[typed], star[typed])
+        kind = (a[start + 3].astype(numpy.int32) << 16 |
+                a[start + 4].astype(numpy.int32) << 8 | a[start + 5])
+        known = (kind == _GGA) | (kind == _RMC) | (kind == _GST)
+        (start, star, kind) = (start[known], star[known], kind[known])
+        self.sentences += len(start)
+
+        gga = kind == _GGA
+        # every GGA, even a bad one, stops RMC making fixes
+        have_gga = numpy.cumsum(gga) > 0
+        have_gga[1:] = have_gga[:-1]
+        if len(have_gga):
+            have_gga[0] = False
+        have_gga |= self._have_gga
+        self._have_gga = self._have_gga or bool(gga.any())
+
+        commas = numpy.append(numpy.flatnonzero(a == 44), len(a) + 3)
+        # every _WIDTH bytes starting at each byte
+        window = numpy.lib.stride_tricks.as_strided(
+            a, (len(a) - _WIDTH + 1, _WIDTH), a.strides * 2, writeable=False)
+        assigned = dict((name, []) for name in _STATE)
+        fixes = []
+        slow = []
+        for (code, handler, count) in ((_GGA, self._gga, 9),
+                                       (_RMC, self._rmc, 9),
+                                       (_GST, self._gst, 8)):
+            which = numpy.flatnonzero(kind == code)
+            s = start[which]
+            (have, fields) = self._fields(a, window, commas, s + 7,
+                                          star[which], count)
+            fast = handler(fields, have, have_gga[which], s, assigned, fixes)
+            slow.append(which[~fast])
+
+        # the rest go through NmeaParser's own handlers
+        slow = numpy.sort(numpy.concatenate(slow))
+        self._slow(a, start[slow], star[slow], kind[slow], have_gga[slow],
+                   assigned, fixes)
+
+        fixes = numpy.sort(numpy.concatenate(fixes)) if fixes else \
+            numpy.empty(0, numpy.int64)
+        return self._columns(fixes, assigned)
+
+    def _fields(self, a, window, commas, begin, star, count):
+        """
+        The first count comma separated fields from begin to star of
+        each sentence, as (begin, end) position pairs, and which
+        sentences have that many.
+        """
+        c = numpy.searchsorted(commas, begin)
+        have = numpy.searchsorted(commas, star) - c + 1
+        index = numpy.minimum(c[:, None] + numpy.arange(count),
+                              len(commas) - 1)
+        ends = numpy.minimum(commas[index], star[:, None])
+        begins = numpy.empty_like(ends)
+        begins[:, 0] = begin
+        begins[:, 1:] = ends[:, :-1] + 1
+
+        parsed = {}
+
+        def field(i):
+            if i not in parsed:
+                parsed[i] = _Field(a, window, begins[:, i],
+                                   numpy.maximum(ends[:, i], begins[:, i]))
+            return parsed[i]
+        return (have, field)
+
+    def _assign(self, assigned, name, position, value):
+        assigned[name].append((position, value))
+
+    def _gga(self, field, have, have_gga, position, assigned, fixes):
+        # time, lat, N/S, lon, E/W, quality, sats, hdop, alt, ...
+        (quality, ok) = _integer(field(5))
+        # no quality is no fix
+        unknown = field(5).length == 0
+        quality = numpy.where(unknown, nmea.FIX_INVALID, quality)
+        valid = quality != nmea.FIX_INVALID
+
+        (t, ok_t) = _time(field(0))
+        (lat, ok_lat, no_lat) = _angle(field(1), field(2))
+        (lon, ok_lon, no_lon) = _angle(field(3), field(4))
+        (sats, ok_s) = _integer(field(6))
+        no_sats = field(6).length == 0
+        sats = numpy.where(no_sats, numpy.nan, sats)
+        (hdop, ok_h) = _decimal(field(7))
+        (alt, ok_a) = _decimal(field(8))
+        ok = (ok | unknown) & (~valid | (ok_t & ok_lat & ok_lon &
+                                         (ok_s | no_sats) & ok_h & ok_a))
+        fast = (have >= 9) & ok
+
+        self._assign(assigned, 'quality', position[fast], quality[fast])
+        good = fast & valid
+        for (name, value) in (('time', t), ('latitude', lat),
+                              ('longitude', lon), ('satellites', sats),
+                              ('hdop', hdop), ('altitude', alt)):
+            self._assign(assigned, name, position[good], value[good])
+        fixes.append(position[good & ~no_lat & ~no_lon])
+        return fast
+
+    def _rmc(self, field, have, have_gga, position, assigned, fixes):
+        # time, status, lat, N/S, lon, E/W, speed (knots), course, date, ...
+        active = (field(1).length == 1) & (field(1).first == 65)
+
+        (t, ok_t) = _time(field(0))
+        (speed, ok_v) = _decimal(field(6))
+        (heading, ok_h) = _decimal(field(7))
+        (date, ok_d) = _integer(field(8))
+        dated = field(8).length == 6
+        # ddmmyy to yyyymmdd
+        date = (20000000 + date % 100 * 10000 + date // 100 % 100 * 100 +
+                date // 10000)
+        ok = ok_t & ok_v & ok_h & (ok_d | ~dated)
+        alone = ~have_gga
+        if alone.any():
+            # positions only count until there's a GGA
+            (lat, ok_lat, no_lat) = _angle(field(2), field(3))
+            (lon, ok_lon, no_lon) = _angle(field(4), field(5))
+            ok &= have_gga | (ok_lat & ok_lon)
+
+        # an inactive RMC is skipped, so long as it has a status
+        fast = numpy.where(active, (have >= 9) & ok, have >= 2)
+
+        good = fast & active
+        for (name, value) in (('time', t), ('speed', speed * nmea.KNOTS_TO_MS),
+                              ('heading', heading)):
+            self._assign(assigned, name, position[good], value[good])
+        self._assign(assigned, 'date', position[good & dated],
+                     date[good & dated])
+        alone &= good
+        if alone.any():
+            self._assign(assigned, 'latitude', position[alone], lat[alone])
+            self._assign(assigned, 'longitude', position[alone], lon[alone])
+            fixes.append(position[alone & ~no_lat & ~no_lon])
+        return fast
+
+    def _gst(self, field, have, have_gga, position, assigned, fixes):
+        # time, rms, major, minor, orientation, lat sigma, lon sigma, alt sigma
+        fast = have >= 8
+        values = []
+        for i in (5, 6, 7):
+            (value, ok) = _decimal(field(i))
+            fast &= ok
+            values.append(value)
+        for (name, value) in zip(('lat_sigma', 'lon_sigma', 'alt_sigma'),
+                                 values):
+            self._assign(assigned, name, position[fast], value[fast])
+        return fast
+
+    def _slow(self, a, start, star, kind, have_gga, assigned, fixes):
+        """
+        Parse sentences one at a time with NmeaParser's handlers,
+        noting every field they set, even if they go on to fail.
+        """
+        scratch = self._scratch
+        handlers = {_GGA: scratch._gga, _RMC: scratch._rmc,
+                    _GST: scratch._gst}
+        emitted = []
+        for (s, e, code, before) in zip(start.tolist(), star.tolist(),
+                                        kind.tolist(), have_gga.tolist()):
+            handler = handlers[code]
+            for name in _STATE:
+                setattr(scratch, name, _UNSET)
+            scratch._have_gga = before
+            try:
+                fix = handler(a[s + 7:e].tobytes().split(b','))
+            except (ValueError, IndexError):
+                # it was counted as a sentence in _block
+                self.errors += 1
+                self.sentences -= 1
+                fix = None
+
+            for name in _STATE:
+                value = getattr(scratch, name)
+                if value is _UNSET:
+                    continue
+                if value is None:
+                    value = numpy.nan
+                elif name == 'date':
+                    value = value[0] * 10000 + value[1] * 100 + value[2]
+                self._assign(assigned, name, numpy.array([s]),
+                             numpy.array([value], float))
+            if fix is not None:
+                emitted.append(s)
+        if emitted:
+            fixes.append(numpy.array(emitted, numpy.int64))
+
+    def _columns(self, fixes, assigned):
+        """
+        Each field's value at each fix: the last one set at or before it.
+        """
+        state = {}
+        for name in _STATE:
+            position = numpy.concatenate(
+                [p for (p, v) in assigned[name]] or [numpy.empty(0, int)])
+            value = numpy.concatenate(
+                [v for (p, v) in assigned[name]] or [numpy.empty(0)])
+            last = self._state[name]
+            if not len(position):
+                state[name] = numpy.full(len(fixes), last)
+                continue
+            value = value.astype(float)
+            order = numpy.argsort(position, kind='stable')
+            (position, value) = (position[order], value[order])
+            i = numpy.searchsorted(position, fixes, side='right') - 1
+            state[name] = numpy.where(i >= 0, value[i], last)
+            self._state[name] = value[-1]
+
+        date = state.pop('date')
+        days = numpy.full(len(fixes), numpy.nan)
+        for code in numpy.unique(date[~numpy.isnan(date)]).tolist():
+            code = int(code)
+            try:
+                days[date == code] = calendar.timegm(
+                    (code // 10000, code // 100 % 100, code % 100, 0, 0, 0))
+            except ValueError:
+                # no such day
+                pass
+        state['time'] = numpy.where(numpy.isnan(days), state['time'],
+                                    days + state['time'])
+
+        columns = OrderedDict()
+        for name in FIX_COLUMNS:
+            value = state[name]
+            if name in _INTEGER_COLUMNS:
+                value = numpy.where(numpy.isnan(value), -1, value).astype(
+                    _INTEGER_COLUMNS[name])
+            columns[name] = value
+        return columns
+
+
+def open_log(path):
+    """
+    Open a log for reading bytes, decompressing .gz and .zst.
+    """
+    if path.endswith('.gz'):
+        return gzip.open(path, 'rb')
+    if path.endswith('.zst'):
+        import zstandard
+        return zstandard.ZstdDecompressor().stream_reader(
+            open(path, 'rb'), read_across_frames=True, closefd=True)
+    return open(path, 'rb')
+
+
+def parse(chunks, parser=None):
+    """
+    Parse chunks of bytes into one ordered dict of FIX_COLUMNS arrays.
+    """
+    if parser is None:
+        parser = LogParser()
+    pieces = [parser.feed(data) for data in chunks]
+    if not pieces:
+        return _empty_columns()
+    return OrderedDict((name, numpy.concatenate([p[name] for p in pieces]))
+                       for name in FIX_COLUMNS)
+
+
+def read_log(path, parser=None):
+    """
+    Parse a whole log into an ordered dict of FIX_COLUMNS arrays.
+    """
+    with open_log(path) as f:
+        return parse(iter(lambda: f.read(CHUNK_BYTES), b''), parser)
+
+
+def _reference_altitude(altitude, given):
+    # as SurveyEngine does, a reference without one takes the first
+    # altitude after it's set
+    if given is not None:
+        return given
+    known = numpy.flatnonzero(altitude)
+    return float(altitude[known[0]]) if len(known) else None
+
+
+def measure(columns, start=None, mark=None):
+    """
+    Project every fix in columns onto the local grid around start and
+    measure it from start and mark, which are (lat, lon[, altitude])
+    tuples.  start defaults to the first fix.  Returns columns plus
+    northing and easting and start_ and mark_ columns of each of
+    engine.MEASUREMENT_FIELDS.
+    """
+    latitude = columns['latitude']
+    longitude = columns['longitude']
+    # the engine keeps the last altitude it had, and 0 counts as none
+    altitude = columns['altitude']
+    known = ~numpy.isnan(altitude)
+    last = numpy.maximum.accumulate(numpy.where(known,
+                                                numpy.arange(len(altitude)),
+                                                -1))
+    altitude = numpy.where(last >= 0, altitude[numpy.maximum(last, 0)], 0.0)
+
+    result = OrderedDict(columns)
+    if start is None:
+        if not len(latitude):
+            return result
+        start = (float(latitude[0]), float(longitude[0]),
+                 float(altitude[0]) or None)
+    projector = projection.LocalProjector(start[0], start[1])
+    (northing, easting, _) = projector.forward_many(latitude, longitude)
+    result['northing'] = northing
+    result['easting'] = easting
+
+    measured = numpy.where(altitude != 0, altitude, numpy.nan)
+    references = [(engine.START, (0.0, 0.0), start)]
+    if mark is not None:
+        references.append((engine.MARK,
+                           projector.forward(mark[0], mark[1])[:2], mark))
+    for (name, grid, position) in references:
+        reference_altitude = _reference_altitude(
+            altitude, position[2] if len(position) > 2 else None)
+        m = survey.measure_many(name, grid, reference_altitude, northing,
+                                easting, measured)
+        for field in engine.MEASUREMENT_FIELDS:
+            result['%s_%s' % (name.lower(), field)] = getattr(m, field)
+    return result
+
+
+def write_npz(path, columns):
+    numpy.savez(path, **columns)
+
+
+def write_parquet(path, columns):
+    import pyarrow
+    import pyarrow.parquet
+    pyarrow.parquet.write_table(pyarrow.table(columns), path)
+
+
+def write_csv(path, columns):
+    """
+    A header and a line per row, with NaNs and -1s left blank.
+    """
+    names = list(columns)
+    with open(path, 'w') as f:
+        f.write(','.join(names) + '\n')
+        rows = len(columns[names[0]]) if names else 0
+        for offset in range(0, rows, CSV_ROWS):
+            text = []
+            for name in names:
+                fmt = _CSV_FORMATS.get(name) or \
+                    _CSV_FORMATS.get(name.partition('_')[2], '%.4f')
+                values = columns[name][offset:offset + CSV_ROWS].tolist()
+                if name in _INTEGER_COLUMNS:
+                    text.append([fmt % v if v >= 0 else '' for v in values])
+                else:
+                    text.append([fmt % v if v == v else '' for v in values])
+            f.write(''.join(','.join(row) + '\n' for row in zip(*text)))
+
+
+WRITERS = OrderedDict((('.npz', write_npz), ('.csv', write_csv),
+                       ('.parquet', write_parquet)))
+
+
+def write_table(path, columns):
+    """
+    Write columns out in the format path's extension asks for.
+    """
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in WRITERS:
+        raise ValueError('unknown table format %s, use one of %s' % (
+            extension or path, ', '.join(WRITERS)))
+    WRITERS[extension](path, columns)
+
+
+def _position(text):
+    values = [float(v) for v in text.replace(',', ' ').split()]
+    if len(values) not in (2, 3):
+        raise argparse.ArgumentTypeError('expected LAT,LON[,ALTITUDE]: %s'
+                                         % text)
+    return tuple(values)
+
+
+def _table_path(log):
+    path = log
+    for extension in ('.gz', '.zst', '.nmea', '.log', '.txt'):
+        if path.endswith(extension):
+            path = path[:-len(extension)]
+    return path + '.npz'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Parse an NMEA log and measure every fix from the start '
+                    'and mark, as a table')
+    parser.add_argument('log', help='NMEA log, optionally .gz or .zst')
+    parser.add_argument('--start', type=_position, metavar='LAT,LON[,ALT]',
+                        help='start point, the first fix if not given')
+    parser.add_argument('--mark', type=_position, metavar='LAT,LON[,ALT]')
+    parser.add_argument('--output', metavar='FILE',
+                        help='.npz, .csv or .parquet table to write, the '
+                             'log name with .npz if not given')
+    args = parser.parse_args(argv)
+    output = args.output or _table_path(args.log)
+    if os.path.splitext(output)[1].lower() not in WRITERS:
+        parser.error('--output must end in one of %s' % ', '.join(WRITERS))
+
+    # find out before parsing the log
+    for (needed, module, what) in (
+            (output.lower().endswith('.parquet'), 'pyarrow',
+             'Writing Parquet'),
+            (args.log.endswith('.zst'), 'zstandard', 'Reading .zst logs')):
+        if needed:
+            try:
+                __import__(module)
+            except ImportError:
+                parser.error('%s needs the %s module' % (what, module))
+
+    t = time.perf_counter()
+    log = LogParser()
+    try:
+        columns = measure(read_log(args.log, log), args.start, args.mark)
+        parsed = time.perf_counter() - t
+        write_table(output, columns)
+    except (IOError, OSError) as e:
+        parser.error(str(e))
+    fixes = len(columns['time'])
+    print('%s: %d fixes from %d sentences (%d errors), %.0f fixes/s; '
+          'written in %.2f s' % (output, fixes, log.sentences, log.errors,
+                                 fixes / parsed if parsed else 0.0,
+                                 time.perf_counter() - t - parsed),
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
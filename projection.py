@@ -0,0 +1,271 @@
+from __future__ import division, print_function
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+"""
+Local grid projections for Simple Survey
+
+LocalProjector turns latitude/longitude into north/east/up metres on a
+plane tangent to the WGS84 ellipsoid at the start point.  Everything that
+depends on the origin is worked out once in the constructor so projecting
+a fix is a handful of trig calls and multiply-adds.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# WGS84 ellipsoid
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+WGS84_E2 = WGS84_F * (2 - WGS84_F)
+
+
+def get_zone_number(lat, lon):
+    """
+    algorithm borrowed from utm module
+
+    where possible it returns a floating point pseudo utm zone
+    so that our local grid always lines up with due north
+    """
+
+    if 56 <= lat < 64 and 3 <= lon < 12:
+        return 32
+
+    if 72 <= lat <= 84 and lon >= 0:
+        if lon <= 9: return 31
+        elif lon <= 21: return 33
+        elif lon <= 33: return 35
+        elif lon <= 42: return 37
+
+    # to get a pseudo zone centered on this longitude, we
+    # leave the decimal bits in and subtract 0.5.  This seems
+    # to give us an accurate grid centered on our present location
+    return (lon + 180) / 6 + 1 - 0.5
+
+
+class LocalProjector(object):
+    """
+    East-north-up tangent plane centred on (lat0, lon0, h0).
+
+    Points are converted to earth-centred coordinates in a frame rotated
+    so the origin sits on the prime meridian, then rotated into the local
+    horizon.  Unlike a transverse mercator grid there is no scale factor
+    or convergence to worry about, so north is true north and horizontal
+    distances are ground distances for anything within a few kilometres.
+    """
+
+    def __init__(self, lat0, lon0, h0=0.0):
+        self.lat0 = lat0
+        self.lon0 = lon0
+        self.h0 = h0
+
+        phi = math.radians(lat0)
+        self._lam0 = math.radians(lon0)
+        self._sin0 = math.sin(phi)
+        self._cos0 = math.cos(phi)
+
+        n = WGS84_A / math.sqrt(1 - WGS84_E2 * self._sin0 * self._sin0)
+        self._x0 = (n + h0) * self._cos0
+        self._z0 = (n * (1 - WGS84_E2) + h0) * self._sin0
+
+    def forward(self, lat, lon, h=None):
+        """
+        Returns (northing, easting, up) in metres from the origin.  If h
+        is None the origin height is used, so up is just the earth's
+        curvature dropping away.
+        """
+        if h is None:
+            h = self.h0
+
+        phi = math.radians(lat)
+        lam = math.radians(lon) - self._lam0
+        sinphi = math.sin(phi)
+        cosphi = math.cos(phi)
+
+        n = WGS84_A / math.sqrt(1 - WGS84_E2 * sinphi * sinphi)
+        r = (n + h) * cosphi
+        dx = r * math.cos(lam) - self._x0
+        dz = (n * (1 - WGS84_E2) + h) * sinphi - self._z0
+
+        return (self._cos0 * dz - self._sin0 * dx,
+                r * math.sin(lam),
+                self._cos0 * dx + self._sin0 * dz)
+
+    def inverse(self, northing, easting, up=0.0):
+        """
+        Returns (lat, lon, h) for a point on the local grid.
+        """
+        x = self._x0 + self._cos0 * up - self._sin0 * northing
+        y = easting
+        z = self._z0 + self._sin0 * up + self._cos0 * northing
+
+        p = math.hypot(x, y)
+        lat = math.atan2(z, p * (1 - WGS84_E2))
+        # converges to well under a millimetre in a few iterations
+        for i in range(4):
+            sinphi = math.sin(lat)
+            n = WGS84_A / math.sqrt(1 - WGS84_E2 * sinphi * sinphi)
+            lat = math.atan2(z + WGS84_E2 * n * sinphi, p)
+
+        sinphi = math.sin(lat)
+        cosphi = math.cos(lat)
+        n = WGS84_A / math.sqrt(1 - WGS84_E2 * sinphi * sinphi)
+        if abs(cosphi) > 1e-9:
+            h = p / cosphi - n
+        else:
+            h = abs(z) - n * (1 - WGS84_E2)
+
+        return (math.degrees(lat),
+                math.degrees(math.atan2(y, x) + self._lam0),
+                h)
+
+    def forward_many(self, lats, lons, heights=None):
+        """
+        Batch version of forward().  Takes sequences or arrays of
+        latitude and longitude (and optionally height) and returns
+        (northing, easting, up) arrays.  Uses numpy if it's installed,
+        otherwise returns lists.
+        """
+        if numpy is None:
+            if heights is None:
+                heights = [self.h0] * len(lats)
+            result = [self.forward(lat, lon, h)
+                      for (lat, lon, h) in zip(lats, lons, heights)]
+            return ([r[0] for r in result],
+                    [r[1] for r in result],
+                    [r[2] for r in result])
+
+        phi = numpy.radians(numpy.asarray(lats, dtype=float))
+        lam = numpy.radians(numpy.asarray(lons, dtype=float)) - self._lam0
+        if heights is None:
+            h = self.h0
+        else:
+            h = numpy.asarray(heights, dtype=float)
+
+        sinphi = numpy.sin(phi)
+        n = WGS84_A / numpy.sqrt(1 - WGS84_E2 * sinphi * sinphi)
+        r = (n + h) * numpy.cos(phi)
+        dx = r * numpy.cos(lam) - self._x0
+        dz = (n * (1 - WGS84_E2) + h) * sinphi - self._z0
+
+        return (self._cos0 * dz - self._sin0 * dx,
+                r * numpy.sin(lam),
+                self._cos0 * dx + self._sin0 * dz)
+
+    def inverse_many(self, northings, eastings, ups=0.0):
+        """
+        Batch version of inverse().  Returns (lat, lon, h) arrays, or
+        lists without numpy.
+        """
+        if numpy is None:
+            if not hasattr(ups, '__len__'):
+                ups = [ups] * len(northings)
+            result = [self.inverse(n, e, u)
+                      for (n, e, u) in zip(northings, eastings, ups)]
+            return ([r[0] for r in result],
+                    [r[1] for r in result],
+                    [r[2] for r in result])
+
+        northing = numpy.asarray(northings, dtype=float)
+        up = numpy.asarray(ups, dtype=float)
+        x = self._x0 + self._cos0 * up - self._sin0 * northing
+        y = numpy.asarray(eastings, dtype=float)
+        z = self._z0 + self._sin0 * up + self._cos0 * northing
+
+        p = numpy.hypot(x, y)
+        lat = numpy.arctan2(z, p * (1 - WGS84_E2))
+        for i in range(4):
+            sinphi = numpy.sin(lat)
+            n = WGS84_A / numpy.sqrt(1 - WGS84_E2 * sinphi * sinphi)
+            lat = numpy.arctan2(z + WGS84_E2 * n * sinphi, p)
+
+        sinphi = numpy.sin(lat)
+        n = WGS84_A / numpy.sqrt(1 - WGS84_E2 * sinphi * sinphi)
+        # nothing here is near enough a pole for p / cos(lat) to fail
+        h = p / numpy.cos(lat) - n
+
+        return (numpy.degrees(lat),
+                numpy.degrees(numpy.arctan2(y, x) + self._lam0),
+                h)
+
+
+class PseudoUtmProjector(object):
+    """
+    The original pseudo UTM grid, using a fractional zone centred on the
+    origin longitude.  Kept for comparison; needs the utm module.
+    """
+
+    def __init__(self, lat0, lon0, h0=0.0):
+        import utm
+        self._from_latlon = utm.from_latlon
+        self.zone = get_zone_number(lat0, lon0)
+        (easting, northing, _, _) = utm.from_latlon(
+                 lat0, lon0, force_zone_number=self.zone)
+        self._origin = (northing, easting)
+        self.h0 = h0
+
+    def forward(self, lat, lon, h=None):
+        (easting, northing, _, _) = self._from_latlon(
+                 lat, lon, force_zone_number=self.zone)
+        if h is None:
+            h = self.h0
+        return (northing - self._origin[0], easting - self._origin[1],
+                h - self.h0)
+
+
+if __name__ == "__main__":
+    # compare speed and accuracy against the pseudo utm grid
+    import random
+    import time
+
+    random.seed(1)
+    lat0 = 40.0
+    lon0 = -111.0
+    points = [(lat0 + random.uniform(-0.005, 0.005),
+               lon0 + random.uniform(-0.005, 0.005)) for x in range(20000)]
+
+    local = LocalProjector(lat0, lon0)
+    t = time.perf_counter()
+    for (lat, lon) in points:
+        local.forward(lat, lon)
+    elapsed = time.perf_counter() - t
+    print('LocalProjector.forward:      %9.0f fixes/s' % (
+          len(points) / elapsed))
+
+    t = time.perf_counter()
+    local.forward_many([p[0] for p in points], [p[1] for p in points])
+    elapsed = time.perf_counter() - t
+    print('LocalProjector.forward_many: %9.0f fixes/s' % (
+          len(points) / elapsed))
+
+    worst = 0
+    for (lat, lon) in points:
+        (n, e, u) = local.forward(lat, lon)
+        (lat2, lon2, h2) = local.inverse(n, e, u)
+        worst = max(worst, abs(lat2 - lat), abs(lon2 - lon))
+    print('round trip error:            %9.2g deg' % worst)
+
+    try:
+        pseudo = PseudoUtmProjector(lat0, lon0)
+    except ImportError:
+        print('utm module not available, skipping pseudo UTM comparison')
+    else:
+        t = time.perf_counter()
+        for (lat, lon) in points:
+            pseudo.forward(lat, lon)
+        elapsed = time.perf_counter() - t
+        print('pseudo UTM:                  %9.0f fixes/s' % (
+              len(points) / elapsed))
+
+        worst = 0
+        for (lat, lon) in points:
+            (n1, e1, u1) = local.forward(lat, lon)
+            (n2, e2, u2) = pseudo.forward(lat, lon)
+            worst = max(worst, math.hypot(n1 - n2, e1 - e2))
+        print('largest difference:          %9.3f m' % worst)
@@ -1,15 +1,19 @@
+import io
 import os
+import sys
+import marshal
+import importlib
 
 #Choose which Qt binding to use
 if 'WHICH_QT' in os.environ and \
    os.environ['WHICH_QT'].lower() != "pyqt" or \
    not 'WHICH_QT' in os.environ:
     try:
-        from PySide2 import QtCore, QtGui, QtWidgets, QtUiTools, QtPositioning, QtNetwork, QtSerialPort
+        from PySide2 import QtCore
         from PySide2.QtCore import Slot, Signal, QMetaObject, Property
-        from pyside_dynamic import UiLoader
 
         def load_ui(ui_file, widget, widget_mapping = None):
+            from pyside_dynamic import UiLoader
             if widget_mapping is None:
                 widget_mapping = {}
 
@@ -21,19 +25,77 @@ if 'WHICH_QT' in os.environ and \
     except ImportError:
         USE_PYSIDE = False
 if not USE_PYSIDE:
-    from PyQt5 import QtCore, QtGui, uic, QtWidgets, QtPositioning, QtNetwork, QtSerialPort
+    from PyQt5 import QtCore
     from PyQt5.QtCore import pyqtSlot as Slot
     from PyQt5.QtCore import pyqtSignal as Signal
     from PyQt5.QtCore import pyqtProperty as Property
 
+    def _compiled_ui(ui_file):
+        """
+        The code object uic would generate for ui_file, cached in
+        __pycache__ next to it and rebuilt whenever the .ui file's mtime
+        or size, PyQt or Python changes.  Importing and running uic's
+        parser takes longer than building the widgets.
+        """
+        stat = os.stat(ui_file)
+        key = ('%s %d %d %s' % (QtCore.PYQT_VERSION_STR, stat.st_mtime_ns,
+                                stat.st_size, sys.version)).encode('utf-8')
+        (directory, name) = os.path.split(os.path.abspath(ui_file))
+        cache = os.path.join(directory, '__pycache__', name + '.cache')
+        try:
+            with open(cache, 'rb') as f:
+                if f.readline().rstrip(b'\n') == key:
+                    return marshal.loads(f.read())
+        except (EnvironmentError, ValueError, EOFError):
+            pass
+
+        from PyQt5 import uic
+        source = io.StringIO()
+        uic.compileUi(ui_file, source)
+        code = compile(source.getvalue(), ui_file, 'exec')
+        try:
+            if not os.path.isdir(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache))
+            with open(cache + '.tmp', 'wb') as f:
+                f.write(key + b'\n')
+                f.write(marshal.dumps(code))
+            os.replace(cache + '.tmp', cache)
+        except EnvironmentError:
+            # read-only install; just compile it every time
+            pass
+        return code
+
     def load_ui(ui_file, widget, widget_mapping = None):
-        uic.loadUi(ui_file, widget)
+        namespace = {}
+        exec(_compiled_ui(ui_file), namespace)
+        form = [value for (name, value) in namespace.items()
+                if name.startswith('Ui_')][0]()
+        form.setupUi(widget)
+        # like uic.loadUi, the child widgets become attributes of widget
+        for (name, value) in vars(form).items():
+            setattr(widget, name, value)
+
+# only imported when first used: the networking and positioning modules
+# aren't needed to show the window, and the headless mode never loads
+# the widgets at all
+_LAZY_MODULES = ('QtGui', 'QtWidgets', 'QtPositioning', 'QtNetwork',
+                 'QtSerialPort', 'QtWebSockets')
+
+def __getattr__(name):
+    if name not in _LAZY_MODULES:
+        raise AttributeError('module %r has no attribute %r' % (__name__,
+                                                                name))
+    module = importlib.import_module('%s.%s' % (
+        'PySide2' if USE_PYSIDE else 'PyQt5', name))
+    globals()[name] = module
+    return module
 
 #from blocksignalqt import BlockSignal
 
 if __name__ == "__main__":
     import sys
 
+    QtWidgets = __getattr__('QtWidgets')
     app = QtWidgets.QApplication(sys.argv)
     w = QtWidgets.QWidget()
     b = QtWidgets.QLabel(w)
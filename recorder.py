@@ -0,0 +1,217 @@
+from __future__ import division, print_function
+import os
+import gzip
+import time
+import threading
+from collections import namedtuple
+
+"""
+Raw NMEA recorder for Simple Survey
+
+RawRecorder keeps the raw bytes from a live source (serial port or TCP)
+so a day's work can be replayed or reprocessed later.  write() only
+appends to an in-memory batch; a background thread compresses and
+writes the batches, starting a new file when the current one gets too
+big or too old.  If the disk can't keep up the backlog is capped and
+anything beyond it is counted as dropped rather than ever blocking the
+caller.
+
+Files are named <prefix>-YYYYmmdd-HHMMSS.nmea plus .gz or .zst.  zstd
+needs the zstandard module.  Decompress a file before replaying it.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# start a new file after this many uncompressed bytes or seconds
+MAX_BYTES = 64 * 1024 * 1024
+MAX_SECONDS = 3600
+
+# the writer wakes up when this much is waiting, or every FLUSH_INTERVAL
+BATCH_BYTES = 64 * 1024
+FLUSH_INTERVAL = 2.0
+
+# drop data rather than queue more than this many bytes
+MAX_BACKLOG = 16 * 1024 * 1024
+
+COMPRESSIONS = ('gzip', 'zstd', 'none')
+_SUFFIXES = {'gzip': '.gz', 'zstd': '.zst', 'none': ''}
+
+# path is the file being written.  written is uncompressed bytes on
+# disk, backlog bytes waiting to be written, dropped bytes lost because
+# the backlog was full.
+RecorderStatus = namedtuple('RecorderStatus', ['path', 'files', 'written',
+                                               'backlog', 'dropped'])
+
+
+class RawRecorder(object):
+
+    def __init__(self, directory, prefix='nmea', compression='gzip',
+                 max_bytes=MAX_BYTES, max_seconds=MAX_SECONDS,
+                 max_backlog=MAX_BACKLOG):
+        if compression not in COMPRESSIONS:
+            raise ValueError('unknown compression %s' % compression)
+        if compression == 'zstd':
+            import zstandard
+            self._zstd = zstandard.ZstdCompressor()
+
+        self.directory = directory
+        self.prefix = prefix
+        self.compression = compression
+        self.max_bytes = max_bytes
+        self.max_seconds = max_seconds
+        self.max_backlog = max_backlog
+
+        self.path = None
+        self.files = 0
+        self.written = 0
+        self.dropped = 0
+        self._file = None
+        self._file_bytes = 0
+        self._opened = 0
+
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = []
+        self._backlog = 0
+        self._closing = False
+        self.error = None
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        self._thread = threading.Thread(target=self._run,
+                                        name='nmea recorder')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, data):
+        """
+        Queue data to be written.  Never blocks on the disk.
+        """
+        with self._lock:
+            if self._closing or self._backlog + len(data) > self.max_backlog:
+                self.dropped += len(data)
+                return
+            self._pending.append(data)
+            self._backlog += len(data)
+            full = self._backlog >= BATCH_BYTES
+        if full:
+            self._wake.set()
+
+    @property
+    def backlog(self):
+        return self._backlog
+
+    def status(self):
+        return RecorderStatus(self.path, self.files, self.written,
+                              self._backlog, self.dropped)
+
+    def close(self):
+        """
+        Write out whatever is waiting and close the file.
+        """
+        with self._lock:
+            self._closing = True
+        self._wake.set()
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            self._wake.wait(FLUSH_INTERVAL)
+            self._wake.clear()
+            with self._lock:
+                chunks = self._pending
+                self._pending = []
+                closing = self._closing
+
+            if chunks:
+                data = b''.join(chunks)
+                lost = 0
+                try:
+                    self._write(data)
+                except EnvironmentError as e:
+                    # keep going; the backlog shows nothing's being written
+                    self.error = e
+                    lost = len(data)
+                with self._lock:
+                    self._backlog -= len(data)
+                    self.dropped += lost
+
+            if closing:
+                break
+        self._close_file()
+
+    def _write(self, data):
+        now = time.time()
+        if self._file is None or self._file_bytes >= self.max_bytes or \
+           now - self._opened >= self.max_seconds:
+            self._open(now)
+
+        if self.compression == 'zstd':
+            self._file.write(self._zstd_stream.compress(data))
+        else:
+            self._file.write(data)
+        self._file_bytes += len(data)
+        self.written += len(data)
+
+    def _open(self, now):
+        self._close_file()
+
+        name = '%s-%s.nmea' % (self.prefix, time.strftime(
+            '%Y%m%d-%H%M%S', time.localtime(now)))
+        path = os.path.join(self.directory, name + _SUFFIXES[self.compression])
+        count = 1
+        while os.path.exists(path):
+            count += 1
+            path = os.path.join(self.directory, '%s.%d%s' % (
+                                name, count, _SUFFIXES[self.compression]))
+
+        if self.compression == 'gzip':
+            self._file = gzip.open(path, 'wb', compresslevel=6)
+        else:
+            self._file = open(path, 'wb')
+            if self.compression == 'zstd':
+                self._zstd_stream = self._zstd.compressobj()
+        self.path = path
+        self.files += 1
+        self._file_bytes = 0
+        self._opened = now
+
+    def _close_file(self):
+        if self._file is None:
+            return
+        if self.compression == 'zstd':
+            self._file.write(self._zstd_stream.flush())
+        self._file.close()
+        self._file = None
+
+
+if __name__ == "__main__":
+    # record ten minutes of 50 Hz data as fast as we can, timing write()
+    import tempfile
+    import ssbench
+
+    epochs = ssbench.synthetic_stream(50, 600)
+    directory = tempfile.mkdtemp()
+    recorder = RawRecorder(directory, max_bytes=1024 * 1024)
+
+    samples = []
+    clock = time.perf_counter
+    t = clock()
+    for data in epochs:
+        t0 = clock()
+        recorder.write(data)
+        samples.append(clock() - t0)
+    recorder.close()
+    total = clock() - t
+
+    stats = ssbench.percentiles(samples)
+    compressed = sum(os.path.getsize(os.path.join(directory, name))
+                     for name in os.listdir(directory))
+    print('%d epochs in %.2f s, write() p99 %.1f us, max %.1f us' % (
+          len(epochs), total, stats['p99'], stats['max']))
+    print('%d files, %d bytes -> %d bytes compressed, %d dropped' % (
+          recorder.files, recorder.written, compressed, recorder.dropped))
@@ -0,0 +1,77 @@
+from __future__ import division, print_function
+import display
+
+"""
+Table model of measurements against every reference point
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore
+
+
+class ReferenceTableModel(QtCore.QAbstractTableModel):
+    """
+    One row per reference point in a survey.ReferenceSet.  update() is
+    given the latest survey.Measurements and only signals the rows whose
+    text changed.
+    """
+
+    COLUMNS = ('Name', 'North/South', 'East/West', 'Bearing', 'Distance',
+               'Elevation', 'Slope')
+
+    def __init__(self, parent=None):
+        super(ReferenceTableModel, self).__init__(parent)
+        self._rows = []
+
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self._rows)
+
+    def columnCount(self, parent=QtCore.QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.COLUMNS)
+
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        if role == QtCore.Qt.DisplayRole:
+            return self._rows[index.row()][index.column()]
+        if role == QtCore.Qt.TextAlignmentRole and index.column() > 0:
+            return int(QtCore.Qt.AlignRight | QtCore.Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=QtCore.Qt.DisplayRole):
+        if role == QtCore.Qt.DisplayRole and \
+           orientation == QtCore.Qt.Horizontal:
+            return self.COLUMNS[section]
+        return None
+
+    def clear(self):
+        if self._rows:
+            self.beginResetModel()
+            self._rows = []
+            self.endResetModel()
+
+    def update(self, measurements, units):
+        rows = [(measurements.names[i],) +
+                display.format_measurement(measurements.row(i), units)
+                for i in range(len(measurements))]
+
+        if len(rows) != len(self._rows) or \
+           any(new[0] != old[0] for (new, old) in zip(rows, self._rows)):
+            self.beginResetModel()
+            self._rows = rows
+            self.endResetModel()
+            return
+
+        last = len(self.COLUMNS) - 1
+        for (i, (new, old)) in enumerate(zip(rows, self._rows)):
+            if new != old:
+                self._rows[i] = new
+                self.dataChanged.emit(self.index(i, 0), self.index(i, last))
@@ -0,0 +1,348 @@
+from __future__ import division, print_function
+import os
+import mmap
+import struct
+import datetime
+from array import array
+from bisect import bisect_left, bisect_right
+
+"""
+Seekable NMEA log replay for Simple Survey
+
+NmeaLogIndex memory-maps a log file and keeps a sidecar index (log file
+name plus .idx) of epoch times to byte offsets, so jumping to any point
+in a long recording is a binary search.  The index is built on the first
+open and rebuilt whenever the log's size or modification time changes.
+
+LogReplay hands out the bytes that are due at a given wall clock time,
+taking pause, seeking and a speed multiplier into account.  It doesn't
+know about Qt; sources.ReplaySource drives it from a timer.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+INDEX_SUFFIX = '.idx'
+INDEX_MAGIC = b'SSIDX\x00\x00\x01'
+_INDEX_HEADER = struct.Struct('<8sqdq')   # magic, log size, mtime, entries
+
+# if nothing happens in the log for longer than this many seconds, jump
+# straight to the next epoch instead of waiting for it
+MAX_GAP = 5.0
+
+# epochs handed out per read() when replaying as fast as possible
+UNTHROTTLED_BATCH = 200
+
+_EPOCH_ORDINAL = datetime.date(1970, 1, 1).toordinal()
+
+
+def _time_of_day(line):
+    # hhmmss.sss in the first field
+    comma = line.find(b',', 7)
+    field = line[7:comma]
+    if len(field) < 6:
+        return None
+    try:
+        return (int(field[0:2]) * 3600 + int(field[2:4]) * 60 +
+                float(field[4:]))
+    except ValueError:
+        return None
+
+
+def _rmc_day(line):
+    # days since 1970 from the ddmmyy field of an RMC sentence
+    fields = line.split(b',')
+    if len(fields) < 10 or len(fields[9]) < 6:
+        return None
+    date = fields[9]
+    try:
+        return datetime.date(2000 + int(date[4:6]), int(date[2:4]),
+                             int(date[0:2])).toordinal() - _EPOCH_ORDINAL
+    except ValueError:
+        return None
+
+
+class NmeaLogIndex(object):
+    """
+    Memory mapped NMEA log with an index of epoch start offsets.
+
+    times holds the time of each epoch in seconds (since 1970 if the log
+    has RMC dates in it, otherwise since the start of the first day) and
+    offsets the byte offset where that epoch starts.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        stat = os.fstat(self._file.fileno())
+        self.size = stat.st_size
+        self._mtime = stat.st_mtime
+
+        if self.size:
+            self.data = mmap.mmap(self._file.fileno(), 0,
+                                  access=mmap.ACCESS_READ)
+        else:
+            self.data = b''
+
+        self.times = array('d')
+        self.offsets = array('q')
+        if not self._load_index():
+            self._build_index()
+            self._save_index()
+
+    def close(self):
+        if isinstance(self.data, mmap.mmap):
+            self.data.close()
+        self.data = b''
+        self._file.close()
+
+    def __len__(self):
+        return len(self.times)
+
+    @property
+    def start_time(self):
+        return self.times[0] if self.times else 0.0
+
+    @property
+    def end_time(self):
+        return self.times[-1] if self.times else 0.0
+
+    def find(self, log_time):
+        """
+        Index of the first epoch at or after log_time.
+        """
+        return bisect_left(self.times, log_time)
+
+    def end_offset(self, entry):
+        """
+        Byte offset where epoch number entry ends.
+        """
+        if entry + 1 < len(self.offsets):
+            return self.offsets[entry + 1]
+        return self.size
+
+    def _index_path(self):
+        return self.path + INDEX_SUFFIX
+
+    def _load_index(self):
+        try:
+            with open(self._index_path(), 'rb') as f:
+                header = f.read(_INDEX_HEADER.size)
+                if len(header) != _INDEX_HEADER.size:
+                    return False
+                (magic, size, mtime, count) = _INDEX_HEADER.unpack(header)
+                if magic != INDEX_MAGIC or size != self.size or \
+                   mtime != self._mtime:
+                    return False
+                self.times.fromfile(f, count)
+                self.offsets.fromfile(f, count)
+        except (IOError, OSError, EOFError):
+            self.times = array('d')
+            self.offsets = array('q')
+            return False
+        return True
+
+    def _save_index(self):
+        try:
+            with open(self._index_path(), 'wb') as f:
+                f.write(_INDEX_HEADER.pack(INDEX_MAGIC, self.size,
+                                           self._mtime, len(self.times)))
+                self.times.tofile(f)
+                self.offsets.tofile(f)
+        except (IOError, OSError):
+            # read only media; we'll just have to index again next time
+            pass
+
+    def _build_index(self):
+        data = self.data
+        times = self.times
+        offsets = self.offsets
+
+        # the first RMC date sets the day; we track midnight rollovers
+        # from there
+        day = None
+        rmc = data.find(b'RMC,')
+        while rmc >= 0 and day is None:
+            start = data.rfind(b'$', 0, rmc)
+            end = data.find(b'\n', rmc)
+            if end < 0:
+                end = self.size
+            if start >= 0:
+                day = _rmc_day(data[start:end])
+            rmc = data.find(b'RMC,', end)
+        if day is None:
+            day = 0
+
+        last_tod = None
+        last_time = None
+        pos = 0
+        while pos < self.size:
+            end = data.find(b'\n', pos)
+            if end < 0:
+                end = self.size
+            start = pos
+            pos = end + 1
+
+            if data[start:start + 1] != b'$' or \
+               data[start + 3:start + 7] not in (b'GGA,', b'RMC,'):
+                continue
+
+            line = data[start:end]
+            tod = _time_of_day(line)
+            if tod is None:
+                continue
+
+            if data[start + 3:start + 6] == b'RMC':
+                rmc_day = _rmc_day(line)
+                if rmc_day is not None:
+                    day = rmc_day
+                    last_tod = tod
+            if last_tod is not None and tod < last_tod - 43200:
+                day += 1
+            last_tod = tod
+
+            log_time = day * 86400 + tod
+            if last_time is not None and log_time <= last_time:
+                # same epoch, or the log went backwards; either way keep
+                # the index sorted
+                continue
+
+            # the first epoch also picks up any header junk before it
+            offsets.append(start if times else 0)
+            times.append(log_time)
+            last_time = log_time
+
+
+class LogReplay(object):
+    """
+    Decides which part of an indexed log is due at a given moment.
+
+    Call read(now) periodically with a monotonic clock; it returns the
+    bytes for every epoch whose time has come.  speed is a multiplier on
+    real time; None (or 0) replays as fast as read() is called.
+    """
+
+    def __init__(self, index, speed=1.0, max_gap=MAX_GAP):
+        self.index = index
+        self.max_gap = max_gap
+        self.paused = False
+        self._speed = speed or None
+        self._entry = 0
+        self._anchor_wall = None
+        self._anchor_log = index.start_time
+
+    @property
+    def at_end(self):
+        return self._entry >= len(self.index)
+
+    @property
+    def time(self):
+        """
+        Log time of the last epoch handed out.
+        """
+        if self._entry == 0:
+            return self.index.start_time
+        return self.index.times[self._entry - 1]
+
+    @property
+    def elapsed(self):
+        return self.time - self.index.start_time
+
+    @property
+    def duration(self):
+        return self.index.end_time - self.index.start_time
+
+    def get_speed(self):
+        return self._speed
+
+    def set_speed(self, speed, now=None):
+        # re-anchor so the change takes effect from the current position
+        self._anchor_log = self._log_time(now)
+        self._anchor_wall = now
+        self._speed = speed or None
+
+    speed = property(get_speed, set_speed)
+
+    def pause(self, now=None):
+        if not self.paused:
+            self._anchor_log = self._log_time(now)
+            self.paused = True
+
+    def resume(self, now=None):
+        if self.paused:
+            self._anchor_wall = now
+            self.paused = False
+
+    def seek(self, log_time, now=None):
+        """
+        Jump to the first epoch at or after log_time.
+        """
+        self._entry = self.index.find(log_time)
+        self._anchor_log = log_time
+        self._anchor_wall = now
+
+    def seek_relative(self, seconds, now=None):
+        target = self._log_time(now) + seconds
+        target = max(self.index.start_time, min(target, self.index.end_time))
+        self.seek(target, now)
+
+    def _log_time(self, now):
+        if self.paused or self._speed is None or \
+           self._anchor_wall is None or now is None:
+            if self._speed is None:
+                return self.time
+            return self._anchor_log
+        return self._anchor_log + (now - self._anchor_wall) * self._speed
+
+    def read(self, now):
+        """
+        Returns the bytes that are due at wall clock time now, which may
+        be empty.
+        """
+        index = self.index
+        count = len(index)
+        first = self._entry
+        if self.paused or first >= count:
+            return b''
+
+        if self._speed is None:
+            last = min(count, first + UNTHROTTLED_BATCH)
+        else:
+            if self._anchor_wall is None:
+                self._anchor_wall = now
+            target = self._log_time(now)
+            last = bisect_right(index.times, target, first)
+            if last == first and index.times[first] - target > self.max_gap:
+                # long gap in the log; skip ahead rather than wait
+                self._anchor_log = index.times[first]
+                self._anchor_wall = now
+                last = first + 1
+
+        if last == first:
+            return b''
+
+        self._entry = last
+        return index.data[index.offsets[first]:index.end_offset(last - 1)]
+
+
+if __name__ == "__main__":
+    # index a log and replay it as fast as possible
+    import sys
+    import time
+    import nmea
+
+    t = time.perf_counter()
+    index = NmeaLogIndex(sys.argv[1])
+    print('%d epochs, %.0f s long, indexed in %.3f s' % (
+          len(index), index.end_time - index.start_time,
+          time.perf_counter() - t))
+
+    replay = LogReplay(index, speed=None)
+    parser = nmea.NmeaParser()
+    fixes = 0
+    t = time.perf_counter()
+    while not replay.at_end:
+        fixes += len(parser.feed(replay.read(0)))
+    print('%d fixes replayed in %.3f s' % (fixes, time.perf_counter() - t))
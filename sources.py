@@ -0,0 +1,319 @@
+from __future__ import division, print_function
+import time
+import random
+from collections import namedtuple
+import nmea
+import replay
+
+"""
+NMEA position sources for Simple Survey
+
+These wrap a QIODevice (serial port, TCP socket, etc) or a log file and
+feed the raw bytes to our own nmea.NmeaParser instead of
+QNmeaPositionInfoSource.  TcpSource keeps reconnecting to a server in
+the background when the connection drops.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, QtNetwork, Signal, Slot
+
+# how long without a fix before we complain, in ms
+UPDATE_TIMEOUT = 5000
+
+# how often the replay source checks for due epochs, in ms
+REPLAY_TICK = 20
+
+# TcpSource waits between RECONNECT_MIN and RECONNECT_MAX ms before
+# trying again, doubling each time, and gives up on a connection attempt
+# after CONNECT_TIMEOUT ms
+RECONNECT_MIN = 500
+RECONNECT_MAX = 30000
+CONNECT_TIMEOUT = 10000
+
+# state is 'connecting', 'connected', 'waiting' (to reconnect) or
+# 'stopped'.  error is why the last connection failed, retry_in the
+# seconds until the next attempt while waiting.
+ConnectionStatus = namedtuple('ConnectionStatus', ['state', 'error',
+                                                   'attempts', 'reconnects',
+                                                   'retry_in'])
+
+
+class NmeaSource(QtCore.QObject):
+    """
+    Base for our sources.  Emits fixUpdated with an nmea.Fix for each
+    position epoch, and mirrors just enough of the
+    QGeoPositionInfoSource API for SimpleSurveyGui.
+    """
+
+    fixUpdated = Signal(object)
+    updateTimeout = Signal()
+
+    def __init__(self, parent=None):
+        super(NmeaSource, self).__init__(parent)
+        self.parser = nmea.NmeaParser()
+
+        self._timeout = QtCore.QTimer(self)
+        self._timeout.setSingleShot(True)
+        self._timeout.setInterval(UPDATE_TIMEOUT)
+        self._timeout.timeout.connect(self.updateTimeout)
+
+    def startUpdates(self):
+        self._timeout.start()
+
+    def stopUpdates(self):
+        self._timeout.stop()
+
+    def _feed(self, data):
+        fixes = self.parser.feed(data)
+        if fixes:
+            self._timeout.start()
+            for fix in fixes:
+                self.fixUpdated.emit(fix)
+
+
+class NmeaDeviceSource(NmeaSource):
+    """
+    Reads NMEA from a QIODevice as it arrives.  If recorder is set to a
+    recorder.RawRecorder the raw bytes are also passed to it.
+    """
+
+    def __init__(self, parent=None):
+        super(NmeaDeviceSource, self).__init__(parent)
+        self._device = None
+        self._running = False
+        self.recorder = None
+
+    def device(self):
+        return self._device
+
+    def setDevice(self, device):
+        self.stopUpdates()
+        self._device = device
+        self.parser.reset()
+
+    def startUpdates(self):
+        if not self._device or self._running:
+            return
+        self._device.readyRead.connect(self._ready_read)
+        self._running = True
+        super(NmeaDeviceSource, self).startUpdates()
+        if not self._device.isOpen():
+            self._open()
+
+    def _open(self):
+        self._device.open(QtCore.QIODevice.ReadOnly)
+
+    def stopUpdates(self):
+        super(NmeaDeviceSource, self).stopUpdates()
+        if self._running:
+            self._device.readyRead.disconnect(self._ready_read)
+            self._running = False
+
+    @Slot()
+    def _ready_read(self):
+        data = bytes(self._device.readAll())
+        if self.recorder:
+            self.recorder.write(data)
+        self._feed(data)
+
+
+class TcpSource(NmeaDeviceSource):
+    """
+    Reads NMEA from a TCP server.  Whenever the connection fails, drops
+    or goes quiet for UPDATE_TIMEOUT, it reconnects in the background
+    with exponential backoff and jitter.  Whatever arrived before a drop
+    is read first, and the parser starts each line at its last $, so
+    only the sentence the drop cut off is lost.  connectionChanged is
+    emitted on every change of state; see status().
+    """
+
+    connectionChanged = Signal()
+
+    def __init__(self, hostname, port, parent=None):
+        super(TcpSource, self).__init__(parent)
+        self.hostname = hostname
+        self.port = port
+        self.state = 'stopped'
+        self.error = None
+        self.attempts = 0      # failed attempts since the last connection
+        self.reconnects = 0    # successful reconnections
+        self._ever_connected = False
+        self._retry_at = None
+
+        self._timer = QtCore.QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.timeout.connect(self._timer_fired)
+        self.updateTimeout.connect(self._quiet)
+
+        self.setDevice(QtNetwork.QTcpSocket(self))
+        self._device.connected.connect(self._connected)
+        self._device.disconnected.connect(self._lost)
+        self._device.error.connect(self._lost)
+
+    def status(self):
+        retry_in = None
+        if self._retry_at is not None:
+            retry_in = max(0.0, self._retry_at - time.monotonic())
+        return ConnectionStatus(self.state, self.error, self.attempts,
+                                self.reconnects, retry_in)
+
+    def _set_state(self, state):
+        self.state = state
+        self.connectionChanged.emit()
+
+    def _open(self):
+        self._retry_at = None
+        self._device.abort()
+        self._set_state('connecting')
+        self._timer.start(CONNECT_TIMEOUT)
+        self._device.connectToHost(self.hostname, self.port)
+
+    def stopUpdates(self):
+        super(TcpSource, self).stopUpdates()
+        self._timer.stop()
+        self._retry_at = None
+        if self.state != 'stopped':
+            self.state = 'stopped'
+            self._device.abort()
+            self.connectionChanged.emit()
+
+    @Slot()
+    def _connected(self):
+        self._timer.stop()
+        if self._ever_connected:
+            self.reconnects += 1
+        self._ever_connected = True
+        self.attempts = 0
+        self.error = None
+        self._timeout.start()
+        self._set_state('connected')
+
+    def _lost(self, *args):
+        # error and disconnected often both fire for the same drop
+        if self.state not in ('connecting', 'connected'):
+            return
+        self._retry_later(self._device.errorString())
+
+    @Slot()
+    def _quiet(self):
+        if self.state == 'connected':
+            self._retry_later('No data for %g s' % (UPDATE_TIMEOUT / 1000))
+
+    @Slot()
+    def _timer_fired(self):
+        if self.state == 'connecting':
+            self._retry_later('Timed out connecting')
+        elif self.state == 'waiting':
+            self._open()
+
+    def _retry_later(self, error):
+        self.state = 'waiting'
+        self.error = error
+        self.attempts += 1
+        # keep the sentences that arrived before the drop
+        if self._running and self._device.bytesAvailable():
+            self._ready_read()
+        self._device.abort()
+        # exponential backoff, with jitter so a site full of receivers
+        # doesn't hammer the server in step
+        delay = min(RECONNECT_MAX, RECONNECT_MIN * 2 ** (self.attempts - 1))
+        delay = random.uniform(delay / 2, delay)
+        self._retry_at = time.monotonic() + delay / 1000
+        self._timer.start(int(delay))
+        self.connectionChanged.emit()
+
+
+class ReplaySource(NmeaSource):
+    """
+    Plays back an NMEA log file through replay.LogReplay, with seeking,
+    pausing and a speed multiplier.  A speed of None replays as fast as
+    possible.
+    """
+
+    finished = Signal()
+
+    def __init__(self, parent=None):
+        super(ReplaySource, self).__init__(parent)
+        self.index = None
+        self.replay = None
+        self._speed = 1.0
+
+        self._tick = QtCore.QTimer(self)
+        self._tick.timeout.connect(self._read)
+
+    def setFile(self, filename):
+        self.close()
+        self.index = replay.NmeaLogIndex(filename)
+        self.replay = replay.LogReplay(self.index, self._speed)
+        self.parser.reset()
+
+    def close(self):
+        self.stopUpdates()
+        if self.index:
+            self.index.close()
+            self.index = None
+            self.replay = None
+
+    def startUpdates(self):
+        if not self.replay:
+            return
+        self._tick.setInterval(0 if self._speed is None else REPLAY_TICK)
+        self._tick.start()
+        super(ReplaySource, self).startUpdates()
+
+    def stopUpdates(self):
+        super(ReplaySource, self).stopUpdates()
+        self._tick.stop()
+
+    def get_speed(self):
+        return self._speed
+
+    def set_speed(self, speed):
+        self._speed = speed or None
+        if self.replay:
+            self.replay.set_speed(self._speed, time.monotonic())
+        if self._tick.isActive():
+            self._tick.setInterval(0 if self._speed is None else REPLAY_TICK)
+
+    speed = property(get_speed, set_speed)
+
+    @property
+    def paused(self):
+        return self.replay is not None and self.replay.paused
+
+    def pause(self):
+        if self.replay:
+            self.replay.pause(time.monotonic())
+            self._timeout.stop()
+
+    def resume(self):
+        if self.replay:
+            self.replay.resume(time.monotonic())
+            self._timeout.start()
+
+    def seek(self, seconds):
+        """
+        Jump to seconds from the start of the log.
+        """
+        if self.replay:
+            self.replay.seek(self.index.start_time + seconds, time.monotonic())
+            self.parser.reset()
+
+    def seek_relative(self, seconds):
+        if self.replay:
+            self.replay.seek_relative(seconds, time.monotonic())
+            self.parser.reset()
+
+    @Slot()
+    def _read(self):
+        if self.replay.at_end:
+            self.stopUpdates()
+            self.finished.emit()
+            return
+        if self.replay.paused:
+            return
+        self._feed(self.replay.read(time.monotonic()))
@@ -0,0 +1,407 @@
+#!/usr/bin/env python3
+from __future__ import division, print_function
+import os
+import sys
+import json
+import math
+import time
+import random
+import platform
+import argparse
+import subprocess
+
+import nmea
+import engine
+import projection
+import survey
+import units
+import postprocess
+
+"""
+Benchmark suite for Simple Survey
+
+Times every stage a fix goes through (NMEA parsing, projection, the
+relative measurements and formatting) on synthetic, reproducible NMEA
+streams, the same streams post-processed as a batch, plus
+SimpleSurveyGui construction and a cold start of the whole
+program (a fresh interpreter up to the window being shown) on the
+offscreen Qt platform.
+Nothing needs a display.  Results are printed and can be saved as JSON
+to compare versions:
+
+    python3 ssbench.py --output bench-$(git describe --always).json
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+DEFAULT_RATES = (1, 10, 20, 50)
+DEFAULT_SECONDS = 600
+PERCENTILES = (50, 90, 99, 99.9)
+
+
+def synthetic_stream(rate, seconds, seed=1, lat0=40.0, lon0=-111.0,
+                     alt0=1400.0):
+    """
+    A reproducible random walk around (lat0, lon0) at rate Hz, as a list
+    of one bytes object per epoch holding its GGA, RMC and GST sentences.
+    """
+    rnd = random.Random(seed)
+    epochs = []
+    metres_lat = 1 / 111000.0
+    metres_lon = 1 / (111000.0 * math.cos(math.radians(lat0)))
+    (north, east, up) = (0.0, 0.0, 0.0)
+    heading = 0.0
+    for i in range(int(rate * seconds)):
+        t = i / rate
+        north += rnd.gauss(0, 0.5 / rate)
+        east += rnd.gauss(0, 0.5 / rate)
+        up += rnd.gauss(0, 0.01 / rate)
+        heading = (heading + rnd.gauss(0, 2)) % 360
+
+        lat = lat0 + north * metres_lat
+        lon = lon0 + east * metres_lon
+        hhmmss = '%02d%02d%06.3f' % (t // 3600 % 24, t // 60 % 60, t % 60)
+        latfield = '%02d%011.8f,%s' % (int(abs(lat)), abs(lat) % 1 * 60,
+                                       'N' if lat >= 0 else 'S')
+        lonfield = '%03d%011.8f,%s' % (int(abs(lon)), abs(lon) % 1 * 60,
+                                       'E' if lon >= 0 else 'W')
+
+        epochs.append(
+            nmea.make_sentence('GNGGA,%s,%s,%s,4,%d,0.6,%.3f,M,-17.500,M,'
+                               '1.0,0000'
+                               % (hhmmss, latfield, lonfield,
+                                  rnd.randint(12, 24), alt0 + up)) +
+            nmea.make_sentence('GNRMC,%s,A,%s,%s,%.3f,%.1f,180618,,,R'
+                               % (hhmmss, latfield, lonfield,
+                                  rnd.uniform(0, 0.1), heading)) +
+            nmea.make_sentence('GNGST,%s,0.01,0.012,0.008,45.0,0.010,0.011,'
+                               '0.020'
+                               % hhmmss))
+    return epochs
+
+
+def percentiles(samples):
+    """
+    Latency summary in microseconds of a list of durations in seconds.
+    """
+    samples = sorted(samples)
+    count = len(samples)
+    result = {}
+    if not count:
+        return result
+    for p in PERCENTILES:
+        result['p%g' % p] = samples[min(count - 1, int(count * p / 100))] * 1e6
+    result['max'] = samples[-1] * 1e6
+    result['mean'] = sum(samples) / count * 1e6
+    return result
+
+
+def bench_pipeline(rate, seconds, seed):
+    """
+    Push one stream through every stage, timing each stage per fix.
+    """
+    clock = time.perf_counter
+    epochs = synthetic_stream(rate, seconds, seed)
+
+    stages = ['parse', 'zone+utm', 'local projection', 'measure',
+              'measure 2 refs', 'measure 50 refs',
+              'engine 1 receiver', 'engine 8 receivers',
+              'format metres', 'format footinch']
+    timings = dict((stage, []) for stage in stages)
+
+    try:
+        import utm
+    except ImportError:
+        utm = None
+        stages.remove('zone+utm')
+        del timings['zone+utm']
+
+    parser = nmea.NmeaParser()
+    metres = units.get('metres')
+    feet = units.get('feet')
+    projector = None
+    utm_zone = None
+    start = (0.0, 0.0)
+    start_altitude = None
+    rnd = random.Random(seed)
+    # a whole SurveyEngine update, with one receiver and with eight
+    # averaged together
+    engines = (('engine 1 receiver', engine.SurveyEngine(), 1),
+               ('engine 8 receivers', engine.SurveyEngine(), 8))
+    two = survey.ReferenceSet()
+    fifty = survey.ReferenceSet()
+    for i in range(50):
+        reference = ('Stake %d' % i, rnd.uniform(-50, 50),
+                     rnd.uniform(-50, 50), None)
+        if i < 2:
+            two.add(*reference)
+        fifty.add(*reference)
+
+    total = clock()
+    fixes = 0
+    for data in epochs:
+        t0 = clock()
+        new_fixes = parser.feed(data)
+        timings['parse'].append(clock() - t0)
+
+        for fix in new_fixes:
+            fixes += 1
+            if projector is None:
+                projector = projection.LocalProjector(fix.latitude,
+                                                      fix.longitude)
+                start_altitude = fix.altitude
+                two.fill_altitude(fix.altitude)
+                fifty.fill_altitude(fix.altitude)
+
+            if utm:
+                t0 = clock()
+                if utm_zone is None:
+                    utm_zone = projection.get_zone_number(fix.latitude,
+                                                          fix.longitude)
+                utm.from_latlon(fix.latitude, fix.longitude,
+                                force_zone_number=utm_zone)
+                timings['zone+utm'].append(clock() - t0)
+
+            t0 = clock()
+            (northing, easting, _) = projector.forward(fix.latitude,
+                                                       fix.longitude)
+            timings['local projection'].append(clock() - t0)
+
+            t0 = clock()
+            m = survey.measure(start, start_altitude, northing, easting,
+                               fix.altitude)
+            timings['measure'].append(clock() - t0)
+
+            for (name, references) in (('measure 2 refs', two),
+                                       ('measure 50 refs', fifty)):
+                t0 = clock()
+                references.measure(northing, easting, fix.altitude)
+                timings[name].append(clock() - t0)
+
+            for (name, survey_engine, receivers) in engines:
+                fix.source = 'rx%d' % (fixes % receivers)
+                t0 = clock()
+                survey_engine.update(fix)
+                timings[name].append(clock() - t0)
+                if survey_engine.projector is None:
+                    survey_engine.set_start()
+
+            for (name, formatter) in (('format metres', metres),
+                                      ('format footinch', feet)):
+                t0 = clock()
+                formatter.length(abs(m.northing))
+                formatter.length(abs(m.easting))
+                formatter.length(m.distance)
+                formatter.height(m.elevation or 0.0)
+                timings[name].append(clock() - t0)
+    total = clock() - total
+
+    return {
+        'rate': rate,
+        'seconds': seconds,
+        'fixes': fixes,
+        'fixes_per_second': fixes / total if total else 0.0,
+        'realtime_factor': seconds / total if total else 0.0,
+        'stages': dict((stage, percentiles(timings[stage]))
+                       for stage in stages),
+    }
+
+
+def bench_postprocess(rate, seconds, seed):
+    """
+    Parse and measure one stream as a batch, as postprocess.py does a
+    log.
+    """
+    data = b''.join(synthetic_stream(rate, seconds, seed))
+    chunk = postprocess.CHUNK_BYTES
+    t = time.perf_counter()
+    columns = postprocess.parse(data[offset:offset + chunk]
+                                for offset in range(0, len(data), chunk))
+    parsed = time.perf_counter() - t
+    t = time.perf_counter()
+    postprocess.measure(columns, mark=(40.0001, -111.0001))
+    measured = time.perf_counter() - t
+    fixes = len(columns['time'])
+
+    return {
+        'fixes': fixes,
+        'parse_fixes_per_second': fixes / parsed if parsed else 0.0,
+        'measure_fixes_per_second': fixes / measured if measured else 0.0,
+        'fixes_per_second': fixes / (parsed + measured) if parsed else 0.0,
+    }
+
+
+def bench_gui(repeats):
+    """
+    Time SimpleSurveyGui construction on the offscreen Qt platform.
+    Uses its own settings so a real configuration isn't touched.
+    """
+    os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    try:
+        from qt5pick import QtCore, QtWidgets
+    except ImportError as e:
+        return {'skipped': str(e)}
+
+    app = QtWidgets.QApplication.instance() or QtWidgets.QApplication([])
+    QtCore.QCoreApplication.setOrganizationName("Simple Survey Benchmark")
+    QtCore.QCoreApplication.setApplicationName("Simple Survey Benchmark")
+
+    clock = time.perf_counter
+    t0 = clock()
+    import simplesurvey
+    import_time = clock() - t0
+
+    samples = []
+    for x in range(repeats):
+        t0 = clock()
+        gui = simplesurvey.SimpleSurveyGui()
+        samples.append(clock() - t0)
+        gui.close()
+        gui.deleteLater()
+        app.processEvents()
+
+    return {
+        'import_seconds': import_time,
+        'construct': percentiles(samples),
+    }
+
+
+# run in a fresh interpreter by bench_startup; prints seconds since the
+# epoch when the window has been painted and when the worker is running
+_STARTUP_SCRIPT = '''
+import sys, time
+sys.path.insert(0, %r)
+from qt5pick import QtCore, QtWidgets
+app = QtWidgets.QApplication(sys.argv)
+QtCore.QCoreApplication.setOrganizationName("Simple Survey Benchmark")
+QtCore.QCoreApplication.setApplicationName("Simple Survey Benchmark")
+import simplesurvey
+shown = []
+start_worker = simplesurvey.SimpleSurveyGui.start_worker
+def painted(gui):
+    shown.append(time.time())
+    start_worker(gui)
+simplesurvey.SimpleSurveyGui.start_worker = painted
+gui = simplesurvey.SimpleSurveyGui()
+gui.show()
+while not gui.worker:
+    app.processEvents()
+print(shown[0], time.time())
+gui.close()
+'''
+
+
+def bench_startup(repeats):
+    """
+    Time a cold start: a new Python process importing everything and
+    painting the main window, then starting the worker thread and the
+    last source.  The first run also builds any caches, so it's
+    reported separately.
+    """
+    env = dict(os.environ)
+    env.setdefault('QT_QPA_PLATFORM', 'offscreen')
+    here = os.path.dirname(os.path.abspath(__file__))
+    script = _STARTUP_SCRIPT % here
+
+    shown = []
+    ready = []
+    for x in range(repeats + 1):
+        t0 = time.time()
+        try:
+            output = subprocess.check_output([sys.executable, '-c', script],
+                                             cwd=here, env=env,
+                                             stderr=subprocess.DEVNULL)
+        except (OSError, subprocess.CalledProcessError) as e:
+            return {'skipped': str(e)}
+        times = [float(t) for t in output.split()[-2:]]
+        shown.append(times[0] - t0)
+        ready.append(times[1] - t0)
+
+    return {
+        'first_shown_seconds': shown[0],
+        'shown': percentiles(shown[1:]),
+        'ready': percentiles(ready[1:]),
+    }
+
+
+def _version():
+    try:
+        return subprocess.check_output(
+            ['git', 'describe', '--always', '--dirty'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode('ascii').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Simple Survey benchmarks')
+    parser.add_argument('--rates',
+                        default=','.join(str(r) for r in DEFAULT_RATES),
+                        help='comma separated fix rates in Hz')
+    parser.add_argument('--seconds', type=float, default=DEFAULT_SECONDS,
+                        help='length of each synthetic stream')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--gui-repeats', type=int, default=5)
+    parser.add_argument('--no-gui', action='store_true',
+                        help='skip timing the GUI construction and startup')
+    parser.add_argument('--startup-repeats', type=int, default=5)
+    parser.add_argument('--output', help='save results as JSON to this file')
+    args = parser.parse_args(argv)
+
+    results = {
+        'version': _version(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'seed': args.seed,
+        'pipeline': [],
+    }
+
+    for rate in [int(r) for r in args.rates.split(',')]:
+        result = bench_pipeline(rate, args.seconds, args.seed)
+        results['pipeline'].append(result)
+        print('%d Hz: %d fixes, %.0f fixes/s (%.0fx real time)' % (
+              rate, result['fixes'], result['fixes_per_second'],
+              result['realtime_factor']))
+        for (stage, stats) in sorted(result['stages'].items()):
+            print('    %-18s p50 %7.1f us  p99 %7.1f us  max %8.1f us' % (
+                  stage, stats['p50'], stats['p99'], stats['max']))
+        result['postprocess'] = bench_postprocess(rate, args.seconds,
+                                                  args.seed)
+        print('    post-processed: %.0f fixes/s (parse %.0f, measure %.0f)' % (
+              result['postprocess']['fixes_per_second'],
+              result['postprocess']['parse_fixes_per_second'],
+              result['postprocess']['measure_fixes_per_second']))
+
+    if not args.no_gui:
+        results['gui'] = bench_gui(args.gui_repeats)
+        if 'skipped' in results['gui']:
+            print('GUI: skipped (%s)' % results['gui']['skipped'])
+        else:
+            print('GUI: import %.1f ms, construct p50 %.1f ms' % (
+                  results['gui']['import_seconds'] * 1000,
+                  results['gui']['construct']['p50'] / 1000))
+
+        results['startup'] = bench_startup(args.startup_repeats)
+        if 'skipped' in results['startup']:
+            print('startup: skipped (%s)' % results['startup']['skipped'])
+        else:
+            print('startup: window shown p50 %.0f ms (first run %.0f ms), '
+                  'worker running p50 %.0f ms' % (
+                  results['startup']['shown']['p50'] / 1000,
+                  results['startup']['first_shown_seconds'] * 1000,
+                  results['startup']['ready']['p50'] / 1000))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+
+    return results
+
+
+if __name__ == "__main__":
+    main()
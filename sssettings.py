@@ -1,17 +1,103 @@
-from qt5pick import QtCore
+from qt5pick import QtCore, Slot
+
+"""
+Settings for Simple Survey
+
+SSSettings reads every setting once when it's made and answers value()
+from memory.  setValue() only changes the copy in memory; the changes
+are written out together FLUSH_DELAY after the last one, or when
+flush() or sync() is called, and when the application quits.  With a
+profile on network storage each write can be slow, and toggling units
+or switching sources changes several settings at once.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# write changes out this long after the last one, in ms
+FLUSH_DELAY = 2000
+
+
+def convert(value, kind):
+    """
+    value, which may be a string from the settings file, as kind: bool,
+    int, float or str.  Raises ValueError if it can't be.
+    """
+    if kind is bool:
+        if isinstance(value, str):
+            if value.lower() in ('true', '1', 'yes', 'on'):
+                return True
+            if value.lower() in ('false', '0', 'no', 'off'):
+                return False
+            raise ValueError('not a boolean: %s' % value)
+        return bool(value)
+    if kind is int:
+        return int(float(value))
+    return kind(value)
+
 
 class SSSettings(QtCore.QSettings):
 
     def __init__ (self, *args, **kwargs):
         super(SSSettings,self).__init__(*args, **kwargs)
+        self._values = dict((key, super(SSSettings, self).value(key))
+                            for key in self.allKeys())
+        self._changed = {}
 
-    def value(self, key, defaultvalue = None):
-        value = super(SSSettings,self).value(key)
+        self._flush_timer = QtCore.QTimer(self)
+        self._flush_timer.setSingleShot(True)
+        self._flush_timer.setInterval(FLUSH_DELAY)
+        self._flush_timer.timeout.connect(self.flush)
+        app = QtCore.QCoreApplication.instance()
+        if app:
+            app.aboutToQuit.connect(self.flush)
 
-        if defaultvalue is not None:
-            if not value:
-                self.setValue(key, defaultvalue)
+    def value(self, key, defaultvalue = None, type = None):
+        """
+        The setting for key, or defaultvalue if it isn't set.  With type
+        (bool, int, float or str) the value is converted, and
+        defaultvalue returned if it can't be.
+        """
+        value = self._values.get(key)
+        if value is None or value == '':
+            return defaultvalue
+        if type is not None:
+            try:
+                return convert(value, type)
+            except (ValueError, TypeError):
                 return defaultvalue
-
         return value
 
+    def setValue(self, key, value):
+        if key in self._values and self._values[key] == value:
+            return
+        self._values[key] = value
+        self._changed[key] = value
+        self._flush_timer.start()
+
+    def contains(self, key):
+        return self._values.get(key) is not None
+
+    def remove(self, key):
+        for name in list(self._values):
+            if name == key or name.startswith(key + '/'):
+                del self._values[name]
+                self._changed.pop(name, None)
+        super(SSSettings, self).remove(key)
+
+    @Slot()
+    def flush(self):
+        """
+        Write out any changes now.
+        """
+        self._flush_timer.stop()
+        changed = self._changed
+        self._changed = {}
+        for (key, value) in changed.items():
+            super(SSSettings, self).setValue(key, value)
+        super(SSSettings, self).sync()
+
+    def sync(self):
+        self.flush()
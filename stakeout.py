@@ -0,0 +1,314 @@
+from __future__ import division, print_function
+import os
+import csv
+import math
+from collections import namedtuple
+
+import numpy
+
+import pointstore
+
+"""
+Stakeout of design points for Simple Survey
+
+Design points, such as the corners of a building square or the grid of
+a pad, are read from a CSV, LandXML or DXF file with their northing,
+easting and elevation relative to Start.  Stakeout keeps them in the
+same kind of grid index the point store uses, so finding the nearest
+one still to be staked on every fix is a look at a few cells however
+many thousand there are.  Staked points are taken out of the index.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# horizontal distance in metres that counts as on target
+TOLERANCE = 0.02
+
+# elevation is NaN when the file doesn't give one
+DesignPoint = namedtuple('DesignPoint', ['name', 'northing', 'easting',
+                                         'elevation'])
+
+# the nearest point still to be staked, from the current position.
+# northing and easting are how far north and east it is, distance and
+# bearing the same as a line, and cut how far above its elevation the
+# current position is (negative for fill), or None.  remaining counts
+# the points not staked yet.
+StakeoutStatus = namedtuple('StakeoutStatus', ['name', 'northing', 'easting',
+                                               'distance', 'bearing', 'cut',
+                                               'on_target', 'remaining',
+                                               'total'])
+
+# column names a CSV header may use
+_CSV_COLUMNS = {
+    'name': ('name', 'point', 'pt', 'p', 'id', 'number', 'no'),
+    'northing': ('northing', 'north', 'n', 'y'),
+    'easting': ('easting', 'east', 'e', 'x'),
+    'elevation': ('elevation', 'elev', 'z', 'height', 'h', 'up'),
+}
+
+
+def _number(text):
+    try:
+        return float(text)
+    except (TypeError, ValueError):
+        return None
+
+
+def read_csv(path):
+    """
+    Design points from a CSV file: either with a header naming the
+    columns, or point, northing, easting and optionally elevation
+    (PNEZD) in that order.
+    """
+    points = []
+    with open(path, newline='') as f:
+        sample = f.read(4096)
+        f.seek(0)
+        try:
+            dialect = csv.Sniffer().sniff(sample, delimiters=',;\t ')
+        except csv.Error:
+            dialect = csv.excel
+        rows = csv.reader(f, dialect)
+
+        columns = None
+        for row in rows:
+            row = [field.strip() for field in row]
+            if not any(row):
+                continue
+            if columns is None:
+                columns = _csv_columns(row)
+                if columns.get('header'):
+                    continue
+            if len(row) <= max(columns['northing'], columns['easting']):
+                continue
+            northing = _number(row[columns['northing']])
+            easting = _number(row[columns['easting']])
+            if northing is None or easting is None:
+                continue
+            name = row[columns['name']] if columns['name'] is not None \
+                   else 'Point %d' % (len(points) + 1)
+            elevation = None
+            if columns['elevation'] is not None and \
+               len(row) > columns['elevation']:
+                elevation = _number(row[columns['elevation']])
+            points.append(DesignPoint(name, northing, easting,
+                                      numpy.nan if elevation is None
+                                      else elevation))
+    return points
+
+
+def _csv_columns(row):
+    """
+    Which column is which, from the first row.
+    """
+    lower = [field.lower() for field in row]
+    found = {}
+    for (column, names) in _CSV_COLUMNS.items():
+        for (i, field) in enumerate(lower):
+            if field in names:
+                found[column] = i
+                break
+    if 'northing' in found and 'easting' in found:
+        found.setdefault('name', None)
+        found.setdefault('elevation', None)
+        found['header'] = True
+        return found
+
+    if len(row) == 2:
+        return {'name': None, 'northing': 0, 'easting': 1, 'elevation': None}
+    return {'name': 0, 'northing': 1, 'easting': 2,
+            'elevation': 3 if len(row) > 3 else None}
+
+
+def read_landxml(path):
+    """
+    Design points from the CgPoints in a LandXML file.
+    """
+    import xml.etree.ElementTree as ElementTree
+    points = []
+    for (event, element) in ElementTree.iterparse(path):
+        if element.tag.rpartition('}')[2] != 'CgPoint':
+            continue
+        # "northing easting [elevation]"; points that only refer to
+        # another have no text
+        values = [_number(v) for v in (element.text or '').split()]
+        if len(values) >= 2 and None not in values:
+            name = element.get('name') or element.get('oID') or \
+                   'Point %d' % (len(points) + 1)
+            points.append(DesignPoint(name, values[0], values[1],
+                                      values[2] if len(values) > 2
+                                      else numpy.nan))
+        element.clear()
+    return points
+
+
+def read_dxf(path):
+    """
+    Design points from the POINT entities in an ASCII DXF file, which
+    have x as easting and y as northing.  They're named in order, as
+    DXF points have no names.
+    """
+    points = []
+    entity = None
+    values = {}
+
+    def finish():
+        if entity == 'POINT' and '10' in values and '20' in values:
+            points.append(DesignPoint('Point %d' % (len(points) + 1),
+                                      values['20'], values['10'],
+                                      values.get('30', numpy.nan)))
+
+    with open(path, errors='replace') as f:
+        while True:
+            code = f.readline()
+            value = f.readline()
+            if not value:
+                break
+            code = code.strip()
+            value = value.strip()
+            if code == '0':
+                finish()
+                entity = value
+                values = {}
+            elif entity == 'POINT' and code in ('10', '20', '30'):
+                values[code] = float(value)
+    finish()
+    return points
+
+
+READERS = {
+    '.csv': read_csv,
+    '.txt': read_csv,
+    '.xml': read_landxml,
+    '.landxml': read_landxml,
+    '.dxf': read_dxf,
+}
+
+
+def read_design(path):
+    """
+    Design points from a file, by its extension.  Raises ValueError if
+    it isn't a known kind or has no points.
+    """
+    reader = READERS.get(os.path.splitext(path)[1].lower())
+    if reader is None:
+        raise ValueError('not a CSV, LandXML or DXF file: %s' % path)
+    points = reader(path)
+    if not points:
+        raise ValueError('no design points in %s' % path)
+    return points
+
+
+class Stakeout(object):
+    """
+    Design points on the Start grid and which of them have been staked.
+    """
+
+    def __init__(self, points, tolerance=TOLERANCE, name=None):
+        self.name = name
+        self.tolerance = tolerance
+        self.names = [point.name for point in points]
+        self.northing = numpy.array([point.northing for point in points])
+        self.easting = numpy.array([point.easting for point in points])
+        self.elevation = numpy.array([point.elevation for point in points],
+                                     dtype=float)
+        self.staked = numpy.zeros(len(points), dtype=bool)
+        self.target = None   # index of the nearest point not staked
+
+        self.index = pointstore.GridIndex(self._cell_size())
+        for i in range(len(points)):
+            self.index.insert(i, self.northing[i], self.easting[i])
+
+    def __len__(self):
+        return len(self.names)
+
+    @property
+    def remaining(self):
+        return len(self.index)
+
+    def _cell_size(self):
+        # about a couple of points a cell, if they're spread evenly
+        if len(self.names) < 2:
+            return pointstore.CELL_SIZE
+        area = (numpy.ptp(self.northing) or 1.0) * \
+               (numpy.ptp(self.easting) or 1.0)
+        return max(0.5, math.sqrt(2 * area / len(self.names)))
+
+    def update(self, northing, easting, elevation=None):
+        """
+        StakeoutStatus for the nearest point still to be staked from a
+        position on the Start grid, elevation being above Start.  None
+        once they're all staked.
+        """
+        found = self.index.nearest(northing, easting)
+        if found is None:
+            self.target = None
+            return None
+
+        (distance, i) = found
+        self.target = i
+        dn = float(self.northing[i]) - northing
+        de = float(self.easting[i]) - easting
+        bearing = (450 - math.degrees(math.atan2(dn, de))) % 360
+        cut = None
+        design = self.elevation[i]
+        if elevation is not None and design == design:
+            cut = elevation - float(design)
+        return StakeoutStatus(self.names[i], dn, de, distance, bearing, cut,
+                              distance <= self.tolerance, len(self.index),
+                              len(self.names))
+
+    def stake(self, i=None):
+        """
+        Mark a point, the current target by default, as staked.  Returns
+        its index, or None if there was nothing to stake.
+        """
+        if i is None:
+            i = self.target
+        if i is None or self.staked[i]:
+            return None
+        self.staked[i] = True
+        self.index.remove(i)
+        if i == self.target:
+            self.target = None
+        return i
+
+
+if __name__ == "__main__":
+    # nearest-target time with a large pad grid, as points are staked
+    import time
+    import random
+
+    rnd = random.Random(1)
+    points = [DesignPoint('P%d' % (row * 200 + col), row * 0.5, col * 0.5,
+                          0.0) for row in range(250) for col in range(200)]
+    t = time.perf_counter()
+    stakeout = Stakeout(points)
+    print('indexed %d points in %.0f ms' % (len(stakeout),
+                                           (time.perf_counter() - t) * 1000))
+
+    # down to the last point, which the index has to find from anywhere
+    for remaining in (50000, 25000, 500, 10, 1):
+        left = list(stakeout.index._points)
+        rnd.shuffle(left)
+        for i in left[remaining:]:
+            stakeout.stake(i)
+        queries = [(rnd.uniform(-10, 135), rnd.uniform(-10, 110))
+                   for x in range(5000)]
+        times = []
+        for (n, e) in queries:
+            t = time.perf_counter()
+            status = stakeout.update(n, e, 0.1)
+            times.append(time.perf_counter() - t)
+        # the same answer as looking at every point left
+        (n, e) = queries[-1]
+        left = ~stakeout.staked
+        nearest = numpy.hypot(stakeout.northing[left] - n,
+                              stakeout.easting[left] - e).min()
+        assert abs(status.distance - nearest) < 1e-9
+        print('%5d left: %.1f us a fix, at worst %.0f us' % (
+              stakeout.remaining, sum(times) / len(times) * 1e6,
+              max(times) * 1e6))
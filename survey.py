@@ -0,0 +1,316 @@
+from __future__ import division, print_function
+import math
+import numpy
+
+"""
+Survey maths for Simple Survey
+
+Relative measurements between reference points and the current position
+on the local grid, kept apart from the widgets so they can be
+benchmarked and reused.  measure() works on a single reference;
+ReferenceSet measures against any number of them at once with numpy
+(or with measure() one at a time when there are only a few, which is
+quicker), and measure_many() measures any number of positions from one
+reference.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# ReferenceSet measures this many points or fewer one at a time, which
+# is quicker than the numpy overhead
+SMALL_SET = 6
+
+
+class Measurement(object):
+    """
+    Current position relative to a reference point.  Offsets are in
+    metres, bearing in degrees clockwise from north.  elevation and the
+    slopes are None when there's no altitude to work with.
+    """
+    __slots__ = ('northing', 'easting', 'distance', 'bearing', 'elevation',
+                 'slope', 'slope_angle')
+
+    def __init__(self, northing, easting, distance, bearing, elevation=None,
+                 slope=None, slope_angle=None):
+        self.northing = northing
+        self.easting = easting
+        self.distance = distance
+        self.bearing = bearing
+        self.elevation = elevation
+        self.slope = slope
+        self.slope_angle = slope_angle
+
+
+def measure(reference, reference_altitude, northing, easting, altitude):
+    """
+    Measure from reference, a (northing, easting) tuple, to the given
+    position.
+    """
+    deltan = northing - reference[0]
+    deltae = easting - reference[1]
+
+    bearing = (450 - math.degrees(math.atan2(deltan, deltae))) % 360
+    distance = math.sqrt(deltan * deltan + deltae * deltae)
+
+    result = Measurement(deltan, deltae, distance, bearing)
+
+    if altitude and reference_altitude:
+        result.elevation = altitude - reference_altitude
+        if distance > 0:
+            result.slope = result.elevation / distance
+            result.slope_angle = math.degrees(math.atan(result.slope))
+
+    return result
+
+
+class Measurements(object):
+    """
+    Current position relative to every point in a ReferenceSet, as
+    parallel numpy arrays, or tuples for a few points.  Missing values
+    are NaN.
+    """
+    __slots__ = ('names', 'northing', 'easting', 'distance', 'bearing',
+                 'elevation', 'slope', 'slope_angle')
+
+    def __init__(self, names, northing, easting, distance, bearing,
+                 elevation, slope, slope_angle):
+        self.names = names
+        self.northing = northing
+        self.easting = easting
+        self.distance = distance
+        self.bearing = bearing
+        self.elevation = elevation
+        self.slope = slope
+        self.slope_angle = slope_angle
+
+    def __len__(self):
+        return len(self.names)
+
+    def row(self, i):
+        """
+        Measurement to reference number i.
+        """
+        def value(array):
+            v = float(array[i])
+            return None if v != v else v
+
+        return Measurement(float(self.northing[i]), float(self.easting[i]),
+                           float(self.distance[i]), float(self.bearing[i]),
+                           value(self.elevation), value(self.slope),
+                           value(self.slope_angle))
+
+
+def _measurements(names, deltan, deltae, elevation):
+    distance = numpy.hypot(deltan, deltae)
+    bearing = (450 - numpy.degrees(numpy.arctan2(deltan, deltae))) % 360
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slope = numpy.where(distance > 0, elevation / distance, numpy.nan)
+    slope_angle = numpy.degrees(numpy.arctan(slope))
+
+    return Measurements(names, deltan, deltae, distance, bearing,
+                        elevation, slope, slope_angle)
+
+
+def _nan(value):
+    return numpy.nan if value is None else value
+
+
+def measure_many(names, reference, reference_altitude, northing, easting,
+                 altitude):
+    """
+    Measure from reference, a (northing, easting) tuple, to each of the
+    named positions in the northing, easting and altitude arrays.
+    Altitudes may be NaN.
+    """
+    deltan = numpy.asarray(northing) - reference[0]
+    deltae = numpy.asarray(easting) - reference[1]
+    if reference_altitude is None:
+        reference_altitude = numpy.nan
+    elevation = numpy.asarray(altitude, dtype=float) - reference_altitude
+    return _measurements(names, deltan, deltae, elevation)
+
+
+class ReferenceSet(object):
+    """
+    Any number of named reference points on the local grid, stored as
+    numpy arrays so measuring against all of them is one vectorised pass.
+    Altitudes can be NaN until one is known.
+
+    names is replaced rather than changed in place, so Measurements
+    handed to another thread keep the names they were measured with.
+    """
+
+    def __init__(self):
+        self.names = []
+        self.northing = numpy.empty(0)
+        self.easting = numpy.empty(0)
+        self.altitude = numpy.empty(0)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def index(self, name):
+        return self.names.index(name)
+
+    def clear(self):
+        self.__init__()
+
+    def add(self, name, northing, easting, altitude=None):
+        """
+        Add a reference point, replacing any existing one with the same
+        name.  Returns its row number.
+        """
+        if altitude is None:
+            altitude = numpy.nan
+        if name in self.names:
+            i = self.names.index(name)
+            self.northing[i] = northing
+            self.easting[i] = easting
+            self.altitude[i] = altitude
+            return i
+
+        self.names = self.names + [name]
+        self.northing = numpy.append(self.northing, northing)
+        self.easting = numpy.append(self.easting, easting)
+        self.altitude = numpy.append(self.altitude, altitude)
+        return len(self.names) - 1
+
+    def remove(self, name):
+        i = self.names.index(name)
+        self.names = self.names[:i] + self.names[i + 1:]
+        self.northing = numpy.delete(self.northing, i)
+        self.easting = numpy.delete(self.easting, i)
+        self.altitude = numpy.delete(self.altitude, i)
+
+    def fill_altitude(self, altitude):
+        """
+        Give any reference without an altitude this one.
+        """
+        if altitude:
+            numpy.copyto(self.altitude, altitude,
+                         where=numpy.isnan(self.altitude))
+
+    def measure(self, northing, easting, altitude):
+        """
+        Measure from every reference to the given position.
+        """
+        if 0 < len(self.names) <= SMALL_SET:
+            return self._measure_each(northing, easting, altitude)
+        deltan = northing - self.northing
+        deltae = easting - self.easting
+        if altitude:
+            elevation = altitude - self.altitude
+        else:
+            elevation = numpy.full(len(self.names), numpy.nan)
+        return _measurements(self.names, deltan, deltae, elevation)
+
+    def _measure_each(self, northing, easting, altitude):
+        rows = []
+        for (n, e, h) in zip(self.northing.tolist(), self.easting.tolist(),
+                             self.altitude.tolist()):
+            m = measure((n, e), None if h != h else h, northing, easting,
+                        altitude)
+            rows.append((m.northing, m.easting, m.distance, m.bearing,
+                         _nan(m.elevation), _nan(m.slope),
+                         _nan(m.slope_angle)))
+        # a tuple of each field
+        return Measurements(self.names, *zip(*rows))
+
+
+class Occupation(object):
+    """
+    Averages fixes taken at one point.  Keeps a running mean and
+    variance of northing, easting and up with Welford's method, so
+    nothing but the sums is stored no matter how long it runs.  Fixes
+    without an up still count towards the horizontal average; heights
+    counts the ones with.
+
+    The occupation is done after epochs fixes or seconds of time,
+    whichever comes first, or as soon as the horizontal standard error
+    of the mean is down to sigma metres.  Any of them can be None.
+    """
+
+    # don't trust the precision estimate on fewer epochs than this
+    MIN_EPOCHS = 5
+
+    def __init__(self, epochs=None, seconds=None, sigma=None):
+        self.epochs = epochs
+        self.seconds = seconds
+        self.sigma = sigma
+
+        self.count = 0
+        self.heights = 0
+        self.started = None
+        self.last = None
+        self._mean = [0.0, 0.0, 0.0]
+        self._m2 = [0.0, 0.0, 0.0]
+
+    def add(self, northing, easting, up, timestamp=None):
+        if self.count == 0:
+            self.started = timestamp
+        self.last = timestamp
+        self.count += 1
+        self._add(0, northing, self.count)
+        self._add(1, easting, self.count)
+        if up is not None:
+            self.heights += 1
+            self._add(2, up, self.heights)
+
+    def _add(self, i, x, count):
+        delta = x - self._mean[i]
+        self._mean[i] += delta / count
+        self._m2[i] += delta * (x - self._mean[i])
+
+    @property
+    def mean(self):
+        """
+        (northing, easting, up), up being None if no fix had one
+        """
+        (northing, easting, up) = self._mean
+        return (northing, easting, up if self.heights else None)
+
+    @property
+    def variance(self):
+        return tuple(m2 / (count - 1) if count >= 2 else 0.0
+                     for (m2, count) in zip(self._m2, (self.count, self.count,
+                                                       self.heights)))
+
+    @property
+    def std(self):
+        return tuple(math.sqrt(v) for v in self.variance)
+
+    @property
+    def precision(self):
+        """
+        Horizontal standard error of the mean in metres, or None until
+        there are enough epochs to say.
+        """
+        if self.count < 2:
+            return None
+        (vn, ve, _) = self.variance
+        return math.sqrt((vn + ve) / self.count)
+
+    @property
+    def elapsed(self):
+        if self.started is None or self.last is None:
+            return 0.0
+        return self.last - self.started
+
+    @property
+    def done(self):
+        if not self.count:
+            return False
+        if self.epochs and self.count >= self.epochs:
+            return True
+        if self.seconds and self.elapsed >= self.seconds:
+            return True
+        if self.sigma and self.count >= self.MIN_EPOCHS and \
+           self.precision <= self.sigma:
+            return True
+        return False
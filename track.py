@@ -0,0 +1,353 @@
+from __future__ import division, print_function
+import math
+import calendar
+
+import numpy
+
+import projection
+
+"""
+Track history for Simple Survey
+
+Track keeps every fix that drives the display, projected onto a local
+grid centred on the first one, in column arrays rather than a Python
+object per fix: 21 bytes a fix, so a whole day at 20 Hz is about 36 MB.
+Once max_bytes is used up the oldest fixes are overwritten.
+
+Alongside the full-rate history it keeps thinned copies for drawing and
+exporting, with only the fixes needed to follow the path to within
+about 5 cm, 50 cm and 5 m: a plan view picks the one that's finer than
+a pixel at its zoom.  Each fix is thinned as it arrives, in constant
+time, and each coarser level only looks at what the finer one kept.
+
+Northing and easting are float32, good to a couple of millimetres out
+to 20 km from the first fix, which is finer than any receiver.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+# default memory for a track's full-rate history, in bytes
+TRACK_MEMORY = 40 * 1024 * 1024
+
+# how far the thinned track may stray from the fixes it leaves out, in
+# metres, at each level of detail
+THIN_TOLERANCE = 0.05
+THIN_LEVELS = (THIN_TOLERANCE, 0.5, 5.0)
+
+# the thinned tracks are given this share of the memory
+THIN_SHARE = 8
+
+# rows allocated at first; the arrays double from there up to capacity
+INITIAL_ROWS = 4096
+
+# time is UTC seconds since 1970, or since midnight if the receiver
+# hasn't sent a date; quality is -1 when unknown
+COLUMNS = (('time', numpy.float64),
+           ('northing', numpy.float32),
+           ('easting', numpy.float32),
+           ('altitude', numpy.float32),
+           ('quality', numpy.int8))
+
+ROW_BYTES = sum(numpy.dtype(dtype).itemsize for (name, dtype) in COLUMNS)
+_COLUMN_INDEX = dict((name, i) for (i, (name, dtype)) in enumerate(COLUMNS))
+
+
+def timestamp(fix):
+    """
+    A fix's time as UTC seconds since 1970, or since midnight without a
+    date (or with one that isn't a day), or NaN.
+    """
+    if fix.time is None:
+        return numpy.nan
+    if fix.date is None:
+        return fix.time
+    try:
+        return calendar.timegm(fix.date + (0, 0, 0)) + fix.time
+    except ValueError:
+        return fix.time
+
+
+class Ring(object):
+    """
+    The COLUMNS for up to capacity rows, oldest first.  When it's full
+    each new row overwrites the oldest.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = max(1, int(capacity))
+        self.clear()
+
+    def clear(self):
+        rows = min(self.capacity, INITIAL_ROWS)
+        self._arrays = [numpy.empty(rows, dtype) for (name, dtype) in COLUMNS]
+        self._size = 0
+        self._start = 0   # row of the oldest
+        self.total = 0    # rows ever appended
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def dropped(self):
+        """
+        Rows overwritten so far.
+        """
+        return self.total - self._size
+
+    @property
+    def nbytes(self):
+        return sum(array.nbytes for array in self._arrays)
+
+    def _grow(self):
+        rows = min(self.capacity, 2 * len(self._arrays[0]))
+        for (i, array) in enumerate(self._arrays):
+            grown = numpy.empty(rows, array.dtype)
+            grown[:self._size] = array[:self._size]
+            self._arrays[i] = grown
+
+    def append(self, row):
+        """
+        Add a row, a tuple in COLUMNS order.
+        """
+        if self._size < self.capacity:
+            if self._size == len(self._arrays[0]):
+                self._grow()
+            i = self._size
+            self._size += 1
+        else:
+            i = self._start
+            self._start = (i + 1) % self.capacity
+        for (array, value) in zip(self._arrays, row):
+            array[i] = value
+        self.total += 1
+
+    def last(self):
+        """
+        The newest row, or None.
+        """
+        if not self._size:
+            return None
+        i = (self._start + self._size - 1) % len(self._arrays[0])
+        return tuple(array[i].item() for array in self._arrays)
+
+    def column(self, name):
+        """
+        A copy of one column, oldest first.
+        """
+        return self.tail(self._size, name)
+
+    def tail(self, count, name):
+        """
+        A copy of the newest count rows of one column, oldest first.
+        """
+        count = min(count, self._size)
+        array = self._arrays[_COLUMN_INDEX[name]]
+        end = (self._start + self._size) % len(array) or len(array)
+        if count <= end:
+            return array[end - count:end].copy()
+        # wrapped round the end of the arrays
+        return numpy.concatenate((array[len(array) - (count - end):],
+                                  array[:end]))
+
+    def rows(self, start, stop):
+        """
+        Copies of every column for rows start to stop, numbered from the
+        first row ever appended, as (first, arrays).  Rows that have been
+        overwritten are left out, so first may be after start.
+        """
+        oldest = self.total - self._size
+        start = max(start, oldest)
+        stop = max(start, min(stop, self.total))
+        rows = (self._start + numpy.arange(start - oldest, stop - oldest)) \
+               % len(self._arrays[0])
+        return (start, [array[rows] for array in self._arrays])
+
+
+class Thinner(object):
+    """
+    Picks out the fixes needed to follow a path to within about
+    tolerance and appends them to a Ring, one fix at a time.
+
+    It fits a "sleeve" from the last kept fix: every fix more than
+    tolerance away narrows the range of directions a straight line could
+    leave in and still pass within tolerance of it.  When a fix falls
+    outside that range, or the path turns back towards the start, the
+    one before it is kept and becomes the new start.  Unlike
+    Douglas-Peucker nothing is looked at twice.
+    """
+
+    def __init__(self, ring, tolerance=THIN_TOLERANCE, coarser=None):
+        self.ring = ring
+        self.tolerance = tolerance
+        self.coarser = coarser   # another Thinner given what this keeps
+        self.clear()
+
+    def clear(self):
+        self._anchor = None    # last kept (northing, easting)
+        self._previous = None  # last row seen, not kept yet
+        self._centre = None    # direction the sleeve is measured from
+        self._low = self._high = 0.0
+        self._reach = 0.0      # furthest any fix has got from the anchor
+
+    def add(self, row):
+        northing = row[1]
+        easting = row[2]
+        if self._anchor is None:
+            self._keep(row)
+            return
+
+        dn = northing - self._anchor[0]
+        de = easting - self._anchor[1]
+        distance = math.hypot(dn, de)
+        if distance < self._reach - self.tolerance / 2:
+            # turned back, past the end of the line
+            self._keep(self._previous)
+            self.add(row)
+            return
+        self._reach = max(self._reach, distance)
+        if distance > self.tolerance:
+            direction = math.atan2(dn, de)
+            width = math.asin(self.tolerance / distance)
+            if self._centre is None:
+                self._centre = direction
+                (self._low, self._high) = (-width, width)
+            else:
+                offset = (direction - self._centre + math.pi) % \
+                         (2 * math.pi) - math.pi
+                if self._low <= offset <= self._high:
+                    self._low = max(self._low, offset - width)
+                    self._high = min(self._high, offset + width)
+                else:
+                    # this fix can't be reached by a line that passes
+                    # the ones before it, so keep the last of those
+                    self._keep(self._previous)
+                    self.add(row)
+                    return
+        self._previous = row
+
+    def _keep(self, row):
+        self.ring.append(row)
+        if self.coarser:
+            self.coarser.add(row)
+        self._anchor = (row[1], row[2])
+        self._previous = None
+        self._centre = None
+        self._reach = 0.0
+
+    def pending(self):
+        """
+        The latest row if it hasn't been kept, to finish the line with.
+        """
+        return self._previous
+
+
+class Track(object):
+    """
+    Every fix added, up to max_bytes of them, and a thinned copy at each
+    of tolerances, finest first, in levels.  thinned is the finest.
+    projector is the grid northing and easting are on, centred on the
+    first fix, or None until there is one.  position is the latest
+    (northing, easting).
+    """
+
+    def __init__(self, max_bytes=TRACK_MEMORY, tolerances=THIN_LEVELS):
+        capacity = max_bytes // ROW_BYTES
+        self.fixes = Ring(capacity - capacity // THIN_SHARE)
+        self.tolerances = tuple(tolerances)
+        self.levels = [Ring(capacity // THIN_SHARE // len(self.tolerances))
+                       for tolerance in self.tolerances]
+        self.thinned = self.levels[0]
+        thinner = None
+        for (ring, tolerance) in reversed(list(zip(self.levels,
+                                                   self.tolerances))):
+            thinner = Thinner(ring, tolerance, thinner)
+        self._thinner = thinner
+        self.projector = None
+        self.position = None
+
+    def __len__(self):
+        return len(self.fixes)
+
+    def clear(self):
+        self.fixes.clear()
+        thinner = self._thinner
+        while thinner:
+            thinner.ring.clear()
+            thinner.clear()
+            thinner = thinner.coarser
+        self.projector = None
+        self.position = None
+
+    @property
+    def nbytes(self):
+        return self.fixes.nbytes + sum(ring.nbytes for ring in self.levels)
+
+    def add(self, fix, altitude=None):
+        """
+        Add a fix.  altitude, if given, is used in place of the fix's own,
+        as the engine carries the last known altitude forward.
+        """
+        if self.projector is None:
+            self.projector = projection.LocalProjector(fix.latitude,
+                                                       fix.longitude)
+        (northing, easting, _) = self.projector.forward(fix.latitude,
+                                                        fix.longitude)
+        if altitude is None:
+            altitude = fix.altitude
+        row = (timestamp(fix), northing, easting,
+               numpy.nan if altitude is None else altitude,
+               -1 if fix.quality is None else fix.quality)
+        self.fixes.append(row)
+        self._thinner.add(row)
+        self.position = (northing, easting)
+
+    def lite(self, name):
+        """
+        One column of the thinned track, oldest first, ending with the
+        latest fix.
+        """
+        column = self.thinned.column(name)
+        pending = self._thinner.pending()
+        if pending is None:
+            return column
+        return numpy.append(column, numpy.array([pending[_COLUMN_INDEX[name]]],
+                                                column.dtype))
+
+
+if __name__ == "__main__":
+    # a day at 20 Hz walking a random course, to check the memory and the
+    # cost per fix
+    import sys
+    import time
+    import random
+    import nmea
+
+    rate = 20
+    hours = float(sys.argv[1]) if len(sys.argv) > 1 else 24
+    count = int(hours * 3600 * rate)
+    rnd = random.Random(1)
+    track = Track()
+    (lat, lon, heading) = (40.0, -111.0, 0.0)
+    degrees = 1 / 111320
+    t0 = time.perf_counter()
+    for i in range(count):
+        # about 1 m/s with the odd turn, and a little noise
+        if rnd.random() < 0.01:
+            heading += rnd.uniform(-90, 90)
+        lat += math.cos(math.radians(heading)) * degrees / rate
+        lon += math.sin(math.radians(heading)) * degrees / rate / 0.766
+        fix = nmea.Fix(i / rate, None, lat + rnd.gauss(0, 0.005 * degrees),
+                       lon + rnd.gauss(0, 0.005 * degrees), 1400.0,
+                       quality=4)
+        track.add(fix)
+    elapsed = time.perf_counter() - t0
+
+    print('%d fixes (%.1f h at %d Hz) in %.1f s, %.1f us a fix' % (
+          count, hours, rate, elapsed, elapsed / count * 1e6))
+    print('kept %d of them (%d overwritten), thinned to %s: %.1f MB' % (
+          len(track.fixes), track.fixes.dropped,
+          ', '.join(str(len(ring)) for ring in track.levels),
+          track.nbytes / 1024 / 1024))
@@ -0,0 +1,190 @@
+from __future__ import division, print_function
+from collections import OrderedDict
+
+"""
+Unit formatters for Simple Survey
+
+Each unit system is a formatter object with everything worked out ahead
+of time, so formatting a value on the hot path is a multiply, a divmod
+or two and a table lookup.  SimpleSurveyGui picks one formatter when the
+units are changed rather than checking for every field.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+INCHES_PER_METRE = 1 / 0.0254
+US_SURVEY_FEET_PER_METRE = 3937 / 1200
+
+
+class MetresFormatter(object):
+    name = 'metres'
+    label = 'Metres'
+
+    def length(self, metres):
+        return '%.3f m' % metres
+
+    def height(self, metres):
+        return '%.2f m' % metres
+
+    def area(self, square_metres):
+        return '%.2f m\u00b2' % square_metres
+
+    def volume(self, cubic_metres):
+        return '%.2f m\u00b3' % cubic_metres
+
+
+class FeetInchFormatter(object):
+    """
+    Feet, inches and sixteenths, ie. 12' 3_5/16".  The inches and reduced
+    fraction for every one of the 192 sixteenths in a foot are built into
+    a table up front.  Areas are in square feet and volumes in cubic
+    yards, as earthwork is.
+    """
+    name = 'feet'
+    label = 'Feet and inches'
+
+    def __init__(self, inches_per_metre=INCHES_PER_METRE):
+        self._sixteenths = inches_per_metre * 16
+        self._feet = inches_per_metre / 12
+
+        fractions = ['']
+        for sixteenth in range(1, 16):
+            denominator = 16
+            while sixteenth % 2 == 0:
+                sixteenth //= 2
+                denominator //= 2
+            fractions.append('%d/%d' % (sixteenth, denominator))
+
+        self._inches = []
+        for inches in range(12):
+            inches = '%d_' % inches if inches else ''
+            for fraction in fractions:
+                self._inches.append('%s%s"' % (inches, fraction))
+
+    def length(self, metres):
+        if metres < 0:
+            sign = '-'
+            metres = -metres
+        else: sign = ''
+
+        # the tiny bit added keeps exact values like 1" from rounding
+        # down to 15/16"
+        (feet, sixteenths) = divmod(int(metres * self._sixteenths + 1e-9), 192)
+        if feet:
+            return "%s%d' %s" % (sign, feet, self._inches[sixteenths])
+        return sign + self._inches[sixteenths]
+
+    height = length
+
+    def area(self, square_metres):
+        return '%.1f sq ft' % (square_metres * self._feet ** 2)
+
+    def volume(self, cubic_metres):
+        return '%.2f cu yd' % (cubic_metres * self._feet ** 3 / 27)
+
+
+class DecimalFeetFormatter(object):
+    name = 'decimal_feet'
+    label = 'Decimal feet'
+    suffix = 'ft'
+
+    def __init__(self, feet_per_metre=INCHES_PER_METRE / 12):
+        self._feet = feet_per_metre
+        self._length = '%.2f ' + self.suffix
+        self._height = '%.2f ' + self.suffix
+        self._area = '%.1f sq ' + self.suffix
+
+    def length(self, metres):
+        return self._length % (metres * self._feet)
+
+    def height(self, metres):
+        return self._height % (metres * self._feet)
+
+    def area(self, square_metres):
+        return self._area % (square_metres * self._feet ** 2)
+
+    def volume(self, cubic_metres):
+        return '%.2f cu yd' % (cubic_metres * self._feet ** 3 / 27)
+
+
+class UsSurveyFeetFormatter(DecimalFeetFormatter):
+    name = 'survey_feet'
+    label = 'US survey feet'
+    suffix = 'US ft'
+
+    def __init__(self):
+        super(UsSurveyFeetFormatter, self).__init__(US_SURVEY_FEET_PER_METRE)
+
+
+FORMATTERS = OrderedDict((f.name, f) for f in (
+    MetresFormatter(),
+    FeetInchFormatter(),
+    DecimalFeetFormatter(),
+    UsSurveyFeetFormatter(),
+))
+
+footinch = FORMATTERS['feet'].length
+
+
+def get(name):
+    """
+    Return the formatter registered under name, or metres if there
+    isn't one.
+    """
+    return FORMATTERS.get(name, FORMATTERS['metres'])
+
+
+if __name__ == "__main__":
+    # formatted values per second for each unit system, against the old
+    # footinch() that worked everything out on every call
+    import math
+    import random
+    import time
+
+    def old_footinch(metres):
+        if metres < 0:
+            sign = '-'
+            metres = -metres
+        else: sign = ''
+
+        feet = int(metres * 39.3701 / 12)
+        if feet:
+            feet = "%d' " % feet
+        else:
+            feet = ""
+
+        inches = int(metres * 39.3701) % 12
+        if inches:
+            inches = '%d_' % inches
+        else:
+            inches = ''
+
+        decimal = int((metres * 39.3701 - int(metres * 39.3701)) * 16)
+
+        if decimal:
+            gcd = math.gcd(decimal, 16)
+            frac = "%d/%d" % (decimal / gcd, 16/ gcd)
+        else:
+            frac = ''
+
+        return '%s%s%s%s"' % (sign,feet, inches, frac)
+
+    random.seed(1)
+    values = [random.uniform(-100, 100) for x in range(100000)]
+
+    t = time.perf_counter()
+    for value in values:
+        old_footinch(value)
+    elapsed = time.perf_counter() - t
+    print('%-16s %9.0f values/s' % ('old footinch', len(values) / elapsed))
+
+    for formatter in FORMATTERS.values():
+        length = formatter.length
+        t = time.perf_counter()
+        for value in values:
+            length(value)
+        elapsed = time.perf_counter() - t
+        print('%-16s %9.0f values/s' % (formatter.name, len(values) / elapsed))
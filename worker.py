@@ -0,0 +1,583 @@
+from __future__ import division, print_function
+import os
+import math
+import time
+import sqlite3
+import threading
+from collections import namedtuple, OrderedDict
+
+import nmea
+import engine
+import sources
+import recorder
+import ntrip
+import broadcast
+import track
+import stakeout
+import tin
+import export
+
+"""
+Survey worker thread for Simple Survey
+
+SurveyWorker owns the position sources (serial ports, TCP sockets, log
+replays or the system source), their NMEA parsers and a SurveyEngine,
+and lives in its own QThread.  Every fix is parsed and computed there,
+so modal dialogs or a slow repaint in the GUI never hold up the data
+path.  Several receivers can be attached at once, each read as its data
+arrives and named on the fixes it produces.  Live sources can also be
+recorded with a recorder.RawRecorder, an ntrip.NtripClient can relay
+corrections into the first serial receiver, a broadcast.Broadcaster
+can send every result to other devices, and design points read from a
+file can be staked out.  The engine keeps cut and fill of the points set
+against a design plane the GUI chooses.  Points and the track are
+exported a chunk at a time between fixes, so a long track neither holds
+up the data path nor needs copying first.
+
+Results go back to the GUI through a LatestQueue: a single slot the
+worker overwrites with each new Snapshot and the GUI empties on its
+repaint timer.  The GUI only ever sees the latest state, however fast
+fixes come in, while points set in between are merged into the next
+snapshot rather than lost.
+
+The GUI drives the worker by emitting (name, args) commands, which Qt
+queues into the worker thread.
+
+Copyright 2018 Michael Torrie
+torriem@gmail.com
+
+Licensed under the GPLv3
+"""
+
+from qt5pick import QtCore, QtPositioning, QtSerialPort, Signal, Slot
+
+# a finished export's status stays in snapshots for this many seconds
+EXPORT_SHOWN = 10.0
+
+# where a log replay has got to
+ReplayStatus = namedtuple('ReplayStatus', ['elapsed', 'duration', 'speed',
+                                           'paused', 'finished'])
+
+
+class LatestQueue(object):
+    """
+    Bounded, latest-wins queue of one.  put() replaces anything not yet
+    taken, first passing the old and new items through merge if given.
+    replaced counts the items that were never taken.
+    """
+
+    def __init__(self, merge=None):
+        self._lock = threading.Lock()
+        self._item = None
+        self._merge = merge
+        self.replaced = 0
+
+    def put(self, item):
+        with self._lock:
+            if self._item is not None:
+                self.replaced += 1
+                if self._merge:
+                    item = self._merge(self._item, item)
+            self._item = item
+
+    def take(self):
+        """
+        Returns the latest item, or None if nothing new was put.
+        """
+        with self._lock:
+            item = self._item
+            self._item = None
+        return item
+
+
+class Channel(object):
+    """
+    One attached receiver: its source, the device under it, if any, and
+    its recorder while recording.
+    """
+    __slots__ = ('name', 'source', 'device', 'recorder')
+
+    def __init__(self, name, source, device=None):
+        self.name = name
+        self.source = source
+        self.device = device
+        self.recorder = None
+
+
+class SurveyWorker(QtCore.QObject):
+    """
+    Runs any number of sources and a SurveyEngine; move it to a QThread
+    with start_worker().  Snapshots are put in queue for the GUI to take;
+    anything else with a put() method will do, such as the headless
+    mode's output.
+    """
+
+    sourceError = Signal(str, str, bool)   # title, message, no sources left
+    recorderError = Signal(str)
+    stakeoutError = Signal(str)
+    exportError = Signal(str)
+    updateTimeout = Signal()
+
+    # commands the GUI may send
+    COMMANDS = ('open_system', 'open_log', 'open_tcp', 'open_serial',
+                'close_source', 'close_channel', 'set_primary', 'reset',
+                'set_start', 'set_mark', 'add_reference', 'begin_occupation',
+                'finish_occupation', 'replay_toggle_pause', 'replay_speed',
+                'replay_seek', 'replay_skip', 'set_recording', 'set_ntrip',
+                'set_broadcast', 'load_design', 'clear_design', 'stake',
+                'set_design_plane', 'start_export', 'cancel_export')
+
+    def __init__(self, parent=None, queue=None,
+                 track_memory=track.TRACK_MEMORY):
+        super(SurveyWorker, self).__init__(parent)
+        self.engine = engine.SurveyEngine(track_memory)
+        if queue is None:
+            queue = LatestQueue(engine.merge_snapshots)
+        self.queue = queue
+        self.channels = OrderedDict()   #name: Channel
+        self.recording = None   #RawRecorder arguments, if recording
+        self.ntrip = None   #NtripClient, if relaying corrections
+        self._ntrip_channel = None
+        self.broadcaster = None
+        self.exporter = None   #export.Export being written, or just done
+        self._export_timer = None
+        self._export_published = 0.0
+
+    @Slot(str, object)
+    def command(self, name, args):
+        if name not in self.COMMANDS:
+            raise ValueError('unknown command %s' % name)
+        getattr(self, name)(*args)
+
+    def _publish(self, snapshot=None):
+        if snapshot is None:
+            snapshot = self.engine.snapshot()
+        snapshot.replay = self._replay_status()
+        recording = [channel.recorder.status() for channel in
+                     self.channels.values() if channel.recorder]
+        if recording:
+            snapshot.recording = recording
+        connections = [(channel.name, channel.source.status()) for channel in
+                       self.channels.values()
+                       if isinstance(channel.source, sources.TcpSource)]
+        if connections:
+            snapshot.connections = connections
+        if self.ntrip:
+            snapshot.ntrip = self.ntrip.status()
+        if self.broadcaster:
+            self.broadcaster.publish(snapshot)
+            snapshot.broadcast = self.broadcaster.status()
+        if self.exporter:
+            if self.exporter.finished is not None and \
+               time.monotonic() - self.exporter.finished > EXPORT_SHOWN:
+                self.exporter = None
+            else:
+                snapshot.export = self.exporter.status()
+        self.queue.put(snapshot)
+
+    @Slot(object)
+    def fix_updated(self, fix):
+        if self.ntrip and fix.source == self._ntrip_channel:
+            self.ntrip.set_position(fix)
+        self._publish(self.engine.update(fix))
+
+    @Slot(QtPositioning.QGeoPositionInfo)
+    def position_updated(self, position_info, name=None):
+        """
+        Adapt a QGeoPositionInfo from one of the Qt position sources
+        to an nmea.Fix.
+        """
+        coordinate = position_info.coordinate()
+        fix = nmea.Fix(latitude = coordinate.latitude(),
+                       longitude = coordinate.longitude(),
+                       source = name)
+
+        if not math.isnan(coordinate.altitude()):
+            fix.altitude = coordinate.altitude()
+
+        if position_info.hasAttribute(position_info.Direction):
+            fix.heading = position_info.attribute(position_info.Direction)
+
+        if position_info.hasAttribute(position_info.GroundSpeed):
+            fix.speed = position_info.attribute(position_info.GroundSpeed)
+
+        self.fix_updated(fix)
+
+    # sources
+
+    def _start(self, name, source, device=None):
+        """
+        Attach a source as the named receiver, replacing any other
+        source by that name.
+        """
+        self.close_channel(name)
+        channel = Channel(name, source, device)
+        self.channels[name] = channel
+
+        if isinstance(source, sources.NmeaSource):
+            source.parser.source = name
+            source.fixUpdated.connect(self.fix_updated)
+        else:
+            source.positionUpdated.connect(
+                lambda info: self.position_updated(info, name))
+        source.updateTimeout.connect(self.updateTimeout)
+        source.startUpdates()
+        self._start_recorder(channel)
+        self._ntrip_target()
+        self._publish()
+
+    def open_system(self, attach=False):
+        if not attach:
+            self.close_source()
+        source = QtPositioning.QGeoPositionInfoSource.createDefaultSource(self)
+        if source:
+            self._start('system', source)
+
+    def open_log(self, filename, speed, attach=False):
+        if not attach:
+            self.close_source()
+        source = sources.ReplaySource(self)
+        # 0 means replay as fast as we can
+        source.speed = speed
+        try:
+            source.setFile(filename)
+        except EnvironmentError as e:
+            source.deleteLater()
+            self.sourceError.emit('Could not open log',
+                                  'Could not open %s: %s' % (filename, e),
+                                  not self.channels)
+            return
+        source.finished.connect(self._publish)
+        self._start(os.path.basename(filename), source)
+
+    def open_tcp(self, hostname, port, attach=False):
+        if not attach:
+            self.close_source()
+        # reconnects by itself, so errors are only shown as its status
+        source = sources.TcpSource(hostname, port, self)
+        source.connectionChanged.connect(self._publish)
+        self._start('%s:%d' % (hostname, port), source)
+
+    def open_serial(self, path, baud_rate, attach=False):
+        if not attach:
+            self.close_source()
+        device = QtSerialPort.QSerialPort(path, self)
+        device.setBaudRate(baud_rate, device.AllDirections)
+        device.setFlowControl(device.NoFlowControl)
+        # read-write so corrections can be sent back to the receiver
+        device.open(device.ReadWrite)
+
+        source = sources.NmeaDeviceSource(self)
+        source.setDevice(device)
+        self._start(os.path.basename(path), source, device)
+
+    def close_channel(self, name):
+        channel = self.channels.pop(name, None)
+        if not channel: return
+
+        self._stop_recorder(channel)
+        channel.source.stopUpdates()
+        if isinstance(channel.source, sources.ReplaySource):
+            channel.source.close()
+        channel.source.deleteLater()
+
+        if channel.device:
+            channel.device.close()
+            channel.device.deleteLater()
+        self.engine.remove_receiver(name)
+        if name == self._ntrip_channel:
+            self._ntrip_target()
+
+    @Slot()
+    def close_source(self):
+        """
+        Close every source, and give up on any export.
+        """
+        for name in list(self.channels):
+            self.close_channel(name)
+        self.cancel_export()
+
+    def set_primary(self, name):
+        self.engine.set_primary(name)
+        self._publish()
+
+    # recording
+
+    def set_recording(self, options):
+        """
+        Record live sources with a RawRecorder made with options, a dict
+        of its keyword arguments, or stop recording if options is None.
+        """
+        self.recording = options
+        for channel in self.channels.values():
+            self._start_recorder(channel)
+        self._publish()
+
+    def _start_recorder(self, channel):
+        self._stop_recorder(channel)
+        if not self.recording or \
+           not isinstance(channel.source, sources.NmeaDeviceSource):
+            return
+        # file names start with the receiver's name, minus anything
+        # that can't go in one
+        prefix = ''.join(c if c.isalnum() or c in '-_.' else '-'
+                         for c in channel.name)
+        try:
+            channel.recorder = recorder.RawRecorder(prefix=prefix,
+                                                    **self.recording)
+        except (EnvironmentError, ImportError, ValueError) as e:
+            self.recorderError.emit('Could not record the NMEA data: %s' % e)
+            return
+        channel.source.recorder = channel.recorder
+
+    def _stop_recorder(self, channel):
+        if channel.recorder:
+            channel.source.recorder = None
+            channel.recorder.close()
+            channel.recorder = None
+
+    # corrections
+
+    def set_ntrip(self, options):
+        """
+        Relay corrections with an NtripClient made with options, a dict
+        of its keyword arguments, or stop relaying if options is None.
+        """
+        if self.ntrip:
+            self.ntrip.stop()
+            self.ntrip.set_target(None)
+            self.ntrip.deleteLater()
+            self.ntrip = None
+            self._ntrip_channel = None
+        if options:
+            self.ntrip = ntrip.NtripClient(parent=self, **options)
+            self.ntrip.statusChanged.connect(self._publish)
+            self._ntrip_target()
+            self.ntrip.start()
+        self._publish()
+
+    def _ntrip_target(self):
+        # corrections go to the first serial receiver that's open
+        if not self.ntrip:
+            return
+        for channel in self.channels.values():
+            if isinstance(channel.device, QtSerialPort.QSerialPort) and \
+               channel.device.isOpen():
+                if channel.name != self._ntrip_channel:
+                    self._ntrip_channel = channel.name
+                    self.ntrip.set_target(channel.device)
+                return
+        self._ntrip_channel = None
+        self.ntrip.set_target(None)
+
+    # broadcasting
+
+    def set_broadcast(self, options):
+        """
+        Broadcast results with a Broadcaster made with options, a dict of
+        its keyword arguments, or stop if options is None.
+        """
+        if self.broadcaster:
+            self.broadcaster.close()
+            self.broadcaster.deleteLater()
+            self.broadcaster = None
+        if options:
+            self.broadcaster = broadcast.Broadcaster(parent=self, **options)
+        self._publish()
+
+    # survey
+
+    def reset(self, generation):
+        if self.exporter and self.exporter.what == 'track' and \
+           not self.exporter.done:
+            self.cancel_export()
+            self.exportError.emit('The track was cleared before it was '
+                                  'all exported.')
+        self.engine.reset(generation)
+        self._publish()
+
+    def set_start(self, lat=None, lon=None, altitude=None):
+        self.engine.set_start(lat, lon, altitude)
+        self._publish()
+
+    def set_mark(self, lat=None, lon=None, altitude=None):
+        self.engine.set_mark(lat, lon, altitude)
+        self._publish()
+
+    def add_reference(self, name):
+        self.engine.add_reference(name)
+        self._publish()
+
+    def load_design(self, path, tolerance=stakeout.TOLERANCE):
+        """
+        Stake out the design points in a file, read here so a big one
+        doesn't hold up the GUI.
+        """
+        try:
+            points = stakeout.read_design(path)
+        except (EnvironmentError, ValueError) as e:
+            self.stakeoutError.emit('Could not read the design points: %s' % e)
+            return
+        self.engine.set_stakeout(stakeout.Stakeout(points, tolerance,
+                                                   os.path.basename(path)))
+        self._publish()
+
+    def clear_design(self):
+        self.engine.set_stakeout(None)
+        self._publish()
+
+    def stake(self):
+        self.engine.stake()
+        self._publish()
+
+    def set_design_plane(self, elevation, slope=0.0, bearing=0.0):
+        self.engine.set_design_plane(tin.DesignPlane(elevation, slope,
+                                                     bearing))
+        self._publish()
+
+    def begin_occupation(self, target, epochs, seconds, sigma):
+        self.engine.begin_occupation(target, epochs, seconds, sigma)
+        self._publish()
+
+    def finish_occupation(self):
+        self.engine.finish_occupation()
+        self._publish()
+
+    # export
+
+    def start_export(self, what, path, options=None):
+        """
+        Export 'points' from the point store at options['points'], or
+        the 'track' as it is now, to path.  options may also give the
+        format and coordinates for export.Export, and for the track a
+        tolerance to export one of its thinned levels instead of every
+        fix.  It's written a chunk at a time with the event loop run in
+        between.
+        """
+        options = options or {}
+        self.cancel_export()
+        engine = self.engine
+        format = options.get('format')
+        coordinates = options.get('coordinates', export.LOCAL)
+        try:
+            if what == 'points':
+                job = export.export_points(path, options['points'], format,
+                                           coordinates, engine.projector,
+                                           engine.start_altitude)
+            else:
+                track = engine.track
+                if track.projector is None:
+                    raise ValueError('there is no track yet')
+                ring = track.fixes
+                if options.get('tolerance') is not None:
+                    ring = track.levels[track.tolerances.index(
+                                            options['tolerance'])]
+                job = export.export_track(path, ring, track.projector,
+                                          format, coordinates,
+                                          engine.projector,
+                                          engine.start_altitude)
+        except (EnvironmentError, ValueError, sqlite3.Error) as e:
+            self.exportError.emit('Could not export the %s: %s' % (what, e))
+            return
+
+        self.exporter = job
+        if self._export_timer is None:
+            self._export_timer = QtCore.QTimer(self)
+            self._export_timer.timeout.connect(self._export_step)
+        self._export_timer.start(0)
+        self._publish()
+
+    def _export_step(self):
+        job = self.exporter
+        if job is None or job.done:
+            self._export_timer.stop()
+            return
+        try:
+            done = job.step()
+        except (EnvironmentError, sqlite3.Error) as e:
+            self._export_timer.stop()
+            self.exporter = None
+            self.exportError.emit('Could not export to %s: %s' % (job.path,
+                                                                  e))
+            self._publish()
+            return
+
+        # fixes publish the progress too, so this is only for when
+        # there aren't any
+        now = time.monotonic()
+        if done:
+            self._export_timer.stop()
+        if done or now - self._export_published > 0.5:
+            self._export_published = now
+            self._publish()
+
+    def finish_export(self):
+        """
+        Write whatever is left of the export now.
+        """
+        while self.exporter and not self.exporter.done:
+            self._export_step()
+
+    def cancel_export(self):
+        if self.exporter:
+            self.exporter.cancel()
+            self.exporter = None
+        if self._export_timer:
+            self._export_timer.stop()
+
+    # replay
+
+    def _replay(self):
+        # the first log being replayed, if any
+        for channel in self.channels.values():
+            if isinstance(channel.source, sources.ReplaySource) and \
+               channel.source.replay:
+                return channel.source
+        return None
+
+    def _replay_status(self):
+        replay = self._replay()
+        if not replay:
+            return None
+        return ReplayStatus(replay.replay.elapsed, replay.replay.duration,
+                            replay.speed, replay.paused,
+                            replay.replay.at_end)
+
+    def replay_toggle_pause(self):
+        replay = self._replay()
+        if not replay: return
+        if replay.paused:
+            replay.resume()
+        else:
+            replay.pause()
+        self._publish()
+
+    def replay_speed(self, speed):
+        replay = self._replay()
+        if not replay: return
+        replay.speed = speed
+        self._publish()
+
+    def replay_seek(self, seconds):
+        replay = self._replay()
+        if not replay: return
+        replay.seek(seconds)
+        self._publish()
+
+    def replay_skip(self, seconds):
+        replay = self._replay()
+        if not replay: return
+        replay.seek_relative(seconds)
+        self._publish()
+
+
+def start_worker(parent=None, track_memory=track.TRACK_MEMORY):
+    """
+    Start a SurveyWorker in a new QThread.  Returns (thread, worker).
+    """
+    thread = QtCore.QThread(parent)
+    worker = SurveyWorker(track_memory=track_memory)
+    worker.moveToThread(thread)
+    thread.finished.connect(worker.deleteLater)
+    thread.start()
+    return (thread, worker)